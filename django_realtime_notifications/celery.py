@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import celeryd_init
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "django_realtime_notifications.settings")
 
@@ -14,8 +15,44 @@ app.conf.beat_schedule = {
         "task": "notifications.tasks.cleanup_old_notifications",
         "schedule": crontab(hour=2, minute=0),  # Run daily at 2 AM
     },
+    "archive-old-notifications": {
+        "task": "notifications.tasks.archive_old_notifications",
+        "schedule": crontab(hour=3, minute=0),  # Run daily at 3 AM
+    },
     "send-email-digests": {
         "task": "notifications.tasks.send_email_digest",
         "schedule": crontab(hour=8, minute=0),  # Run daily at 8 AM
     },
+    "compact-notification-stats": {
+        "task": "notifications.tasks.compact_notification_stats",
+        "schedule": crontab(),  # Run every minute
+    },
+    "sweep-offline-notifications": {
+        "task": "notifications.tasks.sweep_offline_notifications",
+        "schedule": crontab(),  # Run every minute
+    },
+    "reconcile-unread-counters": {
+        "task": "notifications.tasks.reconcile_unread_counters",
+        "schedule": crontab(minute="*/15"),  # Run every 15 minutes
+    },
 }
+
+
+@celeryd_init.connect
+def set_lane_concurrency(sender=None, conf=None, options=None, **kwargs):
+    """
+    Size workers started for notification lanes, e.g. with
+    -Q notifications.high, from NOTIFICATIONS_WORKER_CONCURRENCY unless
+    -c is given.
+    """
+    from django.conf import settings
+    from notifications.lanes import lane_concurrency
+
+    if options.get("concurrency"):
+        return
+    queues = options.get("queues") or []
+    if isinstance(queues, str):
+        queues = queues.split(",")
+    concurrency = lane_concurrency(queues, settings.NOTIFICATIONS_WORKER_CONCURRENCY)
+    if concurrency:
+        conf.worker_concurrency = concurrency
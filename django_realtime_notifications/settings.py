@@ -151,6 +151,7 @@ REST_FRAMEWORK = {
         "notifications_high": "100/hour",
         "notifications_medium": "50/hour",
         "notifications_low": "20/hour",
+        "notifications_service": "5000/minute",
     },
 }
 
@@ -174,6 +175,54 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Redis for presence tracking and per-user notification state
+# (database 1 to separate it from Celery)
+NOTIFICATIONS_REDIS_URL = os.getenv(
+    "NOTIFICATIONS_REDIS_URL", "redis://127.0.0.1:6379/1"
+)
+NOTIFICATIONS_REDIS_MAX_CONNECTIONS = int(
+    os.getenv("NOTIFICATIONS_REDIS_MAX_CONNECTIONS", "50")
+)
+# Seconds presence lookups for delivery decisions are cached in-process,
+# invalidated early by presence change events (0 disables the cache)
+PRESENCE_LOCAL_CACHE_TTL = float(os.getenv("PRESENCE_LOCAL_CACHE_TTL", "0"))
+
+# Users resolved by WebSocket handshakes are cached in-process, per access
+# token, for up to NOTIFICATIONS_USER_CACHE_TTL seconds (0 disables the
+# cache), and evicted early when the user is changed or deleted
+NOTIFICATIONS_USER_CACHE_SIZE = int(os.getenv("NOTIFICATIONS_USER_CACHE_SIZE", "10000"))
+NOTIFICATIONS_USER_CACHE_TTL = float(os.getenv("NOTIFICATIONS_USER_CACHE_TTL", "60"))
+
+# Seconds a notification queued for an offline user may stay pending before
+# it falls back to email (the span of the former 60/300/900s retries)
+NOTIFICATIONS_OFFLINE_EMAIL_DELAY = int(
+    os.getenv("NOTIFICATIONS_OFFLINE_EMAIL_DELAY", "1260")
+)
+
+# Days read and failed notifications stay in the notifications table
+# before archive_old_notifications moves them to the archive
+NOTIFICATIONS_HOT_WINDOW_DAYS = int(os.getenv("NOTIFICATIONS_HOT_WINDOW_DAYS", "30"))
+
+# Seconds batch mode (low priority) notifications are coalesced per user
+# before being delivered together
+NOTIFICATIONS_BATCH_WINDOW = int(os.getenv("NOTIFICATIONS_BATCH_WINDOW", "30"))
+
+# Usernames of high-volume service accounts rate limited against the
+# notifications_service rate from in-process leases of
+# NOTIFICATIONS_RATE_LIMIT_LEASE_SIZE requests, each used for at most
+# NOTIFICATIONS_RATE_LIMIT_LEASE_TTL seconds
+NOTIFICATIONS_LEASED_RATE_LIMIT_ACCOUNTS = [
+    username
+    for username in os.getenv("NOTIFICATIONS_LEASED_RATE_LIMIT_ACCOUNTS", "").split(",")
+    if username
+]
+NOTIFICATIONS_RATE_LIMIT_LEASE_SIZE = int(
+    os.getenv("NOTIFICATIONS_RATE_LIMIT_LEASE_SIZE", "100")
+)
+NOTIFICATIONS_RATE_LIMIT_LEASE_TTL = float(
+    os.getenv("NOTIFICATIONS_RATE_LIMIT_LEASE_TTL", "5")
+)
+
 # Celery Configuration
 CELERY_BROKER_URL = "redis://127.0.0.1:6379/0"
 CELERY_RESULT_BACKEND = "redis://127.0.0.1:6379/0"
@@ -183,6 +232,23 @@ CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+# Notification tasks run on per-priority lanes (see notifications/lanes.py).
+# Workers started without -Q consume every lane.
+CELERY_TASK_ROUTES = ("notifications.lanes.route_task",)
+CELERY_TASK_DEFAULT_QUEUE = "notifications.medium"
+CELERY_TASK_QUEUES = {
+    "notifications.high": {},
+    "notifications.medium": {},
+    "notifications.low": {},
+    "notifications.maintenance": {},
+}
+# Concurrency of workers started for a lane with -Q notifications.<lane>
+NOTIFICATIONS_WORKER_CONCURRENCY = {
+    "high": int(os.getenv("NOTIFICATIONS_HIGH_CONCURRENCY", "8")),
+    "medium": int(os.getenv("NOTIFICATIONS_MEDIUM_CONCURRENCY", "4")),
+    "low": int(os.getenv("NOTIFICATIONS_LOW_CONCURRENCY", "2")),
+    "maintenance": int(os.getenv("NOTIFICATIONS_MAINTENANCE_CONCURRENCY", "1")),
+}
 
 EMAIL_BACKEND = os.getenv(
     "EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend"
@@ -193,6 +259,8 @@ EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True") == "True"
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "noreply@example.com")
+# SMTP connections a worker sends notification emails over concurrently
+NOTIFICATIONS_EMAIL_CONNECTIONS = int(os.getenv("NOTIFICATIONS_EMAIL_CONNECTIONS", "4"))
 
 LOGGING = {
     "version": 1,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notification
+from .models import ArchivedNotification, Notification
 
 
 @admin.register(Notification)
@@ -19,3 +19,27 @@ class NotificationAdmin(admin.ModelAdmin):
     readonly_fields = ["created_at", "delivered_at", "read_at", "last_attempt_at"]
     date_hierarchy = "created_at"
     ordering = ["-created_at"]
+
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(admin.ModelAdmin):
+    list_display = [
+        "id",
+        "user",
+        "title",
+        "priority",
+        "status",
+        "channel",
+        "created_at",
+        "archived_at",
+    ]
+    list_filter = ["status", "priority", "channel"]
+    search_fields = ["title", "message", "user__username", "user__email"]
+    date_hierarchy = "created_at"
+    ordering = ["-created_at"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
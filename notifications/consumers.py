@@ -1,14 +1,33 @@
-import json
+import asyncio
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from asgiref.sync import sync_to_async
+from .middleware.jwt_auth import TOKEN_SUBPROTOCOL
 from .models import Notification
-from .serializers import NotificationSerializer
-from .services.presence import PresenceService
+from .services.payload import JSON, MSGPACK, NotificationPayloadService
+from .services.presence import AsyncPresenceService
+from .services.reads import NotificationReadService
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# WebSocket subprotocol a client offers to receive MessagePack binary frames
+# using the compact notification schema instead of JSON text frames
+MSGPACK_SUBPROTOCOL = "notifications.msgpack"
+
+# Missed notifications are replayed oldest first in chunks of this size. The
+# next chunk is only sent once the client acknowledges the previous one with a
+# replay_ack message, which also marks it delivered and advances the cursor.
+REPLAY_CHUNK_SIZE = 50
+
+# Ids received in ack and read messages are buffered per socket and applied
+# with one bulk update per kind, this many seconds after the first receipt of
+# a batch, or as soon as this many ids are buffered
+RECEIPT_FLUSH_DELAY = 0.5
+RECEIPT_BATCH_SIZE = 500
+
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -19,32 +38,42 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             return
 
         self.user_group_name = f"notifications_{self.user.id}"
+        self.pending_acks, self.pending_reads = set(), set()
+        self.receipt_flush = None
+        subprotocols = self.scope.get("subprotocols", [])
+        if MSGPACK_SUBPROTOCOL in subprotocols:
+            self.wire_format, self.subprotocol = MSGPACK, MSGPACK_SUBPROTOCOL
+        elif TOKEN_SUBPROTOCOL in subprotocols:
+            # Browsers fail the handshake unless one offered subprotocol is
+            # selected
+            self.wire_format, self.subprotocol = JSON, TOKEN_SUBPROTOCOL
+        else:
+            self.wire_format, self.subprotocol = JSON, None
 
         await self.channel_layer.group_add(
             self.user_group_name,
             self.channel_name
         )
 
-        allowed = await sync_to_async(PresenceService.add_connection)(
+        allowed = await AsyncPresenceService.connect(
             self.user.id, self.channel_name
         )
         if not allowed:
-            await self.accept()
+            await self.accept(self.subprotocol)
             await self.close(code=4001)
             return
 
-        await self.accept()
-
-        await sync_to_async(PresenceService.mark_online)(self.user.id)
+        await self.accept(self.subprotocol)
 
-        missed_notifications = await self.get_missed_notifications()
-        if missed_notifications:
-            await self.send(text_data=json.dumps({
-                "type": "missed_notifications",
-                "notifications": missed_notifications
-            }))
+        self.replay_cursor = await AsyncPresenceService.get_missed_notifications_cursor(
+            self.user.id
+        )
+        await self.send_replay_chunk()
 
     async def disconnect(self, close_code):
+        if hasattr(self, "pending_acks"):
+            await self.flush_receipts()
+
         if hasattr(self, "user_group_name"):
             await self.channel_layer.group_discard(
                 self.user_group_name,
@@ -52,33 +81,184 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
 
         if hasattr(self, "user") and not self.user.is_anonymous:
-            await sync_to_async(PresenceService.remove_connection)(
+            await AsyncPresenceService.disconnect(
                 self.user.id, self.channel_name
             )
-            connection_count = await sync_to_async(PresenceService.get_connection_count)(self.user.id)
-            if connection_count == 0:
-                await sync_to_async(PresenceService.mark_offline)(self.user.id)
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = NotificationPayloadService.decode(
+            self.wire_format, text_data if text_data is not None else bytes_data
+        )
         message_type = data.get("type")
 
         if message_type == "ping":
-            await sync_to_async(PresenceService.refresh_presence)(self.user.id)
-            await self.send(text_data=json.dumps({"type": "pong"}))
+            await AsyncPresenceService.refresh_presence(self.user.id)
+            await self.send_frame({"type": "pong"})
+        elif message_type == "replay_ack":
+            await self.acknowledge_replay(data.get("cursor"))
+        elif message_type in ("ack", "read"):
+            await self.buffer_receipts(message_type, data.get("ids"))
 
     async def notification_message(self, event):
-        await self.send(text_data=json.dumps({
-            "type": "notification",
-            "notification": event["notification"]
-        }))
+        # Payloads arrive pre-encoded in every wire format, so each socket
+        # reuses the same bytes for its negotiated format
+        await self.send_frame(
+            {"type": "notification"},
+            notification=event["payloads"][self.wire_format],
+        )
+
+    async def notification_batch_message(self, event):
+        # Batch mode notifications coalesced over the batch window
+        await self.send_frame(
+            {"type": "notifications"},
+            notifications=NotificationPayloadService.encoded_list(
+                self.wire_format,
+                [payloads[self.wire_format] for payloads in event["payloads"]],
+            ),
+        )
+
+    async def unread_count_message(self, event):
+        await self.send_frame(
+            {
+                "type": "unread_count",
+                "unread": event["unread"],
+                "pending": event["pending"],
+            }
+        )
+
+    async def notifications_read_message(self, event):
+        # Notifications were marked read in bulk, possibly from another device
+        await self.send_frame(
+            {
+                "type": "notifications_read",
+                **event["scope"],
+                "read_at": event["read_at"],
+                **(event["counts"] or {}),
+            }
+        )
+
+    async def send_frame(self, message, **encoded):
+        """Send a frame in the wire format negotiated for this socket."""
+        frame = NotificationPayloadService.frame(self.wire_format, message, **encoded)
+        if self.wire_format == MSGPACK:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame.decode())
+
+    async def send_replay_chunk(self):
+        """Send the next chunk of missed notifications after the cursor."""
+        self.replay_chunk, payloads, more = await self.get_missed_notifications(
+            self.replay_cursor
+        )
+        self.replay_more = more
+        if not self.replay_chunk:
+            return
+
+        await self.send_frame(
+            {
+                "type": "missed_notifications",
+                "cursor": self.replay_chunk[-1].id,
+                "more": more,
+            },
+            notifications=NotificationPayloadService.encoded_list(
+                self.wire_format, payloads
+            ),
+        )
+
+    async def acknowledge_replay(self, cursor):
+        """
+        Handle a replay_ack for the chunk in flight: mark it delivered, move
+        the cursor past it and send the next chunk. Stale acks are ignored.
+        """
+        if not self.replay_chunk or cursor != self.replay_chunk[-1].id:
+            return
+
+        await database_sync_to_async(Notification.mark_delivered_many)(
+            self.replay_chunk
+        )
+        self.replay_cursor = await AsyncPresenceService.set_missed_notifications_cursor(
+            self.user.id, cursor
+        )
+        if self.replay_more:
+            await self.send_replay_chunk()
+        else:
+            self.replay_chunk = []
+
+    async def buffer_receipts(self, receipt_type, ids):
+        """
+        Buffer the ids of an ack or read message until the next flush, which
+        is scheduled by the first receipt after the previous one.
+        """
+        if not isinstance(ids, list):
+            return
+
+        pending = self.pending_acks if receipt_type == "ack" else self.pending_reads
+        pending.update(
+            i for i in ids if isinstance(i, int) and not isinstance(i, bool)
+        )
+        if len(self.pending_acks) + len(self.pending_reads) >= RECEIPT_BATCH_SIZE:
+            await self.flush_receipts()
+        elif self.receipt_flush is None:
+            self.receipt_flush = asyncio.create_task(self.flush_receipts_later())
+
+    async def flush_receipts_later(self):
+        await asyncio.sleep(RECEIPT_FLUSH_DELAY)
+        self.receipt_flush = None
+        await self.flush_receipts()
+
+    async def flush_receipts(self):
+        """Apply the buffered acks and reads."""
+        if self.receipt_flush is not None:
+            self.receipt_flush.cancel()
+            self.receipt_flush = None
+
+        acks, self.pending_acks = self.pending_acks, set()
+        reads, self.pending_reads = self.pending_reads, set()
+        if not acks and not reads:
+            return
+
+        try:
+            await self.apply_receipts(acks, reads)
+        except Exception as e:
+            # Unapplied receipts are not retried; the notifications stay
+            # pending or unread and show up again on the next replay or list
+            logger.error(f"Failed to apply receipts for user {self.user.id}: {str(e)}")
+
+    @database_sync_to_async
+    def apply_receipts(self, acks, reads):
+        """
+        Mark the acknowledged notifications delivered and the read ones read,
+        one UPDATE each. Ids of other users' notifications match nothing.
+        """
+        if acks:
+            Notification.mark_delivered_many(
+                list(
+                    Notification.objects.filter(
+                        user=self.user, id__in=acks, status="pending"
+                    )
+                )
+            )
+        if reads:
+            NotificationReadService.mark_read(self.user, ids=reads)
 
     @database_sync_to_async
-    def get_missed_notifications(self):
-        notifications = Notification.objects.filter(
-            user=self.user,
-            status="pending"
-        ).order_by("-created_at")[:50]
-
-        serializer = NotificationSerializer(notifications, many=True)
-        return serializer.data
+    def get_missed_notifications(self, cursor):
+        """
+        Return (notifications, encoded payloads, more) for the next chunk of
+        pending notifications with an id above the cursor.
+        """
+        notifications = list(
+            Notification.objects.filter(
+                user=self.user, status="pending", id__gt=cursor
+            ).select_related("user").order_by("id")[:REPLAY_CHUNK_SIZE + 1]
+        )
+        more = len(notifications) > REPLAY_CHUNK_SIZE
+        notifications = notifications[:REPLAY_CHUNK_SIZE]
+
+        payloads = [
+            encoded[self.wire_format]
+            for encoded in NotificationPayloadService.get_many(
+                notifications, formats=[self.wire_format]
+            )
+        ]
+        return notifications, payloads, more
@@ -0,0 +1,52 @@
+# Notification tasks are routed onto per-priority lanes, so a backlog of low
+# priority or maintenance work never queues ahead of high priority delivery.
+# Each lane is its own queue, consumed by workers sized from
+# NOTIFICATIONS_WORKER_CONCURRENCY.
+PRIORITY_LANES = ("high", "medium", "low")
+MAINTENANCE_LANE = "maintenance"
+LANES = (*PRIORITY_LANES, MAINTENANCE_LANE)
+
+# Lanes of tasks that do not take a notification priority
+TASK_LANES = {
+    "notifications.tasks.flush_notification_batch": "low",
+    "notifications.tasks.process_offline_notification": MAINTENANCE_LANE,
+    "notifications.tasks.schedule_offline_notifications": MAINTENANCE_LANE,
+    "notifications.tasks.sweep_offline_notifications": MAINTENANCE_LANE,
+    "notifications.tasks.send_email_digest": MAINTENANCE_LANE,
+    "notifications.tasks.send_digest_chunk": MAINTENANCE_LANE,
+    "notifications.tasks.cleanup_old_notifications": MAINTENANCE_LANE,
+    "notifications.tasks.archive_old_notifications": MAINTENANCE_LANE,
+    "notifications.tasks.compact_notification_stats": MAINTENANCE_LANE,
+    "notifications.tasks.reconcile_unread_counters": MAINTENANCE_LANE,
+}
+
+
+def lane_queue(lane):
+    return f"notifications.{lane}"
+
+
+def priority_lane(priority):
+    return priority if priority in PRIORITY_LANES else "medium"
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router: tasks called with a `priority` keyword argument go to
+    that priority's lane, other notification tasks to their fixed lane.
+    """
+    if kwargs and "priority" in kwargs:
+        return {"queue": lane_queue(priority_lane(kwargs["priority"]))}
+    if name in TASK_LANES:
+        return {"queue": lane_queue(TASK_LANES[name])}
+    return None
+
+
+def lane_concurrency(queues, concurrency):
+    """
+    Worker concurrency for the lanes a worker consumes, summing the
+    `concurrency` of each lane queue. None if it consumes no lane queue.
+    """
+    lanes = [lane for lane in LANES if lane_queue(lane) in queues]
+    if not lanes:
+        return None
+    return sum(concurrency[lane] for lane in lanes)
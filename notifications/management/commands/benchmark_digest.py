@@ -0,0 +1,156 @@
+import socket
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.services.digest import DIGEST_CHUNK_SIZE, DigestService
+
+User = get_user_model()
+
+SEED_BATCH_SIZE = 10000
+
+
+class CountingHandler:
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return "250 OK"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the daily digest against a local aiosmtpd server, over a "
+        "seeded table that is rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--per-user", type=int, default=3)
+        parser.add_argument("--chunk-size", type=int, default=DIGEST_CHUNK_SIZE)
+        parser.add_argument(
+            "--legacy-sample",
+            type=int,
+            default=1000,
+            help="Recipients timed with the former per-user queries and send_mail",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise CommandError("aiosmtpd is required, install the dev dependencies")
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        handler = CountingHandler()
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+
+        smtp = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+        )
+        try:
+            with smtp, transaction.atomic():
+                self.seed(options["users"], options["per_user"])
+                since = timezone.now() - timedelta(days=1)
+                self.run_digest(since, options["chunk_size"], handler)
+                self.run_legacy(since, options["legacy_sample"], handler)
+                transaction.set_rollback(True)
+        finally:
+            controller.stop()
+
+    def seed(self, users, per_user):
+        start = time.perf_counter()
+        for offset in range(0, users, SEED_BATCH_SIZE):
+            accounts = User.objects.bulk_create(
+                [
+                    User(username=f"bench_digest_{i}", email=f"bench{i}@example.com")
+                    for i in range(offset, min(offset + SEED_BATCH_SIZE, users))
+                ]
+            )
+            if accounts[0].pk is None:
+                accounts = list(
+                    User.objects.filter(
+                        username__in=[a.username for a in accounts]
+                    ).only("id")
+                )
+            Notification.objects.bulk_create(
+                [
+                    Notification(user_id=account.pk, title=f"Notification {n}", message="Benchmark")
+                    for account in accounts
+                    for n in range(per_user)
+                ]
+            )
+        self.stdout.write(
+            f"Seeded {users} users x {per_user} unread notifications "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+    def run_digest(self, since, chunk_size, handler):
+        """Run every chunk in-process, as the Celery group would across workers."""
+        handler.connections = handler.messages = 0
+        chunk_times = []
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for user_ids in DigestService.recipient_chunks(since, chunk_size):
+                chunk_start = time.perf_counter()
+                DigestService.send(user_ids, since)
+                chunk_times.append(time.perf_counter() - chunk_start)
+            elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"digest: {handler.messages} emails in {elapsed:.1f}s "
+            f"({len(chunk_times)} chunks of {chunk_size}, "
+            f"slowest {max(chunk_times, default=0):.2f}s), "
+            f"{len(queries)} queries, {handler.connections} SMTP connections"
+        )
+
+    def run_legacy(self, since, sample, handler):
+        """Time the former per-user digest on the first `sample` recipients."""
+        if not sample:
+            return
+        handler.connections = handler.messages = 0
+        user_ids = next(DigestService.recipient_chunks(since, sample), [])
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for user_id in user_ids:
+                unread = DigestService.unread(since).filter(user_id=user_id)
+                count = unread.count()
+                lines = [f"You have {count} unread notification(s):\n"]
+                lines += [
+                    f"- {n.title}: {n.message}"
+                    for n in unread.order_by("-created_at")[:10]
+                ]
+                send_mail(
+                    f"Daily Notification Digest - {count} unread",
+                    "\n".join(lines),
+                    None,
+                    [User.objects.get(id=user_id).email],
+                )
+            elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"legacy: {handler.messages} emails in {elapsed:.1f}s, "
+            f"{len(queries)} queries, {handler.connections} SMTP connections"
+        )
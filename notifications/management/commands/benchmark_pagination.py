@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+
+from notifications.models import Notification
+from notifications.pagination import NotificationKeysetPagination
+
+User = get_user_model()
+
+SEED_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark list page latency by depth, OFFSET + COUNT(*) vs keyset, "
+        "over a seeded table that is rolled back afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=10)
+        parser.add_argument("--page-size", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--depths",
+            type=int,
+            nargs="+",
+            default=[1, 10, 100, 1000],
+            help="Page numbers to measure",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options["rows"], options["users"])
+            queryset = Notification.objects.filter(user=user)
+            page_size = options["page_size"]
+
+            self.stdout.write(
+                f"{options['rows']} rows, {queryset.count()} for the paged user, "
+                f"{page_size} per page (ms per page, best of {options['repeat']})"
+            )
+            self.stdout.write(f"{'page':>8} {'offset+count':>14} {'keyset':>10}")
+            for depth in options["depths"]:
+                offset = (depth - 1) * page_size
+
+                request = self.keyset_request(queryset, offset, page_size)
+
+                # Bound as defaults, so each timing runs this depth's query
+                def offset_page(offset=offset):
+                    queryset.count()
+                    list(queryset.order_by("-created_at", "-id")[offset:offset + page_size])
+
+                def keyset_page(request=request):
+                    paginator = NotificationKeysetPagination()
+                    paginator.page_size = page_size
+                    paginator.paginate_queryset(queryset, request)
+
+                self.stdout.write(
+                    f"{depth:>8} {self.best(offset_page, options['repeat']):>14.2f} "
+                    f"{self.best(keyset_page, options['repeat']):>10.2f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def seed(self, rows, users):
+        accounts = [
+            User.objects.create_user(username=f"bench_pagination_{i}")
+            for i in range(users)
+        ]
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            Notification.objects.bulk_create(
+                [
+                    Notification(
+                        user=accounts[i % users],
+                        title=f"Notification {i}",
+                        message="Benchmark",
+                    )
+                    for i in range(start, min(start + SEED_BATCH_SIZE, rows))
+                ]
+            )
+        return accounts[0]
+
+    def keyset_request(self, queryset, offset, page_size):
+        """Build a request carrying the cursor a client would hold at `offset`."""
+        request = RequestFactory().get("/api/notifications/")
+        if offset:
+            last = queryset.order_by("-created_at", "-id")[offset - 1]
+            cursor = NotificationKeysetPagination().encode_cursor(last)
+            request = RequestFactory().get("/api/notifications/", {"cursor": cursor})
+        request.query_params = request.GET
+        return request
+
+    def best(self, page, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            page()
+            timings.append(time.perf_counter() - start)
+        return min(timings) * 1000
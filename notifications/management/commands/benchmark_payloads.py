@@ -0,0 +1,73 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.serializers import NotificationSerializer
+from notifications.services.payload import NotificationPayloadService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark serializer CPU per delivery, per-send json vs encode-once payloads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--notifications", type=int, default=2000)
+        parser.add_argument(
+            "--deliveries",
+            type=int,
+            default=5,
+            help="Sends per notification (sockets, retries and replays)",
+        )
+
+    def handle(self, *args, **options):
+        notifications = self.build_notifications(options["notifications"])
+        deliveries = options["deliveries"]
+        total = len(notifications) * deliveries
+
+        start = time.process_time()
+        for notification in notifications:
+            for _ in range(deliveries):
+                json.dumps({
+                    "type": "notification",
+                    "notification": NotificationSerializer(notification).data,
+                })
+        legacy = (time.process_time() - start) / total
+
+        start = time.process_time()
+        for notification in notifications:
+            payload = NotificationPayloadService.encode(notification)
+            for _ in range(deliveries):
+                NotificationPayloadService.frame(
+                    "json", {"type": "notification"}, notification=payload
+                )
+        cached = (time.process_time() - start) / total
+
+        self.stdout.write(f"{total} deliveries ({deliveries} per notification)")
+        self.stdout.write(f"per-send serializer + json: {legacy * 1e6:8.1f} us CPU/delivery")
+        self.stdout.write(f"encode once + frame:        {cached * 1e6:8.1f} us CPU/delivery")
+
+    def build_notifications(self, count):
+        user = User(
+            id=1,
+            username="bench",
+            email="bench@example.com",
+            first_name="Bench",
+            last_name="User",
+        )
+        now = timezone.now()
+        return [
+            Notification(
+                id=i,
+                user=user,
+                title=f"Notification {i}",
+                message="Your report is ready to download.",
+                created_at=now,
+                data={"report_id": i, "url": f"/reports/{i}/"},
+            )
+            for i in range(1, count + 1)
+        ]
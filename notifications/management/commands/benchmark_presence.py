@@ -0,0 +1,103 @@
+import time
+from unittest import mock
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.services import presence
+from notifications.services.presence import (
+    MAX_CONNECTIONS_PER_USER,
+    PRESENCE_EXPIRY,
+    PresenceService,
+)
+
+
+def legacy_connect(client, user_id, channel_name):
+    """Connect as it was done before the Lua scripts: SCARD, SADD, EXPIRE, SETEX."""
+    connections_key = f"user_connections:{user_id}"
+    if client.scard(connections_key) >= MAX_CONNECTIONS_PER_USER:
+        return False
+    client.sadd(connections_key, channel_name)
+    client.expire(connections_key, PRESENCE_EXPIRY)
+    client.setex(f"user_presence:{user_id}", PRESENCE_EXPIRY, "online")
+    return True
+
+
+def legacy_disconnect(client, user_id, channel_name):
+    """Disconnect as it was done before the Lua scripts: SREM, SCARD, DEL."""
+    connections_key = f"user_connections:{user_id}"
+    client.srem(connections_key, channel_name)
+    if client.scard(connections_key) == 0:
+        client.delete(f"user_presence:{user_id}")
+
+
+class Command(BaseCommand):
+    help = "Benchmark presence connect/disconnect throughput, legacy vs scripted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=5000)
+        parser.add_argument(
+            "--rtt-ms",
+            type=float,
+            default=0.0,
+            help="Simulated network round-trip time added to every command",
+        )
+        parser.add_argument(
+            "--redis-url",
+            help="Benchmark against a real Redis instead of fakeredis",
+        )
+
+    def handle(self, *args, **options):
+        client = self.get_client(options["redis_url"], options["rtt_ms"] / 1000)
+        iterations = options["iterations"]
+
+        legacy = self.run(
+            iterations,
+            lambda i: legacy_connect(client, i, f"bench.{i}"),
+            lambda i: legacy_disconnect(client, i, f"bench.{i}"),
+        )
+        with mock.patch.object(presence, "redis_client", client):
+            scripted = self.run(
+                iterations,
+                lambda i: PresenceService.connect(i, f"bench.{i}"),
+                lambda i: PresenceService.disconnect(i, f"bench.{i}"),
+            )
+
+        self.stdout.write(f"{'':<10}{'connects/sec':>15}{'disconnects/sec':>18}")
+        for label, (connects, disconnects) in (("legacy", legacy), ("scripted", scripted)):
+            self.stdout.write(f"{label:<10}{connects:>15.0f}{disconnects:>18.0f}")
+
+    def run(self, iterations, connect, disconnect):
+        start = time.perf_counter()
+        for i in range(iterations):
+            connect(i)
+        connect_rate = iterations / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i in range(iterations):
+            disconnect(i)
+        disconnect_rate = iterations / (time.perf_counter() - start)
+        return connect_rate, disconnect_rate
+
+    def get_client(self, redis_url, rtt):
+        if redis_url:
+            base = redis.Redis
+            kwargs = {"connection_pool": redis.ConnectionPool.from_url(redis_url)}
+        else:
+            try:
+                import fakeredis
+            except ImportError:
+                raise CommandError(
+                    "fakeredis[lua] is required, install the dev dependencies "
+                    "or pass --redis-url"
+                )
+            base = fakeredis.FakeRedis
+            kwargs = {}
+
+        class LatencyRedis(base):
+            def execute_command(self, *args, **options):
+                if rtt:
+                    time.sleep(rtt)
+                return super().execute_command(*args, **options)
+
+        return LatencyRedis(decode_responses=True, **kwargs)
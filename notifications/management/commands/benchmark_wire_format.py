@@ -0,0 +1,82 @@
+import time
+
+import msgpack
+import orjson
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notifications.models import Notification
+from notifications.serializers import NotificationSerializer
+from notifications.services.payload import JSON, MSGPACK, NotificationPayloadService
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Benchmark frame size and encode/decode CPU, JSON vs compact MessagePack"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--notifications", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        notifications = self.build_notifications(options["notifications"])
+        count = len(notifications)
+        # The JSON schema goes through the DRF serializer and the compact one
+        # is read off the model. Both are built outside the timed sections,
+        # which then only measure the wire formats.
+        builders = {
+            JSON: lambda n: NotificationSerializer(n).data,
+            MSGPACK: NotificationPayloadService.compact,
+        }
+        encoders = {JSON: orjson.dumps, MSGPACK: msgpack.packb}
+        decoders = {JSON: orjson.loads, MSGPACK: msgpack.unpackb}
+
+        self.stdout.write(f"{count} notifications")
+        for wire_format, builder in builders.items():
+            start = time.process_time()
+            data = [builder(n) for n in notifications]
+            build = (time.process_time() - start) / count
+
+            encoder = encoders[wire_format]
+            start = time.process_time()
+            frames = [
+                NotificationPayloadService.frame(
+                    wire_format, {"type": "notification"}, notification=encoder(d)
+                )
+                for d in data
+            ]
+            encode = (time.process_time() - start) / count
+
+            start = time.process_time()
+            for frame in frames:
+                decoders[wire_format](frame)
+            decode = (time.process_time() - start) / count
+
+            size = sum(len(frame) for frame in frames) / count
+            self.stdout.write(
+                f"{wire_format:8} {size:7.1f} bytes/frame  "
+                f"schema {build * 1e6:7.1f} us  "
+                f"encode {encode * 1e6:6.1f} us  decode {decode * 1e6:6.1f} us"
+            )
+
+    def build_notifications(self, count):
+        user = User(
+            id=1,
+            username="bench",
+            email="bench@example.com",
+            first_name="Bench",
+            last_name="User",
+        )
+        now = timezone.now()
+        return [
+            Notification(
+                id=i,
+                user=user,
+                title=f"Notification {i}",
+                message="Your report is ready to download.",
+                created_at=now,
+                data={"report_id": i, "url": f"/reports/{i}/"},
+            )
+            for i in range(1, count + 1)
+        ]
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notifications.services.rollups import StatsRollupService
+
+
+class Command(BaseCommand):
+    help = "Recompute the notification stats rollups from the notifications table"
+
+    def handle(self, *args, **options):
+        touched = StatsRollupService.rebuild()
+        self.stdout.write(f"Rebuilt {touched} rollup rows")
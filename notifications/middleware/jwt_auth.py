@@ -4,20 +4,47 @@ from django.contrib.auth import get_user_model
 from channels.db import database_sync_to_async
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from ..services.user_cache import user_cache
 
 User = get_user_model()
 
+# WebSocket subprotocol a client offers followed by its access token, e.g.
+# new WebSocket(url, ["access_token", token]), to keep the token out of the
+# URL and so out of proxy logs. The token itself is never echoed back.
+TOKEN_SUBPROTOCOL = "access_token"
+
 
 @database_sync_to_async
-def get_user_from_token(token_string):
+def load_user_from_token(token_string):
+    """Return the token's active user and the token's expiry (epoch seconds)."""
     try:
         access_token = AccessToken(token_string)
         user_id = access_token.payload.get("user_id")
         if user_id:
-            return User.objects.get(id=user_id)
+            user = User.objects.get(id=user_id)
+            if user.is_active:
+                return user, access_token.payload["exp"]
     except (InvalidToken, TokenError, User.DoesNotExist):
         pass
-    return AnonymousUser()
+    return AnonymousUser(), None
+
+
+async def get_user_from_token(token_string):
+    user = user_cache.get(token_string)
+    if user is None:
+        user, expires_at = await load_user_from_token(token_string)
+        if user.is_authenticated:
+            user_cache.set(token_string, user, expires_at)
+    return user
+
+
+def split_token_subprotocol(subprotocols):
+    """Return (token, the other subprotocols) from the offered subprotocols."""
+    if TOKEN_SUBPROTOCOL not in subprotocols:
+        return None, subprotocols
+    index = subprotocols.index(TOKEN_SUBPROTOCOL)
+    token = subprotocols[index + 1] if index + 1 < len(subprotocols) else None
+    return token, subprotocols[: index + 1] + subprotocols[index + 2:]
 
 
 class JWTAuthMiddleware:
@@ -25,9 +52,15 @@ class JWTAuthMiddleware:
         self.app = app
 
     async def __call__(self, scope, receive, send):
-        query_string = scope.get("query_string", b"").decode()
-        query_params = parse_qs(query_string)
-        token = query_params.get("token", [None])[0]
+        token, subprotocols = split_token_subprotocol(
+            list(scope.get("subprotocols", []))
+        )
+        scope = dict(scope, subprotocols=subprotocols)
+
+        if not token:
+            query_string = scope.get("query_string", b"").decode()
+            query_params = parse_qs(query_string)
+            token = query_params.get("token", [None])[0]
 
         if token:
             scope["user"] = await get_user_from_token(token)
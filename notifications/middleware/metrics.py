@@ -26,9 +26,13 @@ pending_notifications_count = Gauge(
     "pending_notifications_count", "Number of pending notifications"
 )
 
+# Upper bounds (seconds) of the delivery latency histogram buckets, shared with
+# the stats rollups
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0]
+
 notification_delivery_latency_seconds = Histogram(
     "notification_delivery_latency_seconds",
     "Time taken to deliver notifications",
     ["priority"],
-    buckets=[0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0],
+    buckets=LATENCY_BUCKETS,
 )
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-17 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("notifications", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 6.0.9 on 2026-10-17 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notification_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationLatencyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('priority', models.CharField(max_length=10)),
+                ('channel', models.CharField(max_length=10)),
+                ('status', models.CharField(max_length=10)),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hour', 'priority', 'channel', 'status', 'bucket'), name='notif_latency_rollup_key_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='NotificationStatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('priority', models.CharField(max_length=10)),
+                ('channel', models.CharField(max_length=10)),
+                ('status', models.CharField(max_length=10)),
+                ('count', models.BigIntegerField(default=0)),
+                ('latency_count', models.BigIntegerField(default=0)),
+                ('latency_sum', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('hour', 'priority', 'channel', 'status'), name='notif_rollup_key_uniq')],
+            },
+        ),
+    ]
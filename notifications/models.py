@@ -1,5 +1,7 @@
 import logging
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.utils import timezone
@@ -13,6 +15,22 @@ from .middleware.metrics import (
 logger = logging.getLogger(__name__)
 
 
+def _record_changes(changes):
+    # Imported lazily, the tracking services depend on this module
+    from .services.tracking import NotificationStateTracker
+
+    # Counts are only recorded and pushed once the change is committed
+    if changes:
+        transaction.on_commit(lambda: NotificationStateTracker.record(changes))
+
+
+async def _arecord_changes(changes):
+    # Only called after an async ORM write, which commits on its own
+    from .services.tracking import NotificationStateTracker
+
+    await NotificationStateTracker.arecord(changes)
+
+
 class Notification(models.Model):
     PRIORITY_CHOICES = [
         ("high", "High"),
@@ -33,8 +51,12 @@ class Notification(models.Model):
         ("both", "Both"),
     ]
 
+    # Indexed by the composite indexes below, which all lead with it
     user = models.ForeignKey(
-        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="notifications"
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="notifications",
+        db_index=False,
     )
     title = models.CharField(max_length=255)
     message = models.TextField()
@@ -52,13 +74,33 @@ class Notification(models.Model):
     last_attempt_at = models.DateTimeField(null=True, blank=True)
     failure_reason = models.TextField(null=True, blank=True)
     data = models.JSONField(default=dict, blank=True)
+    # Bumped on status and content changes, keys the encoded payload cache
+    version = models.PositiveIntegerField(default=1)
 
     class Meta:
         ordering = ["-created_at"]
+        # Each index leads with the columns a hot query filters on, and
+        # ends with the (created_at, id) keyset order where one is listed
         indexes = [
-            models.Index(fields=["user", "-created_at"], name="notif_user_created_idx"),
+            # Listing a user's notifications
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="notif_user_created_idx"
+            ),
+            # Listing without a user filter
+            models.Index(fields=["-created_at", "-id"], name="notif_created_idx"),
+            # Status filters, the digest's recipients, cleanup and archiving
             models.Index(
-                fields=["status", "priority"], name="notif_status_priority_idx"
+                fields=["status", "-created_at", "-id"], name="notif_status_created_idx"
+            ),
+            # Unread counts, bulk mark read and each digest chunk
+            models.Index(
+                fields=["user", "status", "created_at"], name="notif_user_status_idx"
+            ),
+            # Replaying a user's missed notifications in id order
+            models.Index(
+                fields=["user", "id"],
+                condition=Q(status="pending"),
+                name="notif_pending_user_idx",
             ),
         ]
         verbose_name = "Notification"
@@ -67,11 +109,57 @@ class Notification(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.title} ({self.status})"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            _record_changes([(self.user_id, None, self.rollup_state())])
+
+    async def asave(self, *args, **kwargs):
+        # Saved without the save() hook so the change is recorded on the event
+        # loop rather than with blocking Redis calls in the ORM thread
+        adding = self._state.adding
+        await sync_to_async(super().save)(*args, **kwargs)
+        if adding:
+            await _arecord_changes([(self.user_id, None, self.rollup_state())])
+
+    def delete(self, *args, **kwargs):
+        state = self.rollup_state()
+        result = super().delete(*args, **kwargs)
+        _record_changes([(self.user_id, state, None)])
+        return result
+
+    def rollup_state(self):
+        """
+        Return the stats rollup key (hour as epoch seconds, priority, channel,
+        status) and the delivery latency in seconds, or None if not delivered.
+        """
+        hour = self.created_at.replace(minute=0, second=0, microsecond=0)
+        latency = None
+        if self.status in ("delivered", "read") and self.delivered_at:
+            latency = (self.delivered_at - self.created_at).total_seconds()
+        return (int(hour.timestamp()), self.priority, self.channel, self.status), latency
+
     def mark_delivered(self):
+        before = self.rollup_state()
         self.status = "delivered"
         self.delivered_at = timezone.now()
-        self.save(update_fields=["status", "delivered_at"])
+        self.version += 1
+        self.save(update_fields=["status", "delivered_at", "version"])
+        self._record_delivery()
+        _record_changes([(self.user_id, before, self.rollup_state())])
 
+    async def amark_delivered(self):
+        """Async counterpart of mark_delivered for ASGI code paths."""
+        before = self.rollup_state()
+        self.status = "delivered"
+        self.delivered_at = timezone.now()
+        self.version += 1
+        await self.asave(update_fields=["status", "delivered_at", "version"])
+        self._record_delivery()
+        await _arecord_changes([(self.user_id, before, self.rollup_state())])
+
+    def _record_delivery(self):
         notifications_delivered_total.labels(
             priority=self.priority, channel=self.channel
         ).inc()
@@ -91,16 +179,69 @@ class Notification(models.Model):
             },
         )
 
+    @classmethod
+    def mark_delivered_many(cls, notifications):
+        """
+        Bulk counterpart of mark_delivered for notifications already in memory.
+        Issues a single UPDATE for the rows that are still pending, and
+        records metrics and state changes for those rows only, so racing
+        calls for the same notifications cannot count them twice.
+        """
+        if not notifications:
+            return 0
+
+        delivered_at = timezone.now()
+        with transaction.atomic():
+            ids = set(
+                cls.objects.select_for_update()
+                .filter(id__in=[n.id for n in notifications], status="pending")
+                .values_list("id", flat=True)
+            )
+            updated = cls.objects.filter(id__in=ids).update(
+                status="delivered", delivered_at=delivered_at, version=F("version") + 1
+            )
+
+            changed = {n.id: n for n in notifications if n.id in ids}.values()
+            changes = []
+            for notification in changed:
+                # The locked row was pending, whatever the copy in memory says
+                notification.status = "pending"
+                before = notification.rollup_state()
+                notification.status = "delivered"
+                notification.delivered_at = delivered_at
+                notification.version += 1
+                changes.append(
+                    (notification.user_id, before, notification.rollup_state())
+                )
+                notifications_delivered_total.labels(
+                    priority=notification.priority, channel=notification.channel
+                ).inc()
+                notification_delivery_latency_seconds.labels(
+                    priority=notification.priority
+                ).observe((delivered_at - notification.created_at).total_seconds())
+            _record_changes(changes)
+
+        logger.info("Notifications delivered in bulk", extra={"count": updated})
+        return updated
+
     def mark_read(self):
+        before = self.rollup_state()
         self.status = "read"
         self.read_at = timezone.now()
-        self.save(update_fields=["status", "read_at"])
+        self.version += 1
+        self.save(update_fields=["status", "read_at", "version"])
+        _record_changes([(self.user_id, before, self.rollup_state())])
 
     def mark_failed(self, reason):
+        before = self.rollup_state()
         self.status = "failed"
         self.failure_reason = reason
         self.last_attempt_at = timezone.now()
-        self.save(update_fields=["status", "failure_reason", "last_attempt_at"])
+        self.version += 1
+        self.save(
+            update_fields=["status", "failure_reason", "last_attempt_at", "version"]
+        )
+        _record_changes([(self.user_id, before, self.rollup_state())])
 
         notifications_failed_total.labels(priority=self.priority, reason=reason).inc()
 
@@ -118,3 +259,99 @@ class Notification(models.Model):
         self.delivery_attempts += 1
         self.last_attempt_at = timezone.now()
         self.save(update_fields=["delivery_attempts", "last_attempt_at"])
+
+
+class NotificationStatsRollup(models.Model):
+    """
+    Notification counts per creation hour, priority, channel and status, with
+    the delivery latency total of the delivered and read ones. Maintained from
+    deltas buffered in Redis and folded in by compact_notification_stats.
+    """
+
+    hour = models.DateTimeField()
+    priority = models.CharField(max_length=10)
+    channel = models.CharField(max_length=10)
+    status = models.CharField(max_length=10)
+    count = models.BigIntegerField(default=0)
+    latency_count = models.BigIntegerField(default=0)
+    latency_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hour", "priority", "channel", "status"],
+                name="notif_rollup_key_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} {self.priority}/{self.channel}/{self.status}"
+
+
+class NotificationLatencyRollup(models.Model):
+    """
+    Delivery latency histogram alongside NotificationStatsRollup. `bucket` is
+    the index into LATENCY_BUCKETS of the first upper bound the latency fits
+    under, len(LATENCY_BUCKETS) for anything slower.
+    """
+
+    hour = models.DateTimeField()
+    priority = models.CharField(max_length=10)
+    channel = models.CharField(max_length=10)
+    status = models.CharField(max_length=10)
+    bucket = models.PositiveSmallIntegerField()
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hour", "priority", "channel", "status", "bucket"],
+                name="notif_latency_rollup_key_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.hour:%Y-%m-%d %H:00} {self.priority}/{self.channel}/{self.status}"
+            f" bucket {self.bucket}"
+        )
+
+
+class ArchivedNotification(models.Model):
+    """
+    Read and failed notifications moved out of the Notification table
+    once older than NOTIFICATIONS_HOT_WINDOW_DAYS, keeping their id, by
+    archive_old_notifications. Reads fall through to it past the hot window.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="archived_notifications",
+    )
+    title = models.CharField(max_length=255)
+    message = models.TextField()
+    priority = models.CharField(max_length=10)
+    status = models.CharField(max_length=10)
+    channel = models.CharField(max_length=10)
+    created_at = models.DateTimeField()
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    delivery_attempts = models.IntegerField(default=0)
+    last_attempt_at = models.DateTimeField(null=True, blank=True)
+    failure_reason = models.TextField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    version = models.PositiveIntegerField(default=1)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["user", "-created_at"], name="notif_archive_user_created_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.title} ({self.status}, archived)"
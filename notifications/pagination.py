@@ -0,0 +1,101 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from .services.archive import NotificationArchiveService
+
+
+class NotificationKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id), newest first, matching the
+    notif_user_created_idx index. Each page starts right after the last row of
+    the previous one instead of skipping an OFFSET, so its cost does not grow
+    with depth. Clients follow the opaque `next` link; `count=true` adds the
+    total, which costs a COUNT(*) over the whole result.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = "cursor"
+    count_query_param = "count"
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None, archive=None):
+        """
+        `archive` is the same query over ArchivedNotification, read only
+        when the page reaches past the hot window.
+        """
+        self.request = request
+        self.count = None
+        counting = request.query_params.get(self.count_query_param) in ("1", "true")
+        if counting:
+            self.count = queryset.count()
+            if archive is not None:
+                self.count += archive.count()
+
+        cursor = self.decode_cursor(request)
+        if cursor:
+            queryset = self.after(queryset, *cursor)
+
+        rows = list(queryset.order_by(*self.ordering)[: self.page_size + 1])
+        if archive is not None and self.reaches_archive(rows):
+            if cursor:
+                archive = self.after(archive, *cursor)
+            rows = sorted(
+                rows + list(archive.order_by(*self.ordering)[: self.page_size + 1]),
+                key=lambda row: (row.created_at, row.id),
+                reverse=True,
+            )
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def after(self, queryset, created_at, pk):
+        # Written as a range on created_at plus a tie-break on id so the
+        # index bounds the scan on every backend
+        return queryset.filter(
+            Q(created_at__lt=created_at) | Q(id__lt=pk), created_at__lte=created_at
+        )
+
+    def reaches_archive(self, rows):
+        # Archived rows are all older than the hot window, so a full page
+        # ending inside it cannot include any
+        if len(rows) <= self.page_size:
+            return True
+        return rows[-1].created_at < NotificationArchiveService.hot_window_start()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            created_at, pk = base64.urlsafe_b64decode(encoded).decode().split("|")
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if created_at is None:
+            raise NotFound("Invalid cursor")
+        return created_at, pk
+
+    def encode_cursor(self, notification):
+        position = f"{notification.created_at.isoformat()}|{notification.id}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.page[-1]),
+        )
+
+    def get_paginated_response(self, data):
+        response = {"next": self.get_next_link(), "results": data}
+        if self.count is not None:
+            response = {"count": self.count, **response}
+        return Response(response)
@@ -33,6 +33,7 @@ class NotificationSerializer(serializers.ModelSerializer):
             "last_attempt_at",
             "failure_reason",
             "data",
+            "version",
         ]
         read_only_fields = [
             "id",
@@ -42,6 +43,7 @@ class NotificationSerializer(serializers.ModelSerializer):
             "read_at",
             "delivery_attempts",
             "last_attempt_at",
+            "version",
         ]
 
     def validate_priority(self, value):
@@ -79,6 +81,76 @@ class NotificationSerializer(serializers.ModelSerializer):
         )
 
 
+class NotificationBulkCreateSerializer(NotificationSerializer):
+    RECIPIENT_FILTER_FIELDS = [
+        "is_active",
+        "is_staff",
+        "groups__name",
+        "date_joined__gte",
+        "date_joined__lte",
+        "last_login__gte",
+        "last_login__lte",
+    ]
+
+    recipients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=100000,
+    )
+    recipient_filter = serializers.DictField(required=False, allow_empty=False)
+
+    class Meta(NotificationSerializer.Meta):
+        fields = [
+            "title",
+            "message",
+            "priority",
+            "channel",
+            "data",
+            "recipients",
+            "recipient_filter",
+        ]
+
+    def validate_recipient_filter(self, value):
+        invalid = sorted(set(value) - set(self.RECIPIENT_FILTER_FIELDS))
+        if invalid:
+            raise serializers.ValidationError(
+                f"Unsupported filter(s): {', '.join(invalid)}. "
+                f"Must be one of: {', '.join(self.RECIPIENT_FILTER_FIELDS)}"
+            )
+        return value
+
+    def validate(self, attrs):
+        if ("recipients" in attrs) == ("recipient_filter" in attrs):
+            raise serializers.ValidationError(
+                "Provide exactly one of recipients or recipient_filter"
+            )
+        return attrs
+
+
+class NotificationBulkMarkReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        allow_empty=False,
+        max_length=1000,
+    )
+    before = serializers.DateTimeField(required=False)
+    all = serializers.BooleanField(required=False)
+
+    def validate_all(self, value):
+        if not value:
+            raise serializers.ValidationError("Must be true when provided")
+        return value
+
+    def validate(self, attrs):
+        if len(attrs) != 1:
+            raise serializers.ValidationError(
+                "Provide exactly one of ids, before or all"
+            )
+        return attrs
+
+
 class NotificationStatsSerializer(serializers.Serializer):
     total_notifications = serializers.IntegerField()
     delivered_count = serializers.IntegerField()
@@ -88,3 +160,6 @@ class NotificationStatsSerializer(serializers.Serializer):
     delivery_rate = serializers.FloatField()
     read_rate = serializers.FloatField()
     avg_delivery_latency = serializers.FloatField()
+    latency_p50 = serializers.FloatField(required=False)
+    latency_p95 = serializers.FloatField(required=False)
+    latency_p99 = serializers.FloatField(required=False)
@@ -0,0 +1,117 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from ..models import ArchivedNotification, Notification
+from .tracking import NotificationStateTracker
+
+logger = logging.getLogger(__name__)
+
+# Rows moved per transaction
+ARCHIVE_BATCH_SIZE = 1000
+
+# Seconds to sleep between batches so the hot table is not kept busy
+ARCHIVE_PAUSE = 0.05
+
+# Only rows nothing acts on any more move to the archive. Pending and
+# delivered rows are still unread, and marking read, updating and deleting
+# only look in the hot table.
+ARCHIVE_STATUSES = ("read", "failed")
+
+ARCHIVE_FIELDS = [
+    field.attname
+    for field in ArchivedNotification._meta.concrete_fields
+    if field.name != "archived_at"
+]
+
+
+class NotificationArchiveService:
+    """
+    Moves aged notifications from the hot Notification table to
+    ArchivedNotification in batches, and answers reads that reach past the
+    hot window from both.
+    """
+
+    @staticmethod
+    def hot_window_start():
+        """Notifications created before this may be in the archive."""
+        return timezone.now() - timedelta(days=settings.NOTIFICATIONS_HOT_WINDOW_DAYS)
+
+    @staticmethod
+    def aged(before):
+        return Notification.objects.filter(
+            created_at__lt=before, status__in=ARCHIVE_STATUSES
+        )
+
+    @staticmethod
+    def archive(batch_size=ARCHIVE_BATCH_SIZE, pause=ARCHIVE_PAUSE):
+        """
+        Move read and failed notifications older than the hot window
+        into the archive, in id order. Returns the number moved.
+        """
+        aged = NotificationArchiveService.aged(
+            NotificationArchiveService.hot_window_start()
+        )
+        archived = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    aged.select_for_update(skip_locked=True)
+                    .order_by("id")
+                    .values(*ARCHIVE_FIELDS)[:batch_size]
+                )
+                if not rows:
+                    break
+                batch = Notification.objects.filter(id__in=[row["id"] for row in rows])
+                snapshot = NotificationStateTracker.snapshot(batch)
+                archived_at = timezone.now()
+                ArchivedNotification.objects.bulk_create(
+                    [ArchivedNotification(**row, archived_at=archived_at) for row in rows]
+                )
+                batch.delete()
+                # Counts are only pushed once the move is committed
+                transaction.on_commit(
+                    lambda snapshot=snapshot: NotificationStateTracker.record_removed(
+                        snapshot
+                    )
+                )
+            archived += len(rows)
+            if len(rows) < batch_size:
+                break
+            time.sleep(pause)
+
+        logger.info(f"Archived {archived} notifications")
+        return archived
+
+    @staticmethod
+    def reaches_archive(date_from):
+        """
+        Whether a query for notifications created from `date_from` (an ISO
+        date or datetime string, or None for no lower bound) can match
+        archived ones.
+        """
+        if not date_from:
+            return True
+        try:
+            start = parse_datetime(date_from)
+            if start is None:
+                day = parse_date(date_from)
+                if day is None:
+                    return True
+                start = datetime.combine(day, datetime.min.time())
+        except ValueError:
+            return True
+        if timezone.is_naive(start):
+            start = timezone.make_aware(start)
+        return start < NotificationArchiveService.hot_window_start()
+
+    @staticmethod
+    def get(pk):
+        """The notification with id `pk`, from the archive if it was moved."""
+        notification = Notification.objects.filter(pk=pk).first()
+        if notification is None:
+            notification = ArchivedNotification.objects.filter(pk=pk).first()
+        return notification
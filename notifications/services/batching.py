@@ -0,0 +1,108 @@
+import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from ..models import Notification
+from .connections import redis_client
+from .presence import _run_script
+
+logger = logging.getLogger(__name__)
+
+# Batched notification ids are kept this long past the window, so a batch
+# whose flush task was lost does not linger forever. Its notifications are
+# still pending and replayed on reconnect.
+BATCH_KEY_GRACE = 3600
+
+# KEYS: batch list. ARGV: key TTL, notification ids. Appends the ids and
+# returns 1 if they opened a new batch, which then needs a flush scheduled.
+ADD_TO_BATCH_SCRIPT = """
+local opened = redis.call('EXISTS', KEYS[1]) == 0
+redis.call('RPUSH', KEYS[1], unpack(ARGV, 2))
+if opened then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# KEYS: batch list. Removes the batch and returns its ids.
+TAKE_BATCH_SCRIPT = """
+local ids = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1])
+return ids
+"""
+
+add_to_batch_script = redis_client.register_script(ADD_TO_BATCH_SCRIPT)
+take_batch_script = redis_client.register_script(TAKE_BATCH_SCRIPT)
+
+
+class NotificationBatchService:
+    """
+    Coalesces batch mode (low priority) notifications per online user over
+    NOTIFICATIONS_BATCH_WINDOW seconds, then delivers each batch as one
+    WebSocket frame and one bulk status update.
+    """
+
+    @staticmethod
+    def key(user_id):
+        return f"notification_batch:{user_id}"
+
+    @staticmethod
+    def add(notifications):
+        """
+        Add notifications, whose payloads are already cached, to their users'
+        batches, scheduling a flush for every batch this opens.
+        """
+        if not notifications:
+            return
+        by_user = {}
+        for notification in notifications:
+            by_user.setdefault(notification.user_id, []).append(notification.id)
+
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, ids in by_user.items():
+            add_to_batch_script(
+                keys=[NotificationBatchService.key(user_id)],
+                args=[settings.NOTIFICATIONS_BATCH_WINDOW + BATCH_KEY_GRACE, *ids],
+                client=pipe,
+            )
+        opened = [
+            user_id for user_id, new in zip(by_user, pipe.execute()) if new
+        ]
+        NotificationBatchService.schedule_flushes(opened)
+
+    @staticmethod
+    async def aadd(notification):
+        opened = await _run_script(
+            add_to_batch_script,
+            keys=[NotificationBatchService.key(notification.user_id)],
+            args=[
+                settings.NOTIFICATIONS_BATCH_WINDOW + BATCH_KEY_GRACE,
+                notification.id,
+            ],
+        )
+        if opened:
+            # Publishing to the Celery broker is blocking I/O
+            await sync_to_async(NotificationBatchService.schedule_flushes)(
+                [notification.user_id]
+            )
+
+    @staticmethod
+    def schedule_flushes(user_ids):
+        from notifications.tasks import flush_notification_batch
+
+        for user_id in user_ids:
+            flush_notification_batch.apply_async(
+                args=[user_id], countdown=settings.NOTIFICATIONS_BATCH_WINDOW
+            )
+
+    @staticmethod
+    def take(user_id):
+        """Remove the user's batch and return its notifications still pending."""
+        ids = take_batch_script(keys=[NotificationBatchService.key(user_id)])
+        if not ids:
+            return []
+        return list(
+            Notification.objects.filter(
+                id__in=[int(i) for i in ids], status="pending"
+            ).select_related("user").order_by("id")
+        )
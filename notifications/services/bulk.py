@@ -0,0 +1,78 @@
+import logging
+from django.contrib.auth import get_user_model
+from ..models import Notification
+from ..middleware.metrics import notifications_created_total
+from .delivery import NotificationDeliveryService
+from .tracking import NotificationStateTracker
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Recipients are streamed, inserted and fanned out this many at a time
+BULK_CHUNK_SIZE = 1000
+
+
+class BulkNotificationService:
+    """Service for creating one notification for many recipients"""
+
+    @staticmethod
+    def get_recipients(recipient_ids=None, recipient_filter=None):
+        """Build the recipient queryset from an id list or a user filter."""
+        queryset = User.objects.all()
+        if recipient_ids is not None:
+            queryset = queryset.filter(id__in=recipient_ids)
+        if recipient_filter:
+            queryset = queryset.filter(**recipient_filter)
+        return queryset.only("id", "username", "email", "first_name", "last_name")
+
+    @staticmethod
+    def create_and_deliver(recipients, **fields):
+        """
+        Create a notification for every recipient and deliver it.
+        Recipients are processed in chunks so memory and per-chunk latency stay
+        bounded: each chunk is inserted with one bulk_create and fanned out with
+        one batched presence lookup.
+        """
+        totals = {"created": 0, "delivered": 0, "batched": 0, "queued": 0}
+        chunk = []
+
+        for user in recipients.order_by("id").iterator(chunk_size=BULK_CHUNK_SIZE):
+            chunk.append(user)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                BulkNotificationService._process_chunk(chunk, fields, totals)
+                chunk = []
+        if chunk:
+            BulkNotificationService._process_chunk(chunk, fields, totals)
+
+        logger.info(
+            "Bulk notifications created",
+            extra={
+                "created_count": totals["created"],
+                "delivered_count": totals["delivered"],
+                "batched_count": totals["batched"],
+                "queued_count": totals["queued"],
+            },
+        )
+        return totals
+
+    @staticmethod
+    def _process_chunk(users, fields, totals):
+        notifications = Notification.objects.bulk_create(
+            [Notification(user=user, **fields) for user in users]
+        )
+        notifications_created_total.labels(
+            priority=fields.get("priority", "medium"),
+            channel=fields.get("channel", "websocket"),
+        ).inc(len(notifications))
+        NotificationStateTracker.record(
+            [(n.user_id, None, n.rollup_state()) for n in notifications]
+        )
+
+        delivered, batched, queued = NotificationDeliveryService.deliver_bulk(
+            notifications
+        )
+        totals["created"] += len(notifications)
+        totals["delivered"] += delivered
+        totals["batched"] += batched
+        totals["queued"] += queued
@@ -0,0 +1,96 @@
+import logging
+import time
+from django.db import transaction
+from django.utils import timezone
+from ..models import Notification
+from .connections import redis_client
+from .priority import PriorityHandler
+from .tracking import NotificationStateTracker
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted per transaction, bounding how long each one holds its locks
+CLEANUP_CHUNK_SIZE = 1000
+
+# Seconds to sleep between chunks so inserts are not starved
+CLEANUP_PAUSE = 0.05
+
+# Last id deleted per priority by an unfinished run, so a restarted run
+# resumes there. Cleared once every priority is done.
+CLEANUP_CURSOR_KEY = "notification_cleanup_cursor"
+CLEANUP_CURSOR_TTL = 24 * 60 * 60
+
+
+class NotificationCleanupService:
+    """
+    Deletes read notifications past their priority's retention in id-ordered
+    chunks, each in its own short transaction.
+    """
+
+    @staticmethod
+    def expired(priority, now):
+        return Notification.objects.filter(
+            priority=priority,
+            created_at__lt=now - PriorityHandler.get_retention(priority),
+            status="read",  # Only delete read notifications
+        )
+
+    @staticmethod
+    def run(chunk_size=CLEANUP_CHUNK_SIZE, pause=CLEANUP_PAUSE):
+        """
+        Delete expired notifications of every priority. Returns the number
+        deleted, the deletion rate in rows per second and the longest chunk
+        transaction in seconds.
+        """
+        now = timezone.now()
+        cursors = redis_client.hgetall(CLEANUP_CURSOR_KEY)
+        deleted = 0
+        busy = 0.0
+        max_lock = 0.0
+
+        for priority in PriorityHandler.PRIORITY_CONFIG:
+            cursor = int(cursors.get(priority, 0))
+            expired = NotificationCleanupService.expired(priority, now)
+            priority_deleted = 0
+            while True:
+                started = time.perf_counter()
+                with transaction.atomic():
+                    ids = list(
+                        expired.filter(id__gt=cursor)
+                        .order_by("id")
+                        .values_list("id", flat=True)[:chunk_size]
+                    )
+                    if not ids:
+                        break
+                    chunk = Notification.objects.filter(id__in=ids)
+                    snapshot = NotificationStateTracker.snapshot(chunk)
+                    count, _ = chunk.delete()
+                    # Rollups and counters only move once the delete commits
+                    record = NotificationStateTracker.record_removed
+                    transaction.on_commit(lambda snapshot=snapshot: record(snapshot))
+                elapsed = time.perf_counter() - started
+                busy += elapsed
+                max_lock = max(max_lock, elapsed)
+                priority_deleted += count
+
+                cursor = ids[-1]
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.hset(CLEANUP_CURSOR_KEY, priority, cursor)
+                pipe.expire(CLEANUP_CURSOR_KEY, CLEANUP_CURSOR_TTL)
+                pipe.execute()
+                if len(ids) < chunk_size:
+                    break
+                time.sleep(pause)
+
+            deleted += priority_deleted
+            logger.info(
+                f"Deleted {priority_deleted} {priority} priority notifications older "
+                f"than {PriorityHandler.get_retention(priority).days} days"
+            )
+
+        redis_client.delete(CLEANUP_CURSOR_KEY)
+        return {
+            "deleted": deleted,
+            "rows_per_second": round(deleted / busy, 1) if busy else 0,
+            "max_lock_seconds": round(max_lock, 4),
+        }
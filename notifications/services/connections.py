@@ -0,0 +1,45 @@
+import asyncio
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+# Redis holding presence and other notification state, configured from
+# NOTIFICATIONS_REDIS_URL (database 1 by default to separate it from Celery).
+# Both pools block when exhausted instead of raising, so bursts of heartbeats
+# queue up for a connection rather than failing.
+redis_client = redis.Redis(
+    connection_pool=redis.BlockingConnectionPool.from_url(
+        settings.NOTIFICATIONS_REDIS_URL,
+        max_connections=settings.NOTIFICATIONS_REDIS_MAX_CONNECTIONS,
+        decode_responses=True,
+    )
+)
+
+# Same Redis without response decoding, for values stored as raw bytes
+binary_redis_client = redis.Redis(
+    connection_pool=redis.BlockingConnectionPool.from_url(
+        settings.NOTIFICATIONS_REDIS_URL,
+        max_connections=settings.NOTIFICATIONS_REDIS_MAX_CONNECTIONS,
+    )
+)
+
+# asyncio connections are bound to the event loop that created them, so one
+# client (and pool) is kept per loop. Under ASGI that is a single shared pool.
+_async_redis_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis_client():
+    """Return the asyncio Redis client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_redis_clients.get(loop)
+    if client is None:
+        client = redis.asyncio.Redis(
+            connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+                settings.NOTIFICATIONS_REDIS_URL,
+                max_connections=settings.NOTIFICATIONS_REDIS_MAX_CONNECTIONS,
+                decode_responses=True,
+            )
+        )
+        _async_redis_clients[loop] = client
+    return client
@@ -0,0 +1,188 @@
+from collections import defaultdict
+from django.db.models import Count, Q
+from ..models import Notification
+from .connections import redis_client
+
+# Per-user counter hashes expire after this long without being read, so only
+# users that actually display a badge keep one
+COUNTER_TTL = 24 * 60 * 60
+
+# Users whose counters are reconciled per database query
+RECONCILE_BATCH_SIZE = 500
+
+UNREAD_STATUSES = ("pending", "delivered")
+
+# KEYS: counter hash. ARGV: unread delta, pending delta. Applies the deltas
+# only if the hash exists, since a missing hash is initialised from the
+# database on the next read. Returns the new {unread, pending} or nil.
+UPDATE_COUNTERS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return {
+    redis.call('HINCRBY', KEYS[1], 'unread', ARGV[1]),
+    redis.call('HINCRBY', KEYS[1], 'pending', ARGV[2])
+}
+"""
+
+# KEYS: counter hash. ARGV: unread, pending. Overwrites the counts of a hash
+# that still exists, keeping its TTL.
+RESET_COUNTERS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'unread', ARGV[1], 'pending', ARGV[2])
+end
+"""
+
+update_counters_script = redis_client.register_script(UPDATE_COUNTERS_SCRIPT)
+reset_counters_script = redis_client.register_script(RESET_COUNTERS_SCRIPT)
+
+
+def _status(state):
+    return state[0][3] if state else None
+
+
+class UnreadCounterService:
+    """
+    Per-user unread (pending or delivered) and pending counts kept in a Redis
+    hash, so drawing a badge is one HGETALL instead of a filtered COUNT.
+    """
+
+    @staticmethod
+    def key(user_id):
+        return f"user_counts:{user_id}"
+
+    @staticmethod
+    def deltas(changes):
+        """
+        Turn (user id, before, after) state changes into
+        {user_id: (unread delta, pending delta)}, leaving out users whose
+        counts did not change.
+        """
+        deltas = defaultdict(lambda: [0, 0])
+        for user_id, before, after in changes:
+            for status, sign in ((_status(before), -1), (_status(after), 1)):
+                if status in UNREAD_STATUSES:
+                    deltas[user_id][0] += sign
+                if status == "pending":
+                    deltas[user_id][1] += sign
+        return {
+            user_id: tuple(delta) for user_id, delta in deltas.items() if any(delta)
+        }
+
+    @staticmethod
+    def moved_deltas(users, status):
+        """
+        Counter deltas for rows moving to `status`, from
+        {user_id: {old status: row count}}.
+        """
+        deltas = {}
+        for user_id, statuses in users.items():
+            unread = pending = 0
+            for old_status, count in statuses.items():
+                unread += count * (
+                    (status in UNREAD_STATUSES) - (old_status in UNREAD_STATUSES)
+                )
+                pending += count * ((status == "pending") - (old_status == "pending"))
+            if unread or pending:
+                deltas[user_id] = (unread, pending)
+        return deltas
+
+    @staticmethod
+    def queue(pipe, deltas):
+        """Queue the counter updates on a pipeline, one result per user."""
+        for user_id, (unread, pending) in deltas.items():
+            update_counters_script(
+                keys=[UnreadCounterService.key(user_id)],
+                args=[unread, pending],
+                client=pipe,
+            )
+
+    @staticmethod
+    def messages(deltas, results):
+        """
+        Build the channel layer messages pushing new counts to the users
+        whose unread count changed, from the results of queue().
+        """
+        messages = []
+        for (user_id, (unread, _)), counts in zip(deltas.items(), results):
+            if unread and counts:
+                messages.append(
+                    (
+                        f"notifications_{user_id}",
+                        {
+                            "type": "unread_count_message",
+                            "unread": int(counts[0]),
+                            "pending": int(counts[1]),
+                        },
+                    )
+                )
+        return messages
+
+    @staticmethod
+    def count_from_database(user_ids):
+        """Return {user_id: {"unread": n, "pending": n}} with one grouped query."""
+        counts = {user_id: {"unread": 0, "pending": 0} for user_id in user_ids}
+        rows = (
+            Notification.objects.filter(user_id__in=user_ids, status__in=UNREAD_STATUSES)
+            .order_by()
+            .values("user_id")
+            .annotate(
+                unread=Count("id"), pending=Count("id", filter=Q(status="pending"))
+            )
+        )
+        for row in rows:
+            counts[row["user_id"]] = {
+                "unread": row["unread"],
+                "pending": row["pending"],
+            }
+        return counts
+
+    @staticmethod
+    def get(user_id):
+        """Return the user's counts, initialised from the database on a miss."""
+        key = UnreadCounterService.key(user_id)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.expire(key, COUNTER_TTL)
+        counts, _ = pipe.execute()
+        if counts:
+            return {field: int(value) for field, value in counts.items()}
+
+        counts = UnreadCounterService.count_from_database([user_id])[user_id]
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hset(key, mapping=counts)
+        pipe.expire(key, COUNTER_TTL)
+        pipe.execute()
+        return counts
+
+    @staticmethod
+    def reconcile():
+        """
+        Overwrite every existing counter hash with the counts from the
+        database, repairing drift from lost updates or changes that bypass
+        the model. Returns the number of users reconciled.
+        """
+        reconciled = 0
+        batch = []
+        for key in redis_client.scan_iter("user_counts:*", count=RECONCILE_BATCH_SIZE):
+            batch.append(int(key.split(":")[1]))
+            if len(batch) >= RECONCILE_BATCH_SIZE:
+                reconciled += UnreadCounterService._reconcile_batch(batch)
+                batch = []
+        if batch:
+            reconciled += UnreadCounterService._reconcile_batch(batch)
+        return reconciled
+
+    @staticmethod
+    def _reconcile_batch(user_ids):
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, counts in UnreadCounterService.count_from_database(
+            user_ids
+        ).items():
+            reset_counters_script(
+                keys=[UnreadCounterService.key(user_id)],
+                args=[counts["unread"], counts["pending"]],
+                client=pipe,
+            )
+        pipe.execute()
+        return len(user_ids)
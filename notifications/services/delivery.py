@@ -1,11 +1,36 @@
+import asyncio
 import logging
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .presence import PresenceService
+from ..models import Notification
+from ..serializers import NotificationSerializer
+from .batching import NotificationBatchService
+from .offline import OfflineQueueService
+from .payload import NotificationPayloadService
+from .presence import AsyncPresenceService, PresenceService
 from .priority import PriorityHandler
 
 logger = logging.getLogger(__name__)
 
+# Number of group sends kept in flight at once during bulk fan-out
+FANOUT_BATCH_SIZE = 500
+
+
+async def _group_send_many(channel_layer, messages):
+    """
+    Send (group, message) pairs over the channel layer in concurrent batches.
+    Returns a list of booleans telling which sends succeeded.
+    """
+    results = []
+    for start in range(0, len(messages), FANOUT_BATCH_SIZE):
+        batch = messages[start:start + FANOUT_BATCH_SIZE]
+        outcomes = await asyncio.gather(
+            *(channel_layer.group_send(group, message) for group, message in batch),
+            return_exceptions=True,
+        )
+        results.extend(not isinstance(outcome, Exception) for outcome in outcomes)
+    return results
+
 
 class NotificationDeliveryService:
     """Service for orchestrating notification delivery"""
@@ -19,12 +44,113 @@ class NotificationDeliveryService:
         user_id = notification.user.id
         priority = notification.priority
 
-        if PresenceService.is_online(user_id):
-            return NotificationDeliveryService.deliver_via_websocket(
-                user_id, serializer_data, notification
-            )
-        else:
+        if not PresenceService.is_online(user_id, cached=True):
             return NotificationDeliveryService.queue_for_later(notification)
+        if PriorityHandler.should_batch(priority):
+            NotificationPayloadService.get(notification, data=serializer_data)
+            NotificationBatchService.add([notification])
+            return False
+        return NotificationDeliveryService.deliver_via_websocket(
+            user_id, serializer_data, notification
+        )
+
+    @staticmethod
+    def deliver_bulk(notifications):
+        """
+        Fan out many notifications at once.
+        Presence is resolved for all recipients in one batch, online recipients
+        are sent over the channel layer in pipelined batches inside a single
+        event loop entry, or added to their batches in batch mode, and
+        offline recipients are queued for later.
+        Returns a (delivered, batched, queued) tuple.
+        """
+        if not notifications:
+            return 0, 0, 0
+
+        online = PresenceService.is_online_many(
+            {n.user_id for n in notifications}, cached=True
+        )
+        online_notifications = [n for n in notifications if online[n.user_id]]
+        offline_notifications = [n for n in notifications if not online[n.user_id]]
+
+        delivered, batched = [], []
+        if online_notifications:
+            serializer = NotificationSerializer(online_notifications, many=True)
+            payloads = NotificationPayloadService.get_many(
+                online_notifications, data=serializer.data
+            )
+            immediate = []
+            for notification, encoded in zip(online_notifications, payloads):
+                if PriorityHandler.should_batch(notification.priority):
+                    batched.append(notification)
+                else:
+                    immediate.append((notification, encoded))
+            NotificationBatchService.add(batched)
+
+            messages = [
+                (
+                    f"notifications_{notification.user_id}",
+                    {"type": "notification_message", "payloads": encoded},
+                )
+                for notification, encoded in immediate
+            ]
+            results = NotificationDeliveryService.send_many(messages)
+            delivered = [n for (n, _), ok in zip(immediate, results) if ok]
+            # Recipients whose send failed get the regular offline path
+            offline_notifications += [
+                n for (n, _), ok in zip(immediate, results) if not ok
+            ]
+            Notification.mark_delivered_many(delivered)
+
+        NotificationDeliveryService.queue_many_for_later(
+            [n.id for n in offline_notifications]
+        )
+        return len(delivered), len(batched), len(offline_notifications)
+
+    @staticmethod
+    def send_many(messages):
+        """
+        Send many (group, message) pairs from sync code, e.g. Celery workers,
+        with a single event loop entry instead of one bridge per message.
+        Returns a list of booleans telling which sends succeeded.
+        """
+        return async_to_sync(_group_send_many)(get_channel_layer(), messages)
+
+    @staticmethod
+    def deliver_batch(user_id):
+        """
+        Deliver the user's batch of notifications as one WebSocket frame and
+        mark them delivered with one UPDATE. A user who went offline in the
+        meantime gets them queued for later instead.
+        Returns the number delivered.
+        """
+        notifications = NotificationBatchService.take(user_id)
+        if not notifications:
+            return 0
+        if not PresenceService.is_online(user_id):
+            NotificationDeliveryService.queue_many_for_later(
+                [n.id for n in notifications]
+            )
+            return 0
+
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                f"notifications_{user_id}",
+                {
+                    "type": "notification_batch_message",
+                    "payloads": NotificationPayloadService.get_many(notifications),
+                },
+            )
+        except Exception as e:
+            logger.error(f"WebSocket delivery failed for batch of user {user_id}: {str(e)}")
+            NotificationDeliveryService.queue_many_for_later(
+                [n.id for n in notifications]
+            )
+            return 0
+
+        Notification.mark_delivered_many(notifications)
+        logger.info(f"{len(notifications)} batched notifications delivered to user {user_id}")
+        return len(notifications)
 
     @staticmethod
     def deliver_via_websocket(user_id, serializer_data, notification):
@@ -35,11 +161,12 @@ class NotificationDeliveryService:
         channel_layer = get_channel_layer()
 
         try:
+            payloads = NotificationPayloadService.get(notification, data=serializer_data)
             async_to_sync(channel_layer.group_send)(
                 f"notifications_{user_id}",
                 {
                     "type": "notification_message",
-                    "notification": serializer_data
+                    "payloads": payloads
                 }
             )
             notification.mark_delivered()
@@ -52,13 +179,69 @@ class NotificationDeliveryService:
     @staticmethod
     def queue_for_later(notification):
         """
-        Queue notification for later delivery via Celery.
+        Leave the notification pending for the replay on reconnect, with an
+        email fallback deadline.
         """
-        from notifications.tasks import process_offline_notification
+        OfflineQueueService.enqueue([notification.id])
+        logger.info(f"Notification {notification.id} queued for replay (user offline)")
+        return False
+
+    @staticmethod
+    def queue_many_for_later(notification_ids):
+        """Queue many notifications for later delivery with one Redis call."""
+        if not notification_ids:
+            return
+        OfflineQueueService.enqueue(notification_ids)
+        logger.info(f"{len(notification_ids)} notifications queued for replay (users offline)")
+
 
-        process_offline_notification.apply_async(
-            args=[notification.id],
-            countdown=60
+class AsyncNotificationDeliveryService:
+    """
+    asyncio counterpart of NotificationDeliveryService.
+    Used from ASGI views so the presence check, group send and status update
+    run on the event loop instead of bridging through async_to_sync.
+    """
+
+    @staticmethod
+    async def deliver(notification, serializer_data):
+        user_id = notification.user_id
+
+        if not await AsyncPresenceService.is_online(user_id, cached=True):
+            return await AsyncNotificationDeliveryService.queue_for_later(notification)
+        if PriorityHandler.should_batch(notification.priority):
+            await NotificationPayloadService.aencode_and_cache(
+                notification, serializer_data
+            )
+            await NotificationBatchService.aadd(notification)
+            return False
+        return await AsyncNotificationDeliveryService.deliver_via_websocket(
+            user_id, serializer_data, notification
         )
-        logger.info(f"Notification {notification.id} queued for retry (user offline)")
+
+    @staticmethod
+    async def deliver_via_websocket(user_id, serializer_data, notification):
+        channel_layer = get_channel_layer()
+
+        try:
+            payloads = await NotificationPayloadService.aencode_and_cache(
+                notification, serializer_data
+            )
+            await channel_layer.group_send(
+                f"notifications_{user_id}",
+                {
+                    "type": "notification_message",
+                    "payloads": payloads
+                }
+            )
+            await notification.amark_delivered()
+            logger.info(f"Notification {notification.id} delivered via WebSocket to user {user_id}")
+            return True
+        except Exception as e:
+            logger.error(f"WebSocket delivery failed for notification {notification.id}: {str(e)}")
+            return False
+
+    @staticmethod
+    async def queue_for_later(notification):
+        await OfflineQueueService.aenqueue([notification.id])
+        logger.info(f"Notification {notification.id} queued for replay (user offline)")
         return False
@@ -0,0 +1,91 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+from ..models import Notification
+from .counters import UNREAD_STATUSES
+from .email import EmailDispatchService
+
+# Recipients handled by one digest chunk task
+DIGEST_CHUNK_SIZE = 1000
+
+# Most recent unread notifications listed in a digest
+DIGEST_NOTIFICATION_LIMIT = 10
+
+
+class DigestService:
+    """
+    Builds the daily digest of unread notifications for chunks of
+    recipients, with one windowed query for their notifications and one for
+    their email addresses per chunk.
+    """
+
+    @staticmethod
+    def unread(since):
+        return Notification.objects.filter(
+            status__in=UNREAD_STATUSES, created_at__gte=since
+        )
+
+    @staticmethod
+    def recipient_chunks(since, chunk_size=DIGEST_CHUNK_SIZE):
+        """Stream the ids of users with unread notifications, in chunks."""
+        chunk = []
+        user_ids = (
+            DigestService.unread(since)
+            .order_by("user_id")
+            .values_list("user_id", flat=True)
+            .distinct()
+        )
+        for user_id in user_ids.iterator(chunk_size=chunk_size):
+            chunk.append(user_id)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def messages(user_ids, since):
+        """Build the digest EmailMessages for `user_ids`."""
+        rows = (
+            DigestService.unread(since)
+            .filter(user_id__in=user_ids)
+            .annotate(
+                rank=Window(
+                    RowNumber(),
+                    partition_by=F("user_id"),
+                    order_by=[F("created_at").desc(), F("id").desc()],
+                ),
+                unread=Window(Count("id"), partition_by=F("user_id")),
+            )
+            .filter(rank__lte=DIGEST_NOTIFICATION_LIMIT)
+            .order_by("user_id", "rank")
+            .values_list("user_id", "unread", "title", "message")
+        )
+        digests = {}
+        for user_id, unread, title, message in rows:
+            if user_id not in digests:
+                digests[user_id] = [
+                    unread,
+                    [f"You have {unread} unread notification(s):\n"],
+                ]
+            digests[user_id][1].append(f"- {title}: {message}")
+
+        emails = dict(
+            get_user_model()
+            .objects.filter(id__in=digests)
+            .values_list("id", "email")
+        )
+        return [
+            EmailDispatchService.message(
+                f"Daily Notification Digest - {unread} unread",
+                "\n".join(lines),
+                emails[user_id],
+            )
+            for user_id, (unread, lines) in digests.items()
+            if emails.get(user_id)
+        ]
+
+    @staticmethod
+    def send(user_ids, since):
+        """Send the digests of `user_ids`, returning how many were sent."""
+        return EmailDispatchService.send_many(DigestService.messages(user_ids, since))
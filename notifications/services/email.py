@@ -0,0 +1,79 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+logger = logging.getLogger(__name__)
+
+# Messages handed to one send_messages() call on an open connection
+EMAIL_BATCH_SIZE = 100
+
+
+class EmailDispatchService:
+    """
+    Sends notification emails over a few long-lived connections instead of
+    one connection (and SMTP/TLS handshake) per message. Batches are spread
+    over up to NOTIFICATIONS_EMAIL_CONNECTIONS connections used concurrently.
+    """
+
+    @staticmethod
+    def message(subject, body, recipient):
+        return EmailMessage(
+            subject=subject,
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[recipient],
+        )
+
+    @staticmethod
+    def send_many(messages, batch_size=EMAIL_BATCH_SIZE):
+        """Send EmailMessages, returning how many were sent."""
+        return len(EmailDispatchService.dispatch(messages, batch_size))
+
+    @staticmethod
+    def dispatch(messages, batch_size=EMAIL_BATCH_SIZE):
+        """Send EmailMessages, returning the ones that were sent."""
+        batches = [
+            messages[start:start + batch_size]
+            for start in range(0, len(messages), batch_size)
+        ]
+        if not batches:
+            return []
+
+        connections = min(settings.NOTIFICATIONS_EMAIL_CONNECTIONS, len(batches))
+        if connections == 1:
+            return EmailDispatchService._send_batches(batches)
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            return [
+                message
+                for sent in executor.map(
+                    EmailDispatchService._send_batches,
+                    [batches[i::connections] for i in range(connections)],
+                )
+                for message in sent
+            ]
+
+    @staticmethod
+    def _send_batches(batches):
+        sent = []
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+            for batch in batches:
+                try:
+                    connection.send_messages(batch)
+                except Exception as e:
+                    logger.error(f"Failed to send a batch of {len(batch)} emails: {str(e)}")
+                    # The connection may be broken, the next batch gets a
+                    # fresh one
+                    connection.close()
+                    connection.open()
+                    continue
+                # Backends skip messages without recipients and raise on
+                # any other failure
+                sent.extend(message for message in batch if message.recipients())
+        except Exception as e:
+            logger.error(f"Failed to open email connection: {str(e)}")
+        finally:
+            connection.close()
+        return sent
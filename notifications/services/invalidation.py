@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+from .connections import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Seconds the listener waits for a message before picking up channels
+# subscribed in the meantime
+LISTEN_POLL_INTERVAL = 1.0
+
+
+class InvalidationListener:
+    """
+    One pub/sub connection and daemon thread per process, shared by the
+    local caches that are kept coherent by ids published on a channel. Each
+    channel has an `invalidate(id)` callback, and a `clear()` callback run
+    after a disconnect, as changes may have been missed meanwhile.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, channel, invalidate, clear):
+        with self._lock:
+            self._handlers[channel] = (invalidate, clear)
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._listen, name="cache-invalidation-listener", daemon=True
+                )
+                self._thread.start()
+
+    def _listen(self):
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                self._dispatch(pubsub)
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener disconnected: {str(e)}")
+                # The failed connection is dropped, not leaked, before
+                # reconnecting
+                pubsub.close()
+                for _, clear in list(self._handlers.values()):
+                    clear()
+                time.sleep(1)
+
+    def _dispatch(self, pubsub):
+        subscribed = set()
+        while True:
+            # Channels are subscribed from this thread, as pub/sub
+            # connections are not thread-safe
+            channels = set(self._handlers) - subscribed
+            if channels:
+                pubsub.subscribe(*channels)
+                subscribed |= channels
+            message = pubsub.get_message(timeout=LISTEN_POLL_INTERVAL)
+            if message is not None:
+                invalidate, _ = self._handlers[message["channel"]]
+                invalidate(int(message["data"]))
+
+
+invalidation_listener = InvalidationListener()
@@ -0,0 +1,77 @@
+import logging
+import time
+import redis
+from django.conf import settings
+from .connections import get_async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Email fallback deadlines of notifications queued while their user was
+# offline, a sorted set of notification ids scored by epoch seconds
+OFFLINE_DEADLINES_KEY = "offline_email_deadlines"
+
+# Notifications claimed from the deadline set per sweep batch
+OFFLINE_SWEEP_BATCH_SIZE = 500
+
+# KEYS: deadline set. ARGV: now, limit. Removes and returns up to `limit`
+# ids whose deadline has passed, so concurrent sweepers never claim the same
+# notification twice.
+CLAIM_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+claim_due_script = redis_client.register_script(CLAIM_DUE_SCRIPT)
+
+
+class OfflineQueueService:
+    """
+    Notifications for offline users stay pending in the database, which is
+    the per-user queue the consumer replays in chunks when the user connects.
+    Redis only tracks when each one falls back to email if it is still
+    pending by then, so no broker message is held per notification.
+    """
+
+    @staticmethod
+    def deadlines(notification_ids):
+        deadline = time.time() + settings.NOTIFICATIONS_OFFLINE_EMAIL_DELAY
+        return {notification_id: deadline for notification_id in notification_ids}
+
+    @staticmethod
+    def enqueue(notification_ids):
+        if not notification_ids:
+            return
+        try:
+            redis_client.zadd(
+                OFFLINE_DEADLINES_KEY,
+                OfflineQueueService.deadlines(notification_ids),
+                nx=True,
+            )
+        except redis.RedisError as e:
+            # The notifications are still replayed on connect, only their
+            # email fallback is lost
+            logger.warning(f"Failed to queue offline notifications: {str(e)}")
+
+    @staticmethod
+    async def aenqueue(notification_ids):
+        try:
+            await get_async_redis_client().zadd(
+                OFFLINE_DEADLINES_KEY,
+                OfflineQueueService.deadlines(notification_ids),
+                nx=True,
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Failed to queue offline notifications: {str(e)}")
+
+    @staticmethod
+    def claim_due(limit=OFFLINE_SWEEP_BATCH_SIZE):
+        """Claim up to `limit` notification ids past their email deadline."""
+        return [
+            int(notification_id)
+            for notification_id in claim_due_script(
+                keys=[OFFLINE_DEADLINES_KEY], args=[time.time(), limit]
+            )
+        ]
@@ -0,0 +1,172 @@
+import msgpack
+import orjson
+from ..serializers import NotificationSerializer
+from .connections import binary_redis_client, get_async_redis_client
+
+# How long an encoded notification stays cached (seconds)
+PAYLOAD_CACHE_TTL = 24 * 60 * 60
+
+# Wire formats a WebSocket can negotiate, JSON text frames being the default
+JSON = "json"
+MSGPACK = "msgpack"
+WIRE_FORMATS = (JSON, MSGPACK)
+
+
+def _timestamp_ms(value):
+    return int(value.timestamp() * 1000) if value else None
+
+
+class NotificationPayloadService:
+    """
+    Encodes each notification once per wire format and caches the bytes in
+    Redis keyed on (id, version), so every socket, retry and replay reuses the
+    same bytes instead of re-running the serializer.
+
+    The version only changes on status and content changes, so bookkeeping
+    fields such as delivery_attempts reflect the value at first encoding.
+    """
+
+    @staticmethod
+    def cache_key(notification, wire_format=JSON):
+        return (
+            f"notification_payload:{notification.id}:{notification.version}:{wire_format}"
+        )
+
+    @staticmethod
+    def encode(notification, data=None):
+        if data is None:
+            data = NotificationSerializer(notification).data
+        return orjson.dumps(data)
+
+    @staticmethod
+    def encode_compact(notification):
+        """Encode the compact schema as MessagePack."""
+        return msgpack.packb(NotificationPayloadService.compact(notification))
+
+    @staticmethod
+    def compact(notification):
+        """
+        Return the compact schema: single-letter keys, the user as an id and
+        timestamps as epoch milliseconds.
+        """
+        return {
+            "i": notification.id,
+            "u": notification.user_id,
+            "t": notification.title,
+            "m": notification.message,
+            "p": notification.priority,
+            "s": notification.status,
+            "c": notification.channel,
+            "ca": _timestamp_ms(notification.created_at),
+            "da": _timestamp_ms(notification.delivered_at),
+            "ra": _timestamp_ms(notification.read_at),
+            "d": notification.data,
+            "v": notification.version,
+        }
+
+    @staticmethod
+    def get(notification, data=None, formats=WIRE_FORMATS):
+        """Return {wire format: payload}, encoding and caching on a miss."""
+        return NotificationPayloadService.get_many(
+            [notification], data=None if data is None else [data], formats=formats
+        )[0]
+
+    @staticmethod
+    def get_many(notifications, data=None, formats=WIRE_FORMATS):
+        """
+        Return {wire format: payload} for many notifications with one MGET.
+        `data` optionally holds already serialized dicts for freshly created
+        notifications, in which case they are encoded and cached directly.
+        """
+        if not notifications:
+            return []
+
+        keys = [
+            [NotificationPayloadService.cache_key(n, f) for f in formats]
+            for n in notifications
+        ]
+        if data is None:
+            values = iter(binary_redis_client.mget([k for row in keys for k in row]))
+            payloads = [
+                {f: next(values) for f in formats} for _ in notifications
+            ]
+        else:
+            payloads = [dict.fromkeys(formats) for _ in notifications]
+
+        json_misses = [
+            i for i, encoded in enumerate(payloads) if encoded.get(JSON, b"") is None
+        ]
+        if data is None and json_misses:
+            serialized = dict(zip(json_misses, NotificationSerializer(
+                [notifications[i] for i in json_misses], many=True
+            ).data))
+        else:
+            serialized = dict(enumerate(data or []))
+
+        pipe = None
+        for i, notification in enumerate(notifications):
+            for f, key in zip(formats, keys[i]):
+                if payloads[i][f] is not None:
+                    continue
+                if f == MSGPACK:
+                    payloads[i][f] = NotificationPayloadService.encode_compact(
+                        notification
+                    )
+                else:
+                    payloads[i][f] = orjson.dumps(serialized[i])
+                pipe = pipe or binary_redis_client.pipeline(transaction=False)
+                pipe.set(key, payloads[i][f], ex=PAYLOAD_CACHE_TTL)
+        if pipe is not None:
+            pipe.execute()
+        return payloads
+
+    @staticmethod
+    async def aencode_and_cache(notification, data):
+        """Encode a freshly created notification and cache it from async code."""
+        payloads = {
+            JSON: NotificationPayloadService.encode(notification, data),
+            MSGPACK: NotificationPayloadService.encode_compact(notification),
+        }
+        pipe = get_async_redis_client().pipeline(transaction=False)
+        for wire_format, payload in payloads.items():
+            pipe.set(
+                NotificationPayloadService.cache_key(notification, wire_format),
+                payload,
+                ex=PAYLOAD_CACHE_TTL,
+            )
+        await pipe.execute()
+        return payloads
+
+    @staticmethod
+    def frame(wire_format, message, **encoded):
+        """
+        Build a WebSocket frame from the plain fields in `message` followed by
+        fields already encoded in `wire_format`, which are spliced in as-is.
+        """
+        if wire_format == MSGPACK:
+            parts = [msgpack.Packer().pack_map_header(len(message) + len(encoded))]
+            for key, value in message.items():
+                parts += [msgpack.packb(key), msgpack.packb(value)]
+            for key, value in encoded.items():
+                parts += [msgpack.packb(key), value]
+            return b"".join(parts)
+
+        parts = [orjson.dumps(k) + b":" + orjson.dumps(v) for k, v in message.items()]
+        parts += [orjson.dumps(k) + b":" + v for k, v in encoded.items()]
+        return b"{" + b",".join(parts) + b"}"
+
+    @staticmethod
+    def encoded_list(wire_format, payloads):
+        """Join encoded payloads into an encoded list for frame()."""
+        if wire_format == MSGPACK:
+            return msgpack.Packer().pack_array_header(len(payloads)) + b"".join(
+                payloads
+            )
+        return b"[" + b",".join(payloads) + b"]"
+
+    @staticmethod
+    def decode(wire_format, frame):
+        """Decode an incoming client frame."""
+        if wire_format == MSGPACK:
+            return msgpack.unpackb(frame)
+        return orjson.loads(frame)
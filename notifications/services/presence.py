@@ -1,31 +1,185 @@
-import redis
+import logging
+import threading
+import time
+from django.conf import settings
+from redis.exceptions import NoScriptError
+from .connections import get_async_redis_client, redis_client
+from .invalidation import invalidation_listener
 
-# Redis connection for presence tracking (using database 1 to separate from Celery)
-redis_client = redis.Redis(host="127.0.0.1", port=6379, db=1, decode_responses=True)
+logger = logging.getLogger(__name__)
 
 PRESENCE_EXPIRY = 300
 MAX_CONNECTIONS_PER_USER = 5
 
+# Pub/sub channel announcing users whose online state flipped
+PRESENCE_CHANGES_CHANNEL = "presence_changes"
+
+# Connection lifecycle scripts. Each runs atomically on the server in a single
+# round trip. KEYS: connections set, presence key.
+
+# ARGV: channel name, max connections, expiry, user id, changes channel.
+# Returns 1 if the connection was registered, 0 if the user is already at the
+# connection limit. Publishes the user id when the user comes online.
+CONNECT_SCRIPT = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0
+    and redis.call('SCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+local was_online = redis.call('EXISTS', KEYS[2])
+redis.call('SET', KEYS[2], 'online', 'EX', ARGV[3])
+if was_online == 0 then
+    redis.call('PUBLISH', ARGV[5], ARGV[4])
+end
+return 1
+"""
+
+# ARGV: channel name, user id, changes channel. Returns the number of remaining
+# connections, and clears and publishes presence when it drops to zero.
+DISCONNECT_SCRIPT = """
+redis.call('SREM', KEYS[1], ARGV[1])
+local remaining = redis.call('SCARD', KEYS[1])
+if remaining == 0 and redis.call('DEL', KEYS[2]) == 1 then
+    redis.call('PUBLISH', ARGV[3], ARGV[2])
+end
+return remaining
+"""
+
+# ARGV: expiry. Extends presence and the connections set if the user is online.
+REFRESH_SCRIPT = """
+if redis.call('EXPIRE', KEYS[2], ARGV[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# KEYS: cursor key. ARGV: notification id. Only ever moves the missed
+# notifications cursor forward, so acks racing from several sockets of the
+# same user cannot rewind it. Returns the resulting cursor.
+ADVANCE_CURSOR_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1])
+    return tonumber(ARGV[1])
+end
+return current
+"""
+
+connect_script = redis_client.register_script(CONNECT_SCRIPT)
+disconnect_script = redis_client.register_script(DISCONNECT_SCRIPT)
+refresh_script = redis_client.register_script(REFRESH_SCRIPT)
+advance_cursor_script = redis_client.register_script(ADVANCE_CURSOR_SCRIPT)
+
+
+class LocalPresenceCache:
+    """
+    Short-lived in-process cache of presence lookups for delivery decisions.
+    Entries expire after `ttl` seconds and are evicted as soon as a presence
+    change for the user is published on PRESENCE_CHANGES_CHANNEL.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get_many(self, user_ids):
+        """Return (cached results, user ids that need a lookup)."""
+        invalidation_listener.ensure_running()
+        now = time.monotonic()
+        hits, misses = {}, []
+        with self._lock:
+            for user_id in user_ids:
+                entry = self._entries.get(user_id)
+                if entry and entry[1] > now:
+                    hits[user_id] = entry[0]
+                else:
+                    misses.append(user_id)
+        return hits, misses
+
+    def set_many(self, results):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for user_id, online in results.items():
+                self._entries[user_id] = (online, expires_at)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+presence_cache = LocalPresenceCache(settings.PRESENCE_LOCAL_CACHE_TTL)
+invalidation_listener.subscribe(
+    PRESENCE_CHANGES_CHANNEL, presence_cache.invalidate, presence_cache.clear
+)
+
 
 class PresenceService:
     """Service for tracking user online/offline status"""
 
     @staticmethod
     def mark_online(user_id):
-        redis_client.setex(f"user_presence:{user_id}", PRESENCE_EXPIRY, "online")
+        pipe = redis_client.pipeline()
+        pipe.setex(f"user_presence:{user_id}", PRESENCE_EXPIRY, "online")
+        pipe.publish(PRESENCE_CHANGES_CHANNEL, user_id)
+        pipe.execute()
 
     @staticmethod
     def mark_offline(user_id):
-        redis_client.delete(f"user_presence:{user_id}")
+        pipe = redis_client.pipeline()
+        pipe.delete(f"user_presence:{user_id}")
+        pipe.publish(PRESENCE_CHANGES_CHANNEL, user_id)
+        pipe.execute()
 
     @staticmethod
-    def is_online(user_id):
+    def is_online(user_id, cached=False):
+        if cached:
+            return PresenceService.is_online_many([user_id], cached=True)[user_id]
         return redis_client.exists(f"user_presence:{user_id}") > 0
 
+    @staticmethod
+    def is_online_many(user_ids, cached=False):
+        """
+        Resolve presence for many users in one pipelined round trip.
+        With cached=True, recent answers from the local presence cache are
+        reused and only the remaining users are looked up.
+        """
+        results, user_ids = {}, list(user_ids)
+        if cached and presence_cache.enabled:
+            results, user_ids = presence_cache.get_many(user_ids)
+        if not user_ids:
+            return results
+
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.exists(f"user_presence:{user_id}")
+        fetched = {
+            user_id: exists > 0 for user_id, exists in zip(user_ids, pipe.execute())
+        }
+        if cached and presence_cache.enabled:
+            presence_cache.set_many(fetched)
+        results.update(fetched)
+        return results
+
     @staticmethod
     def refresh_presence(user_id):
-        if redis_client.exists(f"user_presence:{user_id}"):
-            redis_client.expire(f"user_presence:{user_id}", PRESENCE_EXPIRY)
+        return bool(
+            refresh_script(
+                keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+                args=[PRESENCE_EXPIRY],
+                client=redis_client,
+            )
+        )
 
     @staticmethod
     def get_missed_notifications_cursor(user_id):
@@ -34,25 +188,120 @@ class PresenceService:
 
     @staticmethod
     def set_missed_notifications_cursor(user_id, notification_id):
-        redis_client.set(f"user_cursor:{user_id}", notification_id)
+        return advance_cursor_script(
+            keys=[f"user_cursor:{user_id}"], args=[notification_id]
+        )
 
     @staticmethod
-    def add_connection(user_id, channel_name):
-        connections_key = f"user_connections:{user_id}"
-        current_count = redis_client.scard(connections_key)
-
-        if current_count >= MAX_CONNECTIONS_PER_USER:
-            return False
-
-        redis_client.sadd(connections_key, channel_name)
-        redis_client.expire(connections_key, PRESENCE_EXPIRY)
-        return True
+    def connect(user_id, channel_name):
+        """
+        Register a connection and mark the user online.
+        Returns False if the user is already at MAX_CONNECTIONS_PER_USER.
+        """
+        return bool(
+            connect_script(
+                keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+                args=[
+                    channel_name,
+                    MAX_CONNECTIONS_PER_USER,
+                    PRESENCE_EXPIRY,
+                    user_id,
+                    PRESENCE_CHANGES_CHANNEL,
+                ],
+                client=redis_client,
+            )
+        )
 
     @staticmethod
-    def remove_connection(user_id, channel_name):
-        connections_key = f"user_connections:{user_id}"
-        redis_client.srem(connections_key, channel_name)
+    def disconnect(user_id, channel_name):
+        """
+        Unregister a connection, marking the user offline if it was the last.
+        Returns the number of remaining connections.
+        """
+        return disconnect_script(
+            keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+            args=[channel_name, user_id, PRESENCE_CHANGES_CHANNEL],
+            client=redis_client,
+        )
 
     @staticmethod
     def get_connection_count(user_id):
         return redis_client.scard(f"user_connections:{user_id}")
+
+
+async def _run_script(script, keys, args):
+    """Run a registered script on the asyncio client, loading it if needed."""
+    client = get_async_redis_client()
+    try:
+        return await client.evalsha(script.sha, len(keys), *keys, *args)
+    except NoScriptError:
+        await client.script_load(script.script)
+        return await client.evalsha(script.sha, len(keys), *keys, *args)
+
+
+class AsyncPresenceService:
+    """
+    asyncio counterpart of PresenceService.
+    Used by the WebSocket consumer and ASGI views so presence round trips are
+    awaited on the event loop instead of occupying executor threads.
+    """
+
+    @staticmethod
+    async def is_online(user_id, cached=False):
+        if cached and presence_cache.enabled:
+            results, misses = presence_cache.get_many([user_id])
+            if not misses:
+                return results[user_id]
+
+        client = get_async_redis_client()
+        online = await client.exists(f"user_presence:{user_id}") > 0
+        if cached and presence_cache.enabled:
+            presence_cache.set_many({user_id: online})
+        return online
+
+    @staticmethod
+    async def connect(user_id, channel_name):
+        return bool(
+            await _run_script(
+                connect_script,
+                keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+                args=[
+                    channel_name,
+                    MAX_CONNECTIONS_PER_USER,
+                    PRESENCE_EXPIRY,
+                    user_id,
+                    PRESENCE_CHANGES_CHANNEL,
+                ],
+            )
+        )
+
+    @staticmethod
+    async def disconnect(user_id, channel_name):
+        return await _run_script(
+            disconnect_script,
+            keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+            args=[channel_name, user_id, PRESENCE_CHANGES_CHANNEL],
+        )
+
+    @staticmethod
+    async def refresh_presence(user_id):
+        return bool(
+            await _run_script(
+                refresh_script,
+                keys=[f"user_connections:{user_id}", f"user_presence:{user_id}"],
+                args=[PRESENCE_EXPIRY],
+            )
+        )
+
+    @staticmethod
+    async def get_missed_notifications_cursor(user_id):
+        cursor = await get_async_redis_client().get(f"user_cursor:{user_id}")
+        return int(cursor) if cursor else 0
+
+    @staticmethod
+    async def set_missed_notifications_cursor(user_id, notification_id):
+        return await _run_script(
+            advance_cursor_script,
+            keys=[f"user_cursor:{user_id}"],
+            args=[notification_id],
+        )
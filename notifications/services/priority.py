@@ -8,14 +8,17 @@ class PriorityHandler:
         'high': {
             'ttl': timedelta(hours=1),
             'delivery_mode': 'immediate',
+            'retention': timedelta(days=1),
         },
         'medium': {
             'ttl': timedelta(days=1),
             'delivery_mode': 'normal',
+            'retention': timedelta(days=7),
         },
         'low': {
             'ttl': timedelta(days=7),
             'delivery_mode': 'batch',
+            'retention': timedelta(days=30),
         }
     }
 
@@ -24,6 +27,11 @@ class PriorityHandler:
         """Get time-to-live for a priority level"""
         return cls.PRIORITY_CONFIG.get(priority, cls.PRIORITY_CONFIG['medium'])['ttl']
 
+    @classmethod
+    def get_retention(cls, priority):
+        """Get how long read notifications of a priority level are kept"""
+        return cls.PRIORITY_CONFIG.get(priority, cls.PRIORITY_CONFIG['medium'])['retention']
+
     @classmethod
     def get_delivery_mode(cls, priority):
         """Get delivery mode for a priority level"""
@@ -1,81 +1,221 @@
+import threading
 import time
-from django.core.cache import cache
+import uuid
+from django.conf import settings
+from rest_framework.settings import api_settings
 from rest_framework.throttling import SimpleRateThrottle
+from .connections import redis_client
+
+PRIORITY_SCOPES = {
+    "high": "notifications_high",
+    "medium": "notifications_medium",
+    "low": "notifications_low",
+}
+
+# KEYS: sliding window log, a sorted set of request timestamps in ms.
+# ARGV: limit, window in ms, member prefix for this call, number of slots to
+# take (0 to only look). Trims requests that left the window and records up
+# to that many new ones while fewer than `limit` remain, all against the Redis
+# clock so every process shares the same window.
+# Returns {slots taken, remaining, retry after ms}, retrying after a whole
+# window when nothing is recorded to age out, e.g. under a limit of 0.
+SLIDING_WINDOW_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local available = limit - redis.call('ZCARD', KEYS[1])
+if available > 0 then
+    local taken = math.min(tonumber(ARGV[4]), available)
+    for i = 1, taken do
+        redis.call('ZADD', KEYS[1], now, ARGV[3] .. ':' .. i)
+    end
+    if taken > 0 then
+        redis.call('PEXPIRE', KEYS[1], window)
+    end
+    return {taken, available - taken, 0}
+end
+
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #oldest == 0 then
+    return {0, 0, window}
+end
+return {0, 0, tonumber(oldest[2]) + window - now}
+"""
+
+sliding_window_script = redis_client.register_script(SLIDING_WINDOW_SCRIPT)
 
 
-class NotificationRateThrottle(SimpleRateThrottle):
-    scope = "notifications"
+class RateLimiterService:
+    """
+    Sliding window rate limits kept in Redis. Each check is one atomic script
+    call, so concurrent requests cannot race past the limit. Limits come from
+    REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"], shared with the DRF throttles.
+    """
 
-    def get_cache_key(self, request, view):
-        if request.user.is_authenticated:
-            ident = request.user.pk
-        else:
-            ident = self.get_ident(request)
+    @staticmethod
+    def key(scope, ident):
+        return f"rate_limit:{scope}:{ident}"
 
-        return self.cache_format % {"scope": self.scope, "ident": ident}
+    @staticmethod
+    def get_rate(scope):
+        """Return (limit, window seconds) for a throttle scope."""
+        return SimpleRateThrottle.parse_rate(
+            None, api_settings.DEFAULT_THROTTLE_RATES[scope]
+        )
 
+    @staticmethod
+    def priority_scope(priority):
+        return PRIORITY_SCOPES.get(priority, PRIORITY_SCOPES["medium"])
 
-class PriorityBasedRateThrottle(SimpleRateThrottle):
-    scope = "notifications_medium"
+    @staticmethod
+    def take(scope, ident, slots=1):
+        """
+        Take up to `slots` requests from the scope's limit for `ident`.
+        Returns (slots taken, remaining, seconds until a slot frees up).
+        """
+        limit, window = RateLimiterService.get_rate(scope)
+        taken, remaining, retry_after = sliding_window_script(
+            keys=[RateLimiterService.key(scope, ident)],
+            args=[limit, window * 1000, uuid.uuid4().hex, slots],
+        )
+        return taken, remaining, retry_after / 1000
 
-    def get_cache_key(self, request, view):
-        if request.user.is_authenticated:
-            ident = request.user.pk
-        else:
-            ident = self.get_ident(request)
+    @staticmethod
+    def hit(scope, ident, consume=True):
+        """
+        Count a request against the scope's limit for `ident`.
+        Returns (allowed, remaining, seconds until a slot frees up).
+        """
+        taken, remaining, retry_after = RateLimiterService.take(
+            scope, ident, int(consume)
+        )
+        allowed = taken > 0 if consume else remaining > 0
+        return allowed, remaining, retry_after
 
-        priority = request.data.get("priority", "medium")
-        return self.cache_format % {"scope": f"notifications_{priority}", "ident": ident}
+    @staticmethod
+    def hit_leased(scope, ident):
+        """
+        Like hit(), but served from a lease of slots taken in advance, so
+        most checks need no Redis call. Returns (allowed, seconds until a
+        slot frees up).
+        """
+        return token_leases.take(scope, ident)
 
-    def allow_request(self, request, view):
-        priority = request.data.get("priority", "medium")
-        rate_config = {
-            "high": "100/hour",
-            "medium": "50/hour",
-            "low": "20/hour",
-        }
+    @staticmethod
+    def action_ident(user_id, action="create"):
+        """Ident counting a user's `action` requests apart from other actions."""
+        return f"{action}:{user_id}"
 
-        self.rate = rate_config.get(priority, "50/hour")
-        self.num_requests, self.duration = self.parse_rate(self.rate)
+    @staticmethod
+    def check_rate_limit(user_id, priority="medium", action="create"):
+        allowed, remaining, _ = RateLimiterService.hit(
+            RateLimiterService.priority_scope(priority),
+            RateLimiterService.action_ident(user_id, action),
+        )
+        return allowed, remaining
 
-        return super().allow_request(request, view)
+    @staticmethod
+    def get_remaining(user_id, priority="medium", action="create"):
+        _, remaining, _ = RateLimiterService.hit(
+            RateLimiterService.priority_scope(priority),
+            RateLimiterService.action_ident(user_id, action),
+            consume=False,
+        )
+        return remaining
+
+
+class LeasedTokenBucket:
+    """
+    In-process token buckets refilled by taking leases of `lease_size` slots
+    from the shared sliding window in one script call. Leased slots count
+    against the window as soon as they are taken, and a lease is dropped
+    after `lease_ttl` seconds (or the window, if shorter), so the global limit
+    holds up to the slots each process leases early or leaves unused.
+    """
+
+    def __init__(self, lease_size, lease_ttl):
+        self.lease_size = lease_size
+        self.lease_ttl = lease_ttl
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def take(self, scope, ident):
+        key = (scope, ident)
+        with self._lock:
+            tokens, expires_at = self._leases.get(key, (0, 0))
+            if tokens and expires_at > time.monotonic():
+                self._leases[key] = (tokens - 1, expires_at)
+                return True, None
+
+            # Refilled under the lock so concurrent requests do not each
+            # lease a batch
+            _, window = RateLimiterService.get_rate(scope)
+            taken, _, retry_after = RateLimiterService.take(
+                scope, ident, self.lease_size
+            )
+            if not taken:
+                self._leases.pop(key, None)
+                return False, retry_after
+            self._leases[key] = (
+                taken - 1,
+                time.monotonic() + min(self.lease_ttl, window),
+            )
+            return True, None
+
+    def clear(self):
+        with self._lock:
+            self._leases.clear()
+
+
+token_leases = LeasedTokenBucket(
+    settings.NOTIFICATIONS_RATE_LIMIT_LEASE_SIZE,
+    settings.NOTIFICATIONS_RATE_LIMIT_LEASE_TTL,
+)
 
 
-class RateLimiterService:
-    @staticmethod
-    def check_rate_limit(user_id, priority="medium", action="create"):
-        rate_limits = {
-            "high": {"create": 100, "window": 3600},
-            "medium": {"create": 50, "window": 3600},
-            "low": {"create": 20, "window": 3600},
-        }
+class NotificationRateThrottle(SimpleRateThrottle):
+    """Throttle counting requests in RateLimiterService's sliding windows."""
+
+    scope = "notifications"
+
+    def get_rate(self):
+        return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
 
-        config = rate_limits.get(priority, rate_limits["medium"])
-        limit = config["create"]
-        window = config["window"]
+    def get_ident(self, request):
+        if request.user.is_authenticated:
+            return request.user.pk
+        return super().get_ident(request)
 
-        cache_key = f"rate_limit:{action}:{priority}:{user_id}"
-        current = cache.get(cache_key, 0)
+    def get_scope(self, request):
+        return self.scope
 
-        if current >= limit:
-            return False, 0
+    def allow_request(self, request, view):
+        self.retry_after = None
+        if request.user.username in settings.NOTIFICATIONS_LEASED_RATE_LIMIT_ACCOUNTS:
+            # High-volume service accounts share one budget across
+            # priorities, checked against a local lease
+            allowed, retry_after = RateLimiterService.hit_leased(
+                "notifications_service", self.get_ident(request)
+            )
+        else:
+            allowed, _, retry_after = RateLimiterService.hit(
+                self.get_scope(request), self.get_ident(request)
+            )
+        if not allowed:
+            self.retry_after = retry_after
+        return allowed
 
-        cache.set(cache_key, current + 1, window)
-        remaining = limit - (current + 1)
-        return True, remaining
+    def wait(self):
+        return self.retry_after
 
-    @staticmethod
-    def get_remaining(user_id, priority="medium", action="create"):
-        rate_limits = {
-            "high": {"create": 100, "window": 3600},
-            "medium": {"create": 50, "window": 3600},
-            "low": {"create": 20, "window": 3600},
-        }
 
-        config = rate_limits.get(priority, rate_limits["medium"])
-        limit = config["create"]
+class PriorityBasedRateThrottle(NotificationRateThrottle):
+    """Limits requests by the priority of the notification being created."""
 
-        cache_key = f"rate_limit:{action}:{priority}:{user_id}"
-        current = cache.get(cache_key, 0)
+    scope = "notifications_medium"
 
-        return max(0, limit - current)
+    def get_scope(self, request):
+        return RateLimiterService.priority_scope(request.data.get("priority", "medium"))
@@ -0,0 +1,79 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from ..models import Notification
+from .tracking import NotificationStateTracker
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationReadService:
+    """Marks many of a user's notifications read at once"""
+
+    @staticmethod
+    def mark_read(user, ids=None, before=None):
+        """
+        Mark the user's unread notifications read with one set-based UPDATE:
+        those in `ids`, those created up to `before`, or all of them when
+        neither is given. The user's sockets get one notifications_read sync
+        event describing the change. Returns the number marked read.
+        """
+        queryset = Notification.objects.filter(
+            user=user, status__in=["pending", "delivered"]
+        )
+        scope = {"all": True}
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+            scope = {"ids": sorted(ids)}
+        elif before is not None:
+            queryset = queryset.filter(created_at__lte=before)
+            scope = {"before": before.isoformat()}
+
+        read_at = timezone.now()
+        with transaction.atomic():
+            # The rows are locked and the UPDATE limited to them, so the
+            # snapshot describes exactly the rows that change
+            locked_ids = list(
+                queryset.select_for_update()
+                .order_by("id")
+                .values_list("id", flat=True)
+            )
+            if not locked_ids:
+                return 0
+            locked = Notification.objects.filter(id__in=locked_ids)
+            snapshot = NotificationStateTracker.snapshot(locked)
+            updated = locked.update(
+                status="read", read_at=read_at, version=F("version") + 1
+            )
+            transaction.on_commit(
+                lambda: NotificationReadService.publish(user, scope, read_at, snapshot)
+            )
+
+        logger.info(
+            "Notifications marked read in bulk",
+            extra={"user_id": user.id, "count": updated},
+        )
+        return updated
+
+    @staticmethod
+    def publish(user, scope, read_at, snapshot):
+        """
+        Record the rows captured by `snapshot` as read and send the user's
+        sockets the notifications_read sync event with the new counts.
+        """
+        counts = NotificationStateTracker.record_moved(snapshot, "read", push=False)
+        event = {
+            "type": "notifications_read_message",
+            "scope": scope,
+            "read_at": read_at.isoformat(),
+            "counts": counts.get(user.id),
+        }
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                f"notifications_{user.id}", event
+            )
+        except Exception as e:
+            logger.warning(f"Failed to send read sync event to user {user.id}: {str(e)}")
@@ -0,0 +1,321 @@
+import bisect
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+import redis
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncHour
+from ..middleware.metrics import LATENCY_BUCKETS
+from ..models import Notification, NotificationLatencyRollup, NotificationStatsRollup
+from .connections import redis_client
+from .stats import DELIVERED, LATENCY_PERCENTILES
+
+logger = logging.getLogger(__name__)
+
+# Rollup deltas are buffered in a Redis hash, one field per
+# "hour|priority|channel|status|metric", so transitions never contend on the
+# rollup rows. Compaction renames the hash aside before folding it into the
+# database, and a lock keeps concurrent compactions from applying it twice.
+ROLLUP_DELTAS_KEY = "stats_rollup_deltas"
+ROLLUP_COMPACTING_KEY = "stats_rollup_deltas:compacting"
+ROLLUP_LOCK_KEY = "stats_rollup_lock"
+ROLLUP_LOCK_TIMEOUT = 300
+
+STATUSES = ("pending", "delivered", "read", "failed")
+
+
+def _parse_field(field):
+    """Split a delta field into (rollup key fields, metric)."""
+    hour, priority, channel, status, metric = field.split("|")
+    key = {
+        "hour": datetime.fromtimestamp(int(hour), tz=dt_timezone.utc),
+        "priority": priority,
+        "channel": channel,
+        "status": status,
+    }
+    return key, metric
+
+
+class StatsRollupService:
+    """
+    Maintains NotificationStatsRollup and NotificationLatencyRollup so the
+    stats endpoint answers from a few hundred rollup rows instead of scanning
+    the notifications table.
+    """
+
+    @staticmethod
+    def deltas(changes):
+        """
+        Turn (before, after) rollup states, as returned by
+        Notification.rollup_state() or None for a created or deleted
+        notification, into delta fields.
+        """
+        deltas = defaultdict(int)
+        for before, after in changes:
+            if before == after:
+                continue
+            for state, sign in ((before, -1), (after, 1)):
+                if state is None:
+                    continue
+                key, latency = state
+                prefix = "|".join(str(part) for part in key)
+                deltas[f"{prefix}|count"] += sign
+                if latency is not None:
+                    bucket = bisect.bisect_left(LATENCY_BUCKETS, latency)
+                    deltas[f"{prefix}|latency_count"] += sign
+                    deltas[f"{prefix}|latency_sum"] += sign * latency
+                    deltas[f"{prefix}|bucket_{bucket}"] += sign
+        return {field: value for field, value in deltas.items() if value}
+
+    @staticmethod
+    def buffer(pipe, deltas):
+        """Queue delta fields on a Redis pipeline."""
+        for field, value in deltas.items():
+            if isinstance(value, float):
+                pipe.hincrbyfloat(ROLLUP_DELTAS_KEY, field, value)
+            else:
+                pipe.hincrby(ROLLUP_DELTAS_KEY, field, value)
+
+    @staticmethod
+    def record_deltas(deltas):
+        pipe = redis_client.pipeline(transaction=False)
+        StatsRollupService.buffer(pipe, deltas)
+        try:
+            pipe.execute()
+        except redis.RedisError as e:
+            # The state change itself is committed; rebuild_stats_rollups
+            # repairs the rollups if deltas were lost
+            logger.warning(f"Failed to record stats rollup deltas: {str(e)}")
+
+    @staticmethod
+    def aggregate(queryset):
+        """
+        Compute the delta fields that `queryset` contributes to the rollups
+        with two grouped queries, e.g. to subtract rows before deleting them.
+        """
+        hour = TruncHour("created_at", tzinfo=dt_timezone.utc)
+        latency = F("delivered_at") - F("created_at")
+        deltas = {}
+
+        rows = (
+            queryset.order_by()
+            .values("priority", "channel", "status", hour_start=hour)
+            .annotate(
+                count=Count("id"),
+                latency_count=Count("id", filter=DELIVERED),
+                latency_sum=Sum(latency, filter=DELIVERED),
+            )
+        )
+        for row in rows:
+            prefix = StatsRollupService._prefix(row)
+            deltas[f"{prefix}|count"] = row["count"]
+            if row["latency_count"]:
+                deltas[f"{prefix}|latency_count"] = row["latency_count"]
+                deltas[f"{prefix}|latency_sum"] = row["latency_sum"].total_seconds()
+
+        bucket = Case(
+            *[
+                When(latency__lte=timedelta(seconds=bound), then=Value(index))
+                for index, bound in enumerate(LATENCY_BUCKETS)
+            ],
+            default=Value(len(LATENCY_BUCKETS)),
+        )
+        rows = (
+            queryset.order_by()
+            .filter(DELIVERED)
+            .annotate(latency=latency)
+            .values("priority", "channel", "status", hour_start=hour, bucket=bucket)
+            .annotate(count=Count("id"))
+        )
+        for row in rows:
+            prefix = StatsRollupService._prefix(row)
+            deltas[f"{prefix}|bucket_{row['bucket']}"] = row["count"]
+        return deltas
+
+    @staticmethod
+    def _prefix(row):
+        return "|".join(
+            [
+                str(int(row["hour_start"].timestamp())),
+                row["priority"],
+                row["channel"],
+                row["status"],
+            ]
+        )
+
+    @staticmethod
+    def subtract(queryset):
+        """Buffer the removal of the rows in `queryset` from the rollups."""
+        deltas = StatsRollupService.aggregate(queryset)
+        if deltas:
+            StatsRollupService.record_deltas({f: -v for f, v in deltas.items()})
+
+    @staticmethod
+    def compact():
+        """
+        Fold the buffered deltas into the rollup tables.
+        Returns the number of rollup rows touched.
+        """
+        if not redis_client.set(ROLLUP_LOCK_KEY, 1, nx=True, ex=ROLLUP_LOCK_TIMEOUT):
+            return 0
+        try:
+            # A leftover hash means the previous compaction failed before
+            # applying it, so it is retried before taking new deltas
+            if not redis_client.exists(ROLLUP_COMPACTING_KEY):
+                try:
+                    redis_client.rename(ROLLUP_DELTAS_KEY, ROLLUP_COMPACTING_KEY)
+                except redis.ResponseError:
+                    return 0  # Nothing buffered
+
+            touched = StatsRollupService._apply(
+                redis_client.hgetall(ROLLUP_COMPACTING_KEY)
+            )
+            redis_client.delete(ROLLUP_COMPACTING_KEY)
+            return touched
+        finally:
+            redis_client.delete(ROLLUP_LOCK_KEY)
+
+    @staticmethod
+    def rebuild():
+        """
+        Recompute the rollups from the notifications table, e.g. after
+        deploying them on an existing table. Deltas recorded while it runs may
+        be lost, so run it while writes are quiet.
+        """
+        if not redis_client.set(ROLLUP_LOCK_KEY, 1, nx=True, ex=ROLLUP_LOCK_TIMEOUT):
+            raise RuntimeError("A stats rollup compaction is in progress")
+        try:
+            redis_client.delete(ROLLUP_DELTAS_KEY, ROLLUP_COMPACTING_KEY)
+            with transaction.atomic():
+                NotificationStatsRollup.objects.all().delete()
+                NotificationLatencyRollup.objects.all().delete()
+                return StatsRollupService._apply(
+                    StatsRollupService.aggregate(Notification.objects.all())
+                )
+        finally:
+            redis_client.delete(ROLLUP_LOCK_KEY)
+
+    @staticmethod
+    def _apply(deltas):
+        rows = defaultdict(dict)
+        buckets = defaultdict(dict)
+        for field, value in deltas.items():
+            key, metric = _parse_field(field)
+            key = tuple(key.items())
+            if metric.startswith("bucket_"):
+                buckets[key + (("bucket", int(metric[7:])),)]["count"] = int(value)
+            elif metric == "latency_sum":
+                rows[key][metric] = float(value)
+            else:
+                rows[key][metric] = int(value)
+
+        with transaction.atomic():
+            for model, updates in (
+                (NotificationStatsRollup, rows),
+                (NotificationLatencyRollup, buckets),
+            ):
+                for key, values in updates.items():
+                    key = dict(key)
+                    updated = model.objects.filter(**key).update(
+                        **{metric: F(metric) + value for metric, value in values.items()}
+                    )
+                    if not updated:
+                        model.objects.create(**key, **values)
+        return len(rows) + len(buckets)
+
+    @staticmethod
+    def read(status=None, priority=None, percentiles=False):
+        """
+        Return stats in the shape of NotificationStatsService.compute from
+        the rollups plus the deltas not compacted yet.
+        """
+        filters = {}
+        if status:
+            filters["status"] = status
+        if priority:
+            filters["priority"] = priority
+
+        totals = {s: defaultdict(float) for s in STATUSES}
+        rows = (
+            NotificationStatsRollup.objects.filter(**filters)
+            .values("status")
+            .annotate(
+                count=Sum("count"),
+                latency_count=Sum("latency_count"),
+                latency_sum=Sum("latency_sum"),
+            )
+        )
+        for row in rows:
+            for metric in ("count", "latency_count", "latency_sum"):
+                totals[row["status"]][metric] += row[metric]
+
+        buckets = defaultdict(int)
+        if percentiles:
+            rows = (
+                NotificationLatencyRollup.objects.filter(**filters)
+                .values("bucket")
+                .annotate(count=Sum("count"))
+            )
+            for row in rows:
+                buckets[row["bucket"]] += row["count"]
+
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hgetall(ROLLUP_DELTAS_KEY)
+        pipe.hgetall(ROLLUP_COMPACTING_KEY)
+        for pending in pipe.execute():
+            for field, value in pending.items():
+                key, metric = _parse_field(field)
+                if any(key[name] != wanted for name, wanted in filters.items()):
+                    continue
+                if metric.startswith("bucket_"):
+                    buckets[int(metric[7:])] += int(value)
+                else:
+                    totals[key["status"]][metric] += float(value)
+
+        total = int(sum(t["count"] for t in totals.values()))
+        counts = {s: int(totals[s]["count"]) for s in STATUSES}
+        latency_count = sum(t["latency_count"] for t in totals.values())
+        latency_sum = sum(t["latency_sum"] for t in totals.values())
+        stats = {
+            "total_notifications": total,
+            "delivered_count": counts["delivered"],
+            "read_count": counts["read"],
+            "failed_count": counts["failed"],
+            "pending_count": counts["pending"],
+            "delivery_rate": round(counts["delivered"] / total * 100, 2) if total else 0,
+            "read_rate": round(counts["read"] / total * 100, 2) if total else 0,
+            "avg_delivery_latency": (
+                round(latency_sum / latency_count, 3) if latency_count else 0
+            ),
+        }
+        if percentiles:
+            stats.update(StatsRollupService.histogram_percentiles(buckets))
+        return stats
+
+    @staticmethod
+    def histogram_percentiles(buckets):
+        """
+        Estimate latency percentiles from histogram bucket counts by linear
+        interpolation within the bucket holding each rank, the same way
+        Prometheus histogram_quantile does.
+        """
+        total = sum(buckets.values())
+        stats = {}
+        for name, percentile in LATENCY_PERCENTILES.items():
+            value = 0
+            rank = percentile * total
+            cumulative = 0
+            for index in range(len(LATENCY_BUCKETS) + 1):
+                count = buckets.get(index, 0)
+                if count and cumulative + count >= rank:
+                    if index == len(LATENCY_BUCKETS):
+                        value = LATENCY_BUCKETS[-1]
+                    else:
+                        lower = LATENCY_BUCKETS[index - 1] if index else 0
+                        upper = LATENCY_BUCKETS[index]
+                        value = lower + (upper - lower) * (rank - cumulative) / count
+                    break
+                cumulative += count
+            stats[f"latency_{name}"] = round(value, 3)
+        return stats
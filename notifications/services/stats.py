@@ -0,0 +1,103 @@
+from django.db import connection
+from django.db.models import Aggregate, Avg, Count, F, FloatField, Q
+from django.db.models.functions import Extract
+
+# Latency percentiles reported when requested
+LATENCY_PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+DELIVERED = Q(status__in=["delivered", "read"], delivered_at__isnull=False)
+
+
+class PercentileCont(Aggregate):
+    """PostgreSQL PERCENTILE_CONT ordered-set aggregate."""
+
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+class NotificationStatsService:
+    """Computes delivery statistics in the database, never loading rows."""
+
+    @staticmethod
+    def compute(queryset, percentiles=False):
+        """
+        Return the stats for `queryset` from one conditional aggregation
+        query. With `percentiles`, latency p50/p95/p99 (seconds) are added,
+        computed in the same query on PostgreSQL and with one ordered offset
+        query per percentile elsewhere.
+        """
+        latency = F("delivered_at") - F("created_at")
+        aggregates = {
+            "total": Count("id"),
+            "delivered": Count("id", filter=Q(status="delivered")),
+            "read": Count("id", filter=Q(status="read")),
+            "failed": Count("id", filter=Q(status="failed")),
+            "pending": Count("id", filter=Q(status="pending")),
+            "latency_count": Count("id", filter=DELIVERED),
+            "avg_latency": Avg(latency, filter=DELIVERED),
+        }
+        native_percentiles = percentiles and connection.vendor == "postgresql"
+        if native_percentiles:
+            for name, percentile in LATENCY_PERCENTILES.items():
+                aggregates[f"latency_{name}"] = PercentileCont(
+                    Extract(latency, "epoch"), percentile, filter=DELIVERED
+                )
+        result = queryset.aggregate(**aggregates)
+
+        total = result["total"]
+        avg_latency = result["avg_latency"]
+        stats = {
+            "total_notifications": total,
+            "delivered_count": result["delivered"],
+            "read_count": result["read"],
+            "failed_count": result["failed"],
+            "pending_count": result["pending"],
+            "delivery_rate": round(result["delivered"] / total * 100, 2) if total else 0,
+            "read_rate": round(result["read"] / total * 100, 2) if total else 0,
+            "avg_delivery_latency": (
+                round(avg_latency.total_seconds(), 3) if avg_latency else 0
+            ),
+        }
+
+        if native_percentiles:
+            for name in LATENCY_PERCENTILES:
+                value = result[f"latency_{name}"]
+                stats[f"latency_{name}"] = round(value, 3) if value is not None else 0
+        elif percentiles:
+            stats.update(
+                NotificationStatsService.latency_percentiles(
+                    queryset, result["latency_count"]
+                )
+            )
+        return stats
+
+    @staticmethod
+    def latency_percentiles(queryset, count):
+        """
+        Portable percentiles: for each percentile read the (at most two)
+        neighbouring latencies at its rank from an ordered query and
+        interpolate between them, matching PERCENTILE_CONT.
+        """
+        if not count:
+            return {f"latency_{name}": 0 for name in LATENCY_PERCENTILES}
+
+        latencies = (
+            queryset.filter(DELIVERED)
+            .annotate(latency=F("delivered_at") - F("created_at"))
+            .order_by("latency")
+            .values_list("latency", flat=True)
+        )
+        stats = {}
+        for name, percentile in LATENCY_PERCENTILES.items():
+            rank = (count - 1) * percentile
+            lower = int(rank)
+            values = [v.total_seconds() for v in latencies[lower:lower + 2]]
+            value = values[0]
+            if len(values) > 1:
+                value += (values[1] - values[0]) * (rank - lower)
+            stats[f"latency_{name}"] = round(value, 3)
+        return stats
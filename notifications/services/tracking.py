@@ -0,0 +1,137 @@
+import logging
+from collections import defaultdict
+import redis
+from channels.layers import get_channel_layer
+from django.db.models import Count
+from .connections import get_async_redis_client, redis_client
+from .counters import UnreadCounterService, update_counters_script
+from .delivery import NotificationDeliveryService, _group_send_many
+from .rollups import StatsRollupService
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationStateTracker:
+    """
+    Records notification state changes into the stats rollups and the unread
+    counters with a single Redis pipeline, then pushes the new counts to the
+    sockets of users whose unread count changed.
+
+    Changes are (user id, before, after) tuples, the states being
+    Notification.rollup_state() or None for a created or deleted notification.
+    """
+
+    @staticmethod
+    def record(changes):
+        NotificationStateTracker._record(
+            StatsRollupService.deltas(
+                [(before, after) for _, before, after in changes]
+            ),
+            UnreadCounterService.deltas(changes),
+        )
+
+    @staticmethod
+    def snapshot(queryset):
+        """
+        Capture what the rows of `queryset` contribute to the rollups and
+        counters, before a set-based UPDATE moves them to another status.
+        """
+        users = defaultdict(dict)
+        rows = (
+            queryset.order_by().values("user_id", "status").annotate(count=Count("id"))
+        )
+        for row in rows:
+            users[row["user_id"]][row["status"]] = row["count"]
+        return StatsRollupService.aggregate(queryset), users
+
+    @staticmethod
+    def record_moved(snapshot, status, push=True):
+        """
+        Record that the rows captured by snapshot() all moved to `status`,
+        with their delivery latency unchanged. Returns the new counts of the
+        users that have counters, pushing them to their sockets if `push`.
+        """
+        rollups, users = snapshot
+        rollup_deltas = defaultdict(int)
+        for field, value in rollups.items():
+            hour, priority, channel, old_status, metric = field.split("|")
+            if old_status != status:
+                moved = "|".join([hour, priority, channel, status, metric])
+                rollup_deltas[field] -= value
+                rollup_deltas[moved] += value
+        return NotificationStateTracker._record(
+            rollup_deltas, UnreadCounterService.moved_deltas(users, status), push
+        )
+
+    @staticmethod
+    def record_removed(snapshot, push=True):
+        """
+        Record that the rows captured by snapshot() left the notifications
+        table, e.g. deleted or archived in bulk.
+        """
+        rollups, users = snapshot
+        return NotificationStateTracker._record(
+            {field: -value for field, value in rollups.items()},
+            UnreadCounterService.moved_deltas(users, None),
+            push,
+        )
+
+    @staticmethod
+    def _record(rollup_deltas, counter_deltas, push=True):
+        if not rollup_deltas and not counter_deltas:
+            return {}
+
+        pipe = redis_client.pipeline(transaction=False)
+        StatsRollupService.buffer(pipe, rollup_deltas)
+        UnreadCounterService.queue(pipe, counter_deltas)
+        try:
+            results = pipe.execute()
+        except redis.RedisError as e:
+            # The state change itself is committed; compaction, rebuilds and
+            # counter reconciliation repair what was lost
+            logger.warning(f"Failed to record notification state changes: {str(e)}")
+            return {}
+
+        results = results[len(rollup_deltas):]
+        if push:
+            messages = UnreadCounterService.messages(counter_deltas, results)
+            if messages:
+                NotificationDeliveryService.send_many(messages)
+        return {
+            user_id: {"unread": int(counts[0]), "pending": int(counts[1])}
+            for user_id, counts in zip(counter_deltas, results)
+            if counts
+        }
+
+    @staticmethod
+    async def arecord(changes):
+        rollup_deltas = StatsRollupService.deltas(
+            [(before, after) for _, before, after in changes]
+        )
+        counter_deltas = UnreadCounterService.deltas(changes)
+        if not rollup_deltas and not counter_deltas:
+            return
+
+        pipe = get_async_redis_client().pipeline(transaction=False)
+        StatsRollupService.buffer(pipe, rollup_deltas)
+        for user_id, (unread, pending) in counter_deltas.items():
+            # EVAL rather than EVALSHA, a missing script would fail the
+            # whole pipeline
+            pipe.eval(
+                update_counters_script.script,
+                1,
+                UnreadCounterService.key(user_id),
+                unread,
+                pending,
+            )
+        try:
+            results = await pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Failed to record notification state changes: {str(e)}")
+            return
+
+        messages = UnreadCounterService.messages(
+            counter_deltas, results[len(rollup_deltas):]
+        )
+        if messages:
+            await _group_send_many(get_channel_layer(), messages)
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from .connections import redis_client
+from .invalidation import invalidation_listener
+
+logger = logging.getLogger(__name__)
+
+# Pub/sub channel announcing users that were changed or deleted
+USER_CHANGES_CHANNEL = "user_changes"
+
+
+class LocalUserCache:
+    """
+    In-process LRU cache of the users authenticated WebSocket handshakes
+    resolve to, so a reconnect storm does not fetch the same users again.
+    Entries are per (user, access token): a hit skips decoding the token, and
+    an entry never outlives its token's expiry or `ttl` seconds. At most
+    `size` entries are kept. A user's entries are evicted as soon as a
+    change to them is published on USER_CHANGES_CHANNEL.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.size > 0
+
+    def get(self, token):
+        """Return the cached user for an access token, or None."""
+        if not self.enabled:
+            return None
+        invalidation_listener.ensure_running()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def set(self, token, user, token_expires_at):
+        """Cache `user` for `token`, which expires at epoch `token_expires_at`."""
+        if not self.enabled:
+            return
+        lifetime = min(self.ttl, token_expires_at - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (user, time.monotonic() + lifetime)
+            self._tokens.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            for token in self._tokens.pop(user_id, ()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens.clear()
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[entry[0].id]
+
+
+def publish_user_change(user_id):
+    """Evict the user from the user caches of every process."""
+    user_cache.invalidate(user_id)
+    try:
+        redis_client.publish(USER_CHANGES_CHANNEL, user_id)
+    except Exception as e:
+        logger.warning(f"Failed to publish change of user {user_id}: {str(e)}")
+
+
+user_cache = LocalUserCache(
+    settings.NOTIFICATIONS_USER_CACHE_SIZE, settings.NOTIFICATIONS_USER_CACHE_TTL
+)
+invalidation_listener.subscribe(
+    USER_CHANGES_CHANNEL, user_cache.invalidate, user_cache.clear
+)
@@ -0,0 +1,16 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .services.user_cache import publish_user_change
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User, dispatch_uid="notifications_user_saved")
+@receiver(post_delete, sender=User, dispatch_uid="notifications_user_deleted")
+def evict_cached_user(sender, instance, **kwargs):
+    # After commit, so a handshake racing the change cannot cache the old
+    # row. The pk is read now, deletion clears it afterwards.
+    user_id = instance.pk
+    transaction.on_commit(lambda: publish_user_change(user_id))
@@ -1,197 +1,197 @@
 import logging
 from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from django.core.mail import send_mail
-from django.conf import settings
-from celery import shared_task
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-from .services.presence import PresenceService
+from django.utils.dateparse import parse_datetime
+from celery import group, shared_task
+
+from .services.archive import NotificationArchiveService
+from .services.cleanup import NotificationCleanupService
+from .services.counters import UnreadCounterService
+from .services.delivery import NotificationDeliveryService
+from .services.digest import DigestService
+from .services.email import EmailDispatchService
+from .services.offline import OfflineQueueService
+from .services.rollups import StatsRollupService
+from .services.tracking import NotificationStateTracker
+from .middleware.metrics import notifications_failed_total
 from .models import Notification
-from .serializers import NotificationSerializer
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, max_retries=3)
-def process_offline_notification(self, notification_id):
+@shared_task
+def process_offline_notification(notification_id):
     """
-    Retry delivery of notifications with exponential backoff.
-    If all WebSocket attempts fail, send email notification.
+    Hand a notification queued by a previous release, which scheduled one
+    retry task per offline notification, to the offline queue.
     """
-    try:
-        notification = Notification.objects.get(id=notification_id)
+    OfflineQueueService.enqueue([notification_id])
 
-        # Check if notification has exceeded retry attempts
-        if notification.delivery_attempts >= 3:
-            logger.info(
-                f"Notification {notification_id} exceeded max retries, sending email fallback"
-            )
-            send_notification_email(notification)
-            notification.mark_failed(
-                "Exceeded max WebSocket retry attempts, sent via email"
-            )
-            return
 
-        notification.increment_attempts()
+@shared_task
+def schedule_offline_notifications(notification_ids):
+    """Counterpart of process_offline_notification for bulk fan-outs."""
+    OfflineQueueService.enqueue(notification_ids)
+
 
-        if not PresenceService.is_online(notification.user.id):
-            logger.warning(f"User {notification.user.id} still offline, will retry")
-            retry_delays = [60, 300, 900]
-            retry_delay = retry_delays[
-                min(notification.delivery_attempts - 1, len(retry_delays) - 1)
-            ]
-            raise self.retry(countdown=retry_delay)
+@shared_task
+def flush_notification_batch(user_id):
+    """Deliver a user's batch of low priority notifications once its window ends."""
+    return NotificationDeliveryService.deliver_batch(user_id)
 
-        channel_layer = get_channel_layer()
-        serializer = NotificationSerializer(notification)
 
-        try:
-            async_to_sync(channel_layer.group_send)(
-                f"notifications_{notification.user.id}",
-                {"type": "notification_message", "notification": serializer.data},
-            )
-            notification.mark_delivered()
-            logger.info(
-                f"Notification {notification_id} delivered via WebSocket on retry"
-            )
-        except Exception as e:
-            logger.warning(
-                f"WebSocket delivery failed for notification {notification_id}: {str(e)}"
+@shared_task
+def sweep_offline_notifications():
+    """
+    Hand notifications still pending past their offline deadline to
+    send_offline_emails on their priority's lane. Runs every minute via
+    Celery Beat.
+    """
+    swept = 0
+    while True:
+        notification_ids = OfflineQueueService.claim_due()
+        if not notification_ids:
+            break
+        by_priority = {}
+        pending = Notification.objects.filter(
+            id__in=notification_ids, status="pending"
+        ).values_list("id", "priority")
+        for notification_id, priority in pending:
+            by_priority.setdefault(priority, []).append(notification_id)
+        for priority, ids in by_priority.items():
+            send_offline_emails.delay(notification_ids=ids, priority=priority)
+            swept += len(ids)
+
+    if swept:
+        logger.info(f"Queued email fallbacks for {swept} offline notifications")
+    return swept
+
+
+@shared_task
+def send_offline_emails(notification_ids, priority):
+    """
+    Send the email fallback for offline notifications still pending, and
+    mark the emailed ones failed unless they were delivered meanwhile. Those
+    whose email was not sent get a new deadline and are retried.
+    """
+    notifications = list(
+        Notification.objects.filter(
+            id__in=notification_ids, status="pending"
+        ).select_related("user")
+    )
+    if not notifications:
+        return 0
+    messages = [
+        EmailDispatchService.message(n.title, n.message, n.user.email)
+        for n in notifications
+    ]
+    sent = set(EmailDispatchService.dispatch(messages))
+    emailed, unsent = [], []
+    for notification, message in zip(notifications, messages):
+        (emailed if message in sent else unsent).append(notification.id)
+
+    reason = "User offline past the email fallback deadline, sent via email"
+    with transaction.atomic():
+        # Only rows still pending move, one delivered by a replay meanwhile
+        # keeps its status
+        locked = Notification.objects.filter(
+            id__in=list(
+                Notification.objects.select_for_update()
+                .filter(id__in=emailed, status="pending")
+                .values_list("id", flat=True)
             )
-            retry_delays = [60, 300, 900]
-            retry_delay = retry_delays[
-                min(notification.delivery_attempts - 1, len(retry_delays) - 1)
-            ]
-            raise self.retry(exc=e, countdown=retry_delay)
-
-    except Notification.DoesNotExist:
-        logger.error(f"Notification {notification_id} not found")
-    except Exception as e:
-        logger.error(
-            f"Error processing offline notification {notification_id}: {str(e)}"
         )
-        raise
-
-
-def send_notification_email(notification):
-    """Send notification via email as fallback"""
-    try:
-        send_mail(
-            subject=notification.title,
-            message=notification.message,
-            from_email=(
-                settings.DEFAULT_FROM_EMAIL
-                if hasattr(settings, "DEFAULT_FROM_EMAIL")
-                else "noreply@example.com"
-            ),
-            recipient_list=[notification.user.email],
-            fail_silently=False,
+        snapshot = NotificationStateTracker.snapshot(locked)
+        failed = locked.update(
+            status="failed",
+            failure_reason=reason,
+            last_attempt_at=timezone.now(),
+            version=F("version") + 1,
         )
-        logger.info(f"Email sent for notification {notification.id}")
-    except Exception as e:
-        logger.error(
-            f"Failed to send email for notification {notification.id}: {str(e)}"
+        transaction.on_commit(
+            lambda: NotificationStateTracker.record_moved(snapshot, "failed")
         )
+    notifications_failed_total.labels(priority=priority, reason=reason).inc(failed)
+
+    OfflineQueueService.enqueue(unsent)
+    logger.info(
+        f"Sent {len(emailed)} of {len(notifications)} offline email fallbacks, "
+        f"{len(unsent)} requeued"
+    )
+    return len(emailed)
 
 
 @shared_task
 def send_email_digest():
     """
     Send daily email digest of unread notifications to users.
-    Runs daily at 8 AM via Celery Beat.
+    Runs daily at 8 AM via Celery Beat, fanning recipients out in chunks to
+    send_digest_chunk tasks.
     """
-    # Find users with unread notifications from the last 24 hours
-    yesterday = timezone.now() - timedelta(days=1)
-
-    # Group notifications by user
-    from django.db.models import Count
+    # Users with unread notifications from the last 24 hours
+    since = timezone.now() - timedelta(days=1)
+    chunks = [
+        send_digest_chunk.s(user_ids, since.isoformat())
+        for user_ids in DigestService.recipient_chunks(since)
+    ]
+    if chunks:
+        group(chunks).apply_async()
+    logger.info(f"Queued digest emails in {len(chunks)} chunks")
+    return len(chunks)
 
-    users_with_unread = (
-        Notification.objects.filter(
-            status__in=["pending", "delivered"], created_at__gte=yesterday
-        )
-        .values("user")
-        .annotate(count=Count("id"))
-        .filter(count__gt=0)
-    )
 
-    for user_data in users_with_unread:
-        user_id = user_data["user"]
-        notification_count = user_data["count"]
-
-        # Get user's unread notifications
-        notifications = Notification.objects.filter(
-            user_id=user_id,
-            status__in=["pending", "delivered"],
-            created_at__gte=yesterday,
-        ).order_by("-created_at")[
-            :10
-        ]  # Limit to 10 most recent
-
-        # Build email content
-        message_lines = [
-            f"You have {notification_count} unread notification(s):\n",
-        ]
-
-        for notif in notifications:
-            message_lines.append(f"- {notif.title}: {notif.message}")
-
-        message = "\n".join(message_lines)
-
-        # Send digest email
-        try:
-            from users.models import User
-
-            user = User.objects.get(id=user_id)
-            send_mail(
-                subject=f"Daily Notification Digest - {notification_count} unread",
-                message=message,
-                from_email=(
-                    settings.DEFAULT_FROM_EMAIL
-                    if hasattr(settings, "DEFAULT_FROM_EMAIL")
-                    else "noreply@example.com"
-                ),
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
-            logger.info(
-                f"Sent digest email to user {user_id} with {notification_count} notifications"
-            )
-        except Exception as e:
-            logger.error(f"Failed to send digest email to user {user_id}: {str(e)}")
+@shared_task
+def send_digest_chunk(user_ids, since):
+    """Send the digest emails of a chunk of recipients."""
+    sent = DigestService.send(user_ids, parse_datetime(since))
+    logger.info(f"Sent {sent} digest emails for {len(user_ids)} users")
+    return sent
 
 
 @shared_task
 def cleanup_old_notifications():
     """
-    Delete notifications older than 7 days (configurable by priority).
+    Delete read notifications past their priority's retention, in bounded
+    id-ordered chunks. An interrupted run resumes where it stopped.
     Runs daily at 2 AM via Celery Beat.
     """
-    now = timezone.now()
+    report = NotificationCleanupService.run()
+    logger.info(
+        f"Cleanup complete: {report['deleted']} total notifications deleted "
+        f"({report['rows_per_second']} rows/s, longest chunk held locks for "
+        f"{report['max_lock_seconds']}s)"
+    )
+    return report
+
 
-    # Different TTL based on priority
-    ttl_config = {
-        "high": timedelta(days=1),  # High priority: 1 day
-        "medium": timedelta(days=7),  # Medium priority: 7 days
-        "low": timedelta(days=30),  # Low priority: 30 days
-    }
+@shared_task
+def archive_old_notifications():
+    """
+    Move read and failed notifications older than the hot window to
+    the archive. Runs daily at 3 AM via Celery Beat.
+    """
+    return NotificationArchiveService.archive()
 
-    total_deleted = 0
 
-    for priority, ttl in ttl_config.items():
-        cutoff_date = now - ttl
-        deleted_count, _ = Notification.objects.filter(
-            priority=priority,
-            created_at__lt=cutoff_date,
-            status="read",  # Only delete read notifications
-        ).delete()
+@shared_task
+def compact_notification_stats():
+    """
+    Fold the stats rollup deltas buffered in Redis into the rollup tables.
+    Runs every minute via Celery Beat.
+    """
+    touched = StatsRollupService.compact()
+    logger.info(f"Stats rollup compaction touched {touched} rollup rows")
+    return touched
 
-        total_deleted += deleted_count
-        logger.info(
-            f"Deleted {deleted_count} {priority} priority notifications older than {ttl.days} days"
-        )
 
-    logger.info(f"Cleanup complete: {total_deleted} total notifications deleted")
-    return total_deleted
+@shared_task
+def reconcile_unread_counters():
+    """
+    Reset the Redis unread counters from the database to repair drift.
+    Runs every 15 minutes via Celery Beat.
+    """
+    reconciled = UnreadCounterService.reconcile()
+    logger.info(f"Reconciled unread counters for {reconciled} users")
+    return reconciled
@@ -1,11 +1,113 @@
+import socket
+import threading
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+import msgpack
+import redis
+from aiosmtpd.controller import Controller
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+import orjson
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core import mail
+from django.utils import timezone
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
-from .models import Notification
+from rest_framework_simplejwt.tokens import AccessToken
+from .consumers import NotificationConsumer
+from .middleware import jwt_auth
+from .middleware.jwt_auth import JWTAuthMiddleware, get_user_from_token
+from .lanes import lane_concurrency, lane_queue, route_task
+from .tasks import (
+    send_digest_chunk,
+    send_email_digest,
+    send_offline_emails,
+    sweep_offline_notifications,
+)
+from .models import ArchivedNotification, Notification
+from .pagination import NotificationKeysetPagination
+from .services.archive import NotificationArchiveService
+from .services.batching import NotificationBatchService
+from .services.cleanup import CLEANUP_CURSOR_KEY, NotificationCleanupService
+from .services.connections import binary_redis_client
+from .services.counters import UnreadCounterService
+from .serializers import NotificationSerializer
+from .services.delivery import (
+    AsyncNotificationDeliveryService,
+    NotificationDeliveryService,
+)
+from .services.digest import DigestService
+from .services.email import EmailDispatchService
+from .services.invalidation import InvalidationListener
+from .services.offline import OFFLINE_DEADLINES_KEY
+from .services.payload import JSON, NotificationPayloadService
+from .services.presence import (
+    MAX_CONNECTIONS_PER_USER,
+    PRESENCE_CHANGES_CHANNEL,
+    AsyncPresenceService,
+    PresenceService,
+    presence_cache,
+    redis_client,
+)
+from .services.rate_limiter import LeasedTokenBucket, RateLimiterService, token_leases
+from .services.reads import NotificationReadService
+from .services.tracking import NotificationStateTracker
+from .services.rollups import (
+    ROLLUP_COMPACTING_KEY,
+    ROLLUP_DELTAS_KEY,
+    ROLLUP_LOCK_KEY,
+    StatsRollupService,
+)
+from .services.stats import NotificationStatsService
+from .services.user_cache import LocalUserCache, user_cache
 
 User = get_user_model()
 
 
+def clear_payload_cache():
+    keys = list(binary_redis_client.scan_iter("notification_payload:*"))
+    if keys:
+        binary_redis_client.delete(*keys)
+
+
+def clear_rollup_deltas():
+    redis_client.delete(ROLLUP_DELTAS_KEY, ROLLUP_COMPACTING_KEY, ROLLUP_LOCK_KEY)
+
+
+def clear_counters():
+    keys = list(redis_client.scan_iter("user_counts:*"))
+    if keys:
+        redis_client.delete(*keys)
+
+
+def clear_rate_limits():
+    token_leases.clear()
+    keys = list(redis_client.scan_iter("rate_limit:*"))
+    if keys:
+        redis_client.delete(*keys)
+
+
+def throttle_rates(**rates):
+    return {
+        **settings.REST_FRAMEWORK,
+        "DEFAULT_THROTTLE_RATES": {
+            **settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"],
+            **rates,
+        },
+    }
+
+
 class NotificationModelTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -63,6 +165,8 @@ class NotificationModelTest(APITestCase):
 
 class NotificationAPITest(APITestCase):
     def setUp(self):
+        clear_rollup_deltas()
+        clear_rate_limits()
         self.client = APIClient()
         self.user = User.objects.create_user(
             username="testuser", email="test@example.com", password="testpass123"
@@ -82,7 +186,7 @@ class NotificationAPITest(APITestCase):
 
         response = self.client.get("/api/notifications/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(len(response.data["results"]), 2)
 
     def test_create_notification_auto_user(self):
         data = {
@@ -98,6 +202,47 @@ class NotificationAPITest(APITestCase):
         self.assertEqual(notification.user, self.user)
         self.assertEqual(response.data["user"]["username"], "testuser")
 
+    def test_create_notification_delivers_to_online_user(self):
+        PresenceService.mark_online(self.user.id)
+        self.addCleanup(PresenceService.mark_offline, self.user.id)
+
+        data = {"title": "Online", "message": "Delivered right away"}
+        response = self.client.post("/api/notifications/", data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.status, "delivered")
+        self.assertIsNotNone(notification.delivered_at)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_low="2/hour"))
+    def test_create_is_throttled_by_priority(self):
+        data = {"title": "Test", "message": "Test", "priority": "low"}
+        for _ in range(2):
+            response = self.client.post("/api/notifications/", data)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post("/api/notifications/", data)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response["Retry-After"]), 3500)
+
+        # Other priorities have their own window
+        data["priority"] = "high"
+        response = self.client.post("/api/notifications/", data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(NOTIFICATIONS_LEASED_RATE_LIMIT_ACCOUNTS=["testuser"])
+    def test_service_accounts_are_throttled_from_a_lease(self):
+        data = {"title": "Test", "message": "Test", "priority": "low"}
+        with mock.patch.object(
+            RateLimiterService, "take", wraps=RateLimiterService.take
+        ) as take:
+            for _ in range(25):
+                response = self.client.post("/api/notifications/", data)
+                self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        take.assert_called_once_with(
+            "notifications_service", self.user.pk, token_leases.lease_size
+        )
+
     def test_create_notification_validation(self):
         data = {
             "title": "Test",
@@ -159,7 +304,7 @@ class NotificationAPITest(APITestCase):
 
         response = self.client.get("/api/notifications/?status=pending")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(len(response.data["results"]), 1)
 
     def test_filter_by_priority(self):
         Notification.objects.create(
@@ -171,20 +316,21 @@ class NotificationAPITest(APITestCase):
 
         response = self.client.get("/api/notifications/?priority=high")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(len(response.data["results"]), 1)
 
     def test_stats_endpoint(self):
-        Notification.objects.create(
-            user=self.user, title="Test 1", message="Test", status="pending"
-        )
-        n2 = Notification.objects.create(
-            user=self.user, title="Test 2", message="Test", status="delivered"
-        )
-        n2.mark_delivered()
-        n3 = Notification.objects.create(
-            user=self.user, title="Test 3", message="Test", status="read"
-        )
-        n3.mark_read()
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(
+                user=self.user, title="Test 1", message="Test", status="pending"
+            )
+            n2 = Notification.objects.create(
+                user=self.user, title="Test 2", message="Test", status="delivered"
+            )
+            n2.mark_delivered()
+            n3 = Notification.objects.create(
+                user=self.user, title="Test 3", message="Test", status="read"
+            )
+            n3.mark_read()
 
         response = self.client.get("/api/notifications/stats/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -192,6 +338,37 @@ class NotificationAPITest(APITestCase):
         self.assertEqual(response.data["pending_count"], 1)
         self.assertEqual(response.data["delivered_count"], 1)
         self.assertEqual(response.data["read_count"], 1)
+        self.assertNotIn("latency_p50", response.data)
+
+    def test_stats_are_aggregated_in_one_query(self):
+        now = timezone.now()
+        for seconds in [1, 2, 3, 4, 10]:
+            Notification.objects.create(
+                user=self.user,
+                title="Test",
+                message="Test",
+                status="delivered",
+                delivered_at=now,
+            )
+            Notification.objects.filter(delivered_at=now).update(
+                created_at=now - timedelta(seconds=seconds)
+            )
+            now += timedelta(seconds=1)
+        Notification.objects.create(user=self.user, title="Test", message="Test")
+
+        with self.assertNumQueries(1):
+            stats = NotificationStatsService.compute(Notification.objects.all())
+        self.assertEqual(stats["total_notifications"], 6)
+        self.assertEqual(stats["delivered_count"], 5)
+        self.assertEqual(stats["delivery_rate"], 83.33)
+        self.assertEqual(stats["avg_delivery_latency"], 4.0)
+
+        response = self.client.get(
+            f"/api/notifications/stats/?user={self.user.id}&percentiles=true"
+        )
+        self.assertEqual(response.data["latency_p50"], 3.0)
+        self.assertEqual(response.data["latency_p95"], 8.8)
+        self.assertEqual(response.data["latency_p99"], 9.76)
 
     def test_unauthenticated_access(self):
         self.client.force_authenticate(user=None)
@@ -206,6 +383,1553 @@ class NotificationAPITest(APITestCase):
 
         response = self.client.get("/api/notifications/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data["count"], 60)
+        self.assertNotIn("count", response.data)
         self.assertEqual(len(response.data["results"]), 50)
         self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(response.data["results"][-1]["title"], "Test 0")
+
+    def test_pagination_is_stable_across_equal_timestamps(self):
+        created_at = timezone.now()
+        for i in range(120):
+            Notification.objects.create(user=self.user, title=f"Test {i}", message="Test")
+        Notification.objects.update(created_at=created_at)
+
+        ids, url = [], "/api/notifications/?count=true"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.data["count"], 120)
+            ids += [n["id"] for n in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(
+            ids, list(Notification.objects.order_by("-id").values_list("id", flat=True))
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/notifications/?cursor=bogus")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class NotificationBulkCreateTest(APITestCase):
+    def setUp(self):
+        clear_rate_limits()
+        self.client = APIClient()
+        self.staff = User.objects.create_user(
+            username="staff", email="staff@example.com", password="testpass123",
+            is_staff=True,
+        )
+        self.recipients = [
+            User.objects.create_user(
+                username=f"recipient{i}", email=f"r{i}@example.com", password="testpass123"
+            )
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.staff)
+
+    def test_bulk_create_for_recipient_list(self):
+        data = {
+            "title": "Campaign",
+            "message": "Hello everyone",
+            "priority": "low",
+            "recipients": [user.id for user in self.recipients],
+        }
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 3)
+        self.assertEqual(
+            response.data["delivered"]
+            + response.data["batched"]
+            + response.data["queued"],
+            3,
+        )
+        self.assertEqual(
+            set(Notification.objects.values_list("user_id", flat=True)),
+            {user.id for user in self.recipients},
+        )
+
+    def test_bulk_create_delivers_to_online_recipients(self):
+        online_user = self.recipients[0]
+        PresenceService.mark_online(online_user.id)
+        self.addCleanup(PresenceService.mark_offline, online_user.id)
+
+        data = {
+            "title": "Campaign",
+            "message": "Hello everyone",
+            "recipients": [user.id for user in self.recipients],
+        }
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.data["delivered"], 1)
+        self.assertEqual(response.data["queued"], 2)
+        delivered = Notification.objects.get(status="delivered")
+        self.assertEqual(delivered.user, online_user)
+        self.assertIsNotNone(delivered.delivered_at)
+
+    def test_bulk_create_counts_batched_recipients_apart(self):
+        online_user = self.recipients[0]
+        PresenceService.mark_online(online_user.id)
+        self.addCleanup(PresenceService.mark_offline, online_user.id)
+        self.addCleanup(redis_client.delete, NotificationBatchService.key(online_user.id))
+
+        data = {
+            "title": "Digest",
+            "message": "Low priority",
+            "priority": "low",
+            "recipients": [user.id for user in self.recipients],
+        }
+        with mock.patch.object(NotificationBatchService, "schedule_flushes") as flushes:
+            response = self.client.post(
+                "/api/notifications/bulk/", data, format="json"
+            )
+        flushes.assert_called_once_with([online_user.id])
+        self.assertEqual(
+            {k: response.data[k] for k in ("delivered", "batched", "queued")},
+            {"delivered": 0, "batched": 1, "queued": 2},
+        )
+
+    def test_async_batching_opens_one_flush_per_batch(self):
+        user = self.recipients[0]
+        key = NotificationBatchService.key(user.id)
+        redis_client.delete(key)
+        self.addCleanup(redis_client.delete, key)
+        notifications = [
+            Notification.objects.create(user=user, title="Low", message="Test")
+            for _ in range(2)
+        ]
+        with mock.patch.object(NotificationBatchService, "schedule_flushes") as flushes:
+            for notification in notifications:
+                async_to_sync(NotificationBatchService.aadd)(notification)
+        flushes.assert_called_once_with([user.id])
+        self.assertEqual(
+            redis_client.lrange(key, 0, -1), [str(n.id) for n in notifications]
+        )
+
+    def test_bulk_create_for_recipient_filter(self):
+        data = {
+            "title": "Staff only",
+            "message": "Hello staff",
+            "recipient_filter": {"is_staff": True},
+        }
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["created"], 1)
+        self.assertEqual(Notification.objects.get().user, self.staff)
+
+    def test_bulk_create_requires_one_recipient_source(self):
+        data = {"title": "Campaign", "message": "Hello"}
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        data["recipient_filter"] = {"password": "x"}
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_requires_staff(self):
+        self.client.force_authenticate(user=self.recipients[0])
+        data = {"title": "Campaign", "message": "Hello", "recipients": [1]}
+        response = self.client.post("/api/notifications/bulk/", data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StatsRollupTest(APITestCase):
+    def setUp(self):
+        clear_rollup_deltas()
+        self.addCleanup(clear_rollup_deltas)
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications = [
+                Notification.objects.create(
+                    user=self.user, title=f"Test {i}", message="Test", priority=priority
+                )
+                for i, priority in enumerate(["high", "medium", "medium", "low", "low"])
+            ]
+            notifications[0].mark_delivered()
+            notifications[1].mark_delivered()
+            notifications[1].mark_read()
+            notifications[2].mark_failed("Connection timeout")
+            Notification.mark_delivered_many(notifications[3:4])
+            notifications[4].delete()
+
+    def assertMatchesTable(self, **filters):
+        queryset = Notification.objects.filter(**filters)
+        self.assertEqual(
+            StatsRollupService.read(**filters),
+            NotificationStatsService.compute(queryset),
+        )
+
+    def test_rollups_track_transitions_before_and_after_compaction(self):
+        self.assertMatchesTable()
+        self.assertGreater(StatsRollupService.compact(), 0)
+        self.assertFalse(redis_client.exists(ROLLUP_DELTAS_KEY))
+        self.assertMatchesTable()
+        self.assertMatchesTable(priority="medium")
+        self.assertMatchesTable(status="delivered")
+
+        Notification.objects.filter(priority="medium").update(status="pending")
+        StatsRollupService.rebuild()
+        self.assertMatchesTable()
+
+    def test_repeated_bulk_delivery_is_recorded_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(
+                user=self.user, title="Test", message="Test"
+            )
+            stale = Notification.objects.get(pk=notification.pk)
+            self.assertEqual(Notification.mark_delivered_many([notification]), 1)
+            # A second ack with a copy loaded while still pending changes nothing
+            self.assertEqual(Notification.mark_delivered_many([stale, stale]), 0)
+        self.assertEqual(stale.status, "pending")
+        self.assertMatchesTable()
+        self.assertMatchesTable(status="delivered")
+
+    def test_stats_endpoint_reads_rollups_without_scanning(self):
+        StatsRollupService.compact()
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/notifications/stats/?percentiles=true")
+        self.assertEqual(response.data["total_notifications"], 4)
+        self.assertEqual(response.data["read_count"], 1)
+        self.assertEqual(response.data["failed_count"], 1)
+        self.assertIn("latency_p99", response.data)
+
+    def test_subtract_removes_rows_before_deleting(self):
+        expired = Notification.objects.filter(status="read")
+        StatsRollupService.subtract(expired)
+        expired.delete()
+        self.assertMatchesTable()
+
+    def test_histogram_percentiles(self):
+        # 10 latencies in (0.1, 0.5] and 10 slower than every bucket
+        self.assertEqual(
+            StatsRollupService.histogram_percentiles({3: 10, 8: 10}),
+            {"latency_p50": 0.5, "latency_p95": 10.0, "latency_p99": 10.0},
+        )
+
+
+class UnreadCounterTest(APITestCase):
+    def setUp(self):
+        clear_counters()
+        self.addCleanup(clear_counters)
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.client.force_authenticate(user=self.user)
+        Notification.objects.create(user=self.user, title="Test", message="Test")
+
+    def test_counts_are_initialised_once_then_served_from_redis(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/notifications/unread_count/")
+        self.assertEqual(response.data, {"unread": 1, "pending": 1})
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/notifications/unread_count/")
+        self.assertEqual(response.data, {"unread": 1, "pending": 1})
+
+    def test_counts_follow_transitions(self):
+        UnreadCounterService.get(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = Notification.objects.create(
+                user=self.user, title="Test", message="Test"
+            )
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 2, "pending": 2}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.mark_delivered()
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 2, "pending": 1}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            notification.mark_read()
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 1, "pending": 1}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.get(status="pending").delete()
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 0, "pending": 0}
+        )
+
+    def test_counts_are_recorded_on_commit(self):
+        UnreadCounterService.get(self.user.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Notification.objects.create(user=self.user, title="Test", message="Test")
+            self.assertEqual(
+                UnreadCounterService.get(self.user.id), {"unread": 1, "pending": 1}
+            )
+        self.assertEqual(len(callbacks), 1)
+
+    def test_create_view_records_on_the_event_loop(self):
+        UnreadCounterService.get(self.user.id)
+        with mock.patch.object(NotificationStateTracker, "record") as record:
+            response = self.client.post(
+                "/api/notifications/", {"title": "Test", "message": "Test"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        record.assert_not_called()
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 2, "pending": 2}
+        )
+
+    def test_repeated_bulk_delivery_is_counted_once(self):
+        UnreadCounterService.get(self.user.id)
+        notification = Notification.objects.get()
+        stale = Notification.objects.get(pk=notification.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.mark_delivered_many([notification])
+            Notification.mark_delivered_many([stale])
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 1, "pending": 0}
+        )
+
+    def test_reconcile_repairs_drift(self):
+        UnreadCounterService.get(self.user.id)
+        Notification.objects.update(status="read")
+        self.assertEqual(UnreadCounterService.reconcile(), 1)
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 0, "pending": 0}
+        )
+
+
+class NotificationBulkMarkReadTest(APITestCase):
+    def setUp(self):
+        clear_counters()
+        clear_rollup_deltas()
+        self.addCleanup(clear_counters)
+        self.addCleanup(clear_rollup_deltas)
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.other_user = User.objects.create_user(
+            username="otheruser", email="other@example.com", password="testpass123"
+        )
+        self.client.force_authenticate(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.notifications = [
+                Notification.objects.create(
+                    user=self.user, title=f"Test {i}", message="Test"
+                )
+                for i in range(3)
+            ]
+            self.notifications[0].mark_delivered()
+            self.other = Notification.objects.create(
+                user=self.other_user, title="Other", message="Test"
+            )
+
+    def mark_read(self, data):
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                "/api/notifications/mark_read/", data, format="json"
+            )
+        updates = [q for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        return response
+
+    def test_mark_read_by_ids(self):
+        ids = [self.notifications[0].id, self.notifications[1].id, self.other.id]
+        response = self.mark_read({"ids": ids})
+        self.assertEqual(response.data, {"updated": 2})
+        self.assertEqual(Notification.objects.filter(status="read").count(), 2)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.status, "pending")
+
+    def test_mark_read_before_timestamp(self):
+        Notification.objects.filter(id=self.notifications[2].id).update(
+            created_at=timezone.now() + timedelta(hours=1)
+        )
+        response = self.mark_read({"before": timezone.now().isoformat()})
+        self.assertEqual(response.data, {"updated": 2})
+        self.notifications[2].refresh_from_db()
+        self.assertEqual(self.notifications[2].status, "pending")
+
+    def test_mark_all_read_keeps_counters_and_rollups_in_step(self):
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 3, "pending": 2}
+        )
+        response = self.mark_read({"all": True})
+        self.assertEqual(response.data, {"updated": 3})
+        self.assertEqual(
+            UnreadCounterService.get(self.user.id), {"unread": 0, "pending": 0}
+        )
+        self.assertEqual(
+            StatsRollupService.read(),
+            NotificationStatsService.compute(Notification.objects.all()),
+        )
+
+    def test_requires_exactly_one_selector(self):
+        for data in [{}, {"all": True, "ids": [1]}, {"all": False}]:
+            response = self.client.post(
+                "/api/notifications/mark_read/", data, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class OfflineQueueTest(APITestCase):
+    def setUp(self):
+        clear_rate_limits()
+        redis_client.delete(OFFLINE_DEADLINES_KEY)
+        self.addCleanup(redis_client.delete, OFFLINE_DEADLINES_KEY)
+        self.user = User.objects.create_user(
+            username="offline", email="offline@example.com", password="testpass123"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create(self, title):
+        response = self.client.post(
+            "/api/notifications/", {"title": title, "message": "Test"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Notification.objects.get(id=response.data["id"])
+
+    def test_offline_notifications_get_an_email_deadline(self):
+        notification = self.create("Offline")
+        deadline = redis_client.zscore(OFFLINE_DEADLINES_KEY, notification.id)
+        self.assertAlmostEqual(deadline, time.time() + 1260, delta=60)
+        self.assertEqual(sweep_offline_notifications(), 0)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, "pending")
+
+    @override_settings(NOTIFICATIONS_OFFLINE_EMAIL_DELAY=-1)
+    def test_sweeper_emails_notifications_still_pending(self):
+        missed = self.create("Missed")
+        replayed = self.create("Replayed")
+        replayed.mark_delivered()
+
+        with mock.patch.object(
+            send_offline_emails, "delay", side_effect=send_offline_emails
+        ) as delay:
+            self.assertEqual(sweep_offline_notifications(), 1)
+        delay.assert_called_once_with(notification_ids=[missed.id], priority="medium")
+        self.assertEqual([m.subject for m in mail.outbox], ["Missed"])
+        missed.refresh_from_db()
+        self.assertEqual(missed.status, "failed")
+        self.assertEqual(redis_client.zcard(OFFLINE_DEADLINES_KEY), 0)
+
+        # Claimed deadlines are not swept twice
+        self.assertEqual(sweep_offline_notifications(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_unsent_emails_stay_pending_and_are_requeued(self):
+        notification = self.create("Missed")
+        with mock.patch.object(EmailDispatchService, "dispatch", return_value=[]):
+            self.assertEqual(
+                send_offline_emails([notification.id], priority="medium"), 0
+            )
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, "pending")
+        self.assertIsNotNone(redis_client.zscore(OFFLINE_DEADLINES_KEY, notification.id))
+
+    def test_notifications_delivered_while_emailing_keep_their_status(self):
+        notification = self.create("Missed")
+
+        def replay_then_send(messages):
+            Notification.mark_delivered_many([Notification.objects.get()])
+            return messages
+
+        with mock.patch.object(
+            EmailDispatchService, "dispatch", side_effect=replay_then_send
+        ):
+            send_offline_emails([notification.id], priority="medium")
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, "delivered")
+
+
+class EmailDigestTest(APITestCase):
+    def setUp(self):
+        self.busy, self.quiet, self.done = [
+            User.objects.create_user(
+                username=name, email=f"{name}@example.com", password="testpass123"
+            )
+            for name in ("busy", "quiet", "done")
+        ]
+        for i in range(12):
+            Notification.objects.create(user=self.busy, title=f"Busy {i}", message="Test")
+        Notification.objects.create(user=self.quiet, title="Quiet", message="Test")
+        Notification.objects.create(
+            user=self.done, title="Read", message="Test", status="read"
+        )
+        self.since = timezone.now() - timedelta(days=1)
+
+    def test_recipients_are_streamed_in_chunks(self):
+        self.assertEqual(
+            list(DigestService.recipient_chunks(self.since, chunk_size=1)),
+            [[self.busy.id], [self.quiet.id]],
+        )
+
+    def test_digest_chunk_is_built_with_two_queries(self):
+        with self.assertNumQueries(2):
+            messages = DigestService.messages(
+                [self.busy.id, self.quiet.id, self.done.id], self.since
+            )
+        self.assertEqual(
+            [(m.to, m.subject) for m in messages],
+            [
+                (["busy@example.com"], "Daily Notification Digest - 12 unread"),
+                (["quiet@example.com"], "Daily Notification Digest - 1 unread"),
+            ],
+        )
+        lines = messages[0].body.splitlines()
+        self.assertEqual(lines[2], "- Busy 11: Test")
+        self.assertEqual(len(lines), 12)
+
+    def test_digest_fans_out_chunks_as_a_group(self):
+        with mock.patch("notifications.tasks.group") as group:
+            self.assertEqual(send_email_digest(), 1)
+        (chunk,) = group.call_args.args[0]
+        self.assertEqual(chunk.args[0], [self.busy.id, self.quiet.id])
+
+        self.assertEqual(send_digest_chunk(*chunk.args), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class NotificationArchiveTest(APITestCase):
+    def setUp(self):
+        clear_rate_limits()
+        clear_rollup_deltas()
+        clear_counters()
+        self.addCleanup(clear_rollup_deltas)
+        self.addCleanup(clear_counters)
+        self.user = User.objects.create_user(
+            username="archive", email="archive@example.com", password="testpass123"
+        )
+        self.client.force_authenticate(user=self.user)
+        old = timezone.now() - timedelta(days=40)
+        self.aged = [
+            self.create("read", old - timedelta(hours=i)) for i in range(3)
+        ] + [self.create("failed", old)]
+        self.hot = [
+            self.create("pending", old),
+            self.create("delivered", old),
+            self.create("delivered", timezone.now() - timedelta(days=1)),
+            self.create("delivered", timezone.now()),
+        ]
+        # Backdating bypasses the rollup deltas
+        StatsRollupService.rebuild()
+
+    def create(self, status, created_at):
+        notification = Notification.objects.create(
+            user=self.user, title="Old", message="Test"
+        )
+        Notification.objects.filter(id=notification.id).update(
+            status=status, created_at=created_at
+        )
+        return notification
+
+    def ids(self, notifications):
+        return {n.id for n in notifications}
+
+    def archive(self):
+        with mock.patch("notifications.services.archive.time.sleep") as sleep:
+            with self.captureOnCommitCallbacks(execute=True):
+                archived = NotificationArchiveService.archive(batch_size=3)
+        self.assertEqual(sleep.call_count, 1)
+        return archived
+
+    def test_archive_moves_aged_rows_in_batches(self):
+        self.assertEqual(UnreadCounterService.get(self.user.id)["unread"], 4)
+        self.assertEqual(self.archive(), 4)
+
+        self.assertEqual(
+            set(Notification.objects.values_list("id", flat=True)), self.ids(self.hot)
+        )
+        archived = ArchivedNotification.objects.get(id=self.aged[3].id)
+        self.assertEqual(archived.status, "failed")
+        self.assertEqual(archived.user_id, self.user.id)
+        self.assertEqual(
+            set(ArchivedNotification.objects.values_list("id", flat=True)),
+            self.ids(self.aged),
+        )
+        self.assertEqual(UnreadCounterService.get(self.user.id)["unread"], 4)
+        self.assertEqual(
+            StatsRollupService.read(),
+            NotificationStatsService.compute(Notification.objects.all()),
+        )
+
+    def test_aged_unread_rows_stay_hot_and_can_be_marked_read(self):
+        self.archive()
+        unread = self.hot[1]
+        self.assertFalse(ArchivedNotification.objects.filter(id=unread.id).exists())
+
+        response = self.client.patch(f"/api/notifications/{unread.id}/mark_read/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        unread.refresh_from_db()
+        self.assertEqual(unread.status, "read")
+
+    def test_reads_fall_through_to_the_archive_past_the_hot_window(self):
+        self.archive()
+        response = self.client.get(f"/api/notifications/{self.aged[0].id}/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["status"], "read")
+
+        recent = (timezone.now() - timedelta(days=2)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/api/notifications/", {"date_from": recent, "count": "true"}
+            )
+        self.assertEqual(response.data["count"], 2)
+        self.assertFalse(any("archivednotification" in q["sql"] for q in queries))
+
+        with mock.patch.object(NotificationKeysetPagination, "page_size", 1):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get("/api/notifications/")
+            # The first page ends inside the hot window
+            self.assertFalse(any("archivednotification" in q["sql"] for q in queries))
+
+            seen = []
+            while True:
+                seen += [row["id"] for row in response.data["results"]]
+                if not response.data["next"]:
+                    break
+                response = self.client.get(response.data["next"])
+
+        rows = list(Notification.objects.values_list("created_at", "id"))
+        rows += ArchivedNotification.objects.values_list("created_at", "id")
+        self.assertEqual(seen, [pk for _, pk in sorted(rows, reverse=True)])
+
+
+class NotificationCleanupTest(APITestCase):
+    def setUp(self):
+        clear_rollup_deltas()
+        self.addCleanup(clear_rollup_deltas)
+        redis_client.delete(CLEANUP_CURSOR_KEY)
+        self.addCleanup(redis_client.delete, CLEANUP_CURSOR_KEY)
+        self.user = User.objects.create_user(
+            username="cleanup", email="cleanup@example.com", password="testpass123"
+        )
+        now = timezone.now()
+        self.expired = [
+            self.create("high", "read", now - timedelta(days=2)) for _ in range(2)
+        ] + [self.create("medium", "read", now - timedelta(days=8)) for _ in range(5)]
+        self.kept = [
+            self.create("medium", "read", now - timedelta(days=1)),
+            self.create("medium", "delivered", now - timedelta(days=8)),
+            self.create("low", "read", now - timedelta(days=8)),
+        ]
+        # Backdating bypasses the rollup deltas
+        StatsRollupService.rebuild()
+
+    def create(self, priority, status, created_at):
+        notification = Notification.objects.create(
+            user=self.user, title="Old", message="Test", priority=priority
+        )
+        Notification.objects.filter(id=notification.id).update(
+            status=status, created_at=created_at
+        )
+        return notification
+
+    def assertOnlyKeptRemain(self):
+        self.assertEqual(
+            set(Notification.objects.values_list("id", flat=True)),
+            {n.id for n in self.kept},
+        )
+        self.assertEqual(
+            StatsRollupService.read(),
+            NotificationStatsService.compute(Notification.objects.all()),
+        )
+        self.assertFalse(redis_client.exists(CLEANUP_CURSOR_KEY))
+
+    def test_deletes_expired_rows_in_chunks(self):
+        with mock.patch("notifications.services.cleanup.time.sleep") as sleep:
+            with CaptureQueriesContext(connection) as queries, \
+                    self.captureOnCommitCallbacks(execute=True):
+                report = NotificationCleanupService.run(chunk_size=2)
+        self.assertEqual(report["deleted"], 7)
+        self.assertGreater(report["rows_per_second"], 0)
+        self.assertGreaterEqual(report["max_lock_seconds"], 0)
+        # One pause after each full chunk: high 2, medium 2 + 2
+        self.assertEqual(sleep.call_count, 3)
+        deletes = [q for q in queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(len(deletes), 4)
+        self.assertOnlyKeptRemain()
+
+    def test_failed_delete_leaves_rollups_untouched(self):
+        with mock.patch.object(QuerySet, "delete", side_effect=DatabaseError), \
+                self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(DatabaseError):
+                NotificationCleanupService.run(chunk_size=2)
+        self.assertEqual(
+            StatsRollupService.read(),
+            NotificationStatsService.compute(Notification.objects.all()),
+        )
+
+    def test_interrupted_run_resumes_after_last_deleted_id(self):
+        with mock.patch(
+            "notifications.services.cleanup.time.sleep", side_effect=RuntimeError
+        ), self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                NotificationCleanupService.run(chunk_size=2)
+        self.assertEqual(
+            redis_client.hget(CLEANUP_CURSOR_KEY, "high"), str(self.expired[1].id)
+        )
+
+        with mock.patch("notifications.services.cleanup.time.sleep"), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(NotificationCleanupService.run(chunk_size=2)["deleted"], 5)
+        self.assertOnlyKeptRemain()
+
+
+@skipUnless(connection.vendor == "sqlite", "Plans are in SQLite's EXPLAIN format")
+class QueryPlanTest(APITestCase):
+    """
+    The hot paths' query counts and the indexes their plans use, so an index
+    regression fails here rather than in production.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            [User(username=f"plan{i}", email=f"plan{i}@example.com") for i in range(20)]
+        )
+        users = list(User.objects.filter(username__startswith="plan"))
+        statuses = ["pending", "delivered", "read", "failed"]
+        Notification.objects.bulk_create(
+            [
+                Notification(
+                    user=user,
+                    title="Plan",
+                    message="Test",
+                    status=statuses[(i + n) % 4],
+                    priority=["high", "medium", "low"][n % 3],
+                )
+                for i, user in enumerate(users)
+                for n in range(60)
+            ]
+        )
+        with connection.cursor() as cursor:
+            # Spread over the last 60 days, so age filters are selective
+            cursor.execute(
+                "UPDATE notifications_notification SET created_at = "
+                "datetime('now', '-' || (id * 7 % 1440) || ' hours')"
+            )
+            cursor.execute("ANALYZE")
+        cls.user = users[0]
+        cls.user_ids = [user.id for user in users]
+
+    def setUp(self):
+        clear_rate_limits()
+        self.client.force_authenticate(user=self.user)
+
+    def capture(self, func, queries):
+        """Run `func` with `queries` queries, returning their plans."""
+        with self.assertNumQueries(queries):
+            with CaptureQueriesContext(connection) as captured:
+                func()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in captured:
+                cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                plans.append("\n".join(row[-1] for row in cursor.fetchall()))
+        return plans
+
+    def assertUsesIndex(self, plan, *indexes, ordered=False):
+        """
+        Assert the plan searches one of `indexes`, and with `ordered` that
+        it returns rows in index order without sorting them.
+        """
+        plan = plan.replace("COVERING ", "")
+        self.assertTrue(
+            any(f"USING INDEX {index}" in plan for index in indexes),
+            f"None of {indexes} in plan:\n{plan}",
+        )
+        if ordered:
+            self.assertNotIn("TEMP B-TREE FOR", plan)
+
+    def test_missed_notification_replay(self):
+        consumer = NotificationConsumer()
+        consumer.user, consumer.wire_format = self.user, JSON
+        get_missed = NotificationConsumer.__dict__["get_missed_notifications"].func
+        clear_payload_cache()
+        (plan,) = self.capture(lambda: get_missed(consumer, 0), queries=1)
+        self.assertUsesIndex(plan, "notif_pending_user_idx", ordered=True)
+
+    def test_unread_counts(self):
+        (plan,) = self.capture(
+            lambda: UnreadCounterService.count_from_database(self.user_ids[:5]),
+            queries=1,
+        )
+        self.assertUsesIndex(plan, "notif_user_status_idx")
+
+    def test_list_filters(self):
+        for params, index in [
+            ({}, "notif_created_idx"),
+            ({"user": self.user.id}, "notif_user_created_idx"),
+            ({"status": "read"}, "notif_status_created_idx"),
+        ]:
+            with self.subTest(params=params):
+                # A full page ending inside the hot window skips the archive
+                (plan,) = self.capture(
+                    lambda: self.client.get("/api/notifications/", params), queries=1
+                )
+                self.assertUsesIndex(plan, index, ordered=True)
+
+    def test_digest(self):
+        since = timezone.now() - timedelta(days=1)
+        (plan,) = self.capture(
+            lambda: list(DigestService.recipient_chunks(since)), queries=1
+        )
+        self.assertUsesIndex(plan, "notif_user_status_idx", "notif_status_created_idx")
+        rows, _ = self.capture(
+            lambda: DigestService.messages(self.user_ids[:5], since), queries=2
+        )
+        self.assertUsesIndex(rows, "notif_user_status_idx", "notif_user_created_idx")
+
+    def test_bulk_mark_read(self):
+        # Savepoint, the row lock, three snapshot queries by id, the UPDATE
+        # and the release
+        plans = self.capture(
+            lambda: NotificationReadService.mark_read(self.user), queries=7
+        )
+        self.assertUsesIndex(plans[1], "notif_user_status_idx")
+        for plan in plans[2:6]:
+            self.assertIn("USING INTEGER PRIMARY KEY", plan)
+
+    def test_cleanup_and_archive(self):
+        now = timezone.now()
+        (plan,) = self.capture(
+            lambda: list(NotificationCleanupService.expired("low", now)), queries=1
+        )
+        self.assertUsesIndex(plan, "notif_status_created_idx")
+        (plan,) = self.capture(
+            lambda: list(NotificationArchiveService.aged(now)), queries=1
+        )
+        # Either bounds the scan by age, which is what matters
+        self.assertUsesIndex(plan, "notif_status_created_idx", "notif_created_idx")
+
+
+class NotificationPayloadServiceTest(APITestCase):
+    def setUp(self):
+        clear_payload_cache()
+        self.user = User.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.notification = Notification.objects.create(
+            user=self.user, title="Test", message="Test"
+        )
+
+    def test_payload_is_encoded_once_per_version(self):
+        payloads = NotificationPayloadService.get(self.notification)
+        self.assertEqual(orjson.loads(payloads["json"])["title"], "Test")
+
+        with mock.patch(
+            "notifications.services.payload.NotificationSerializer"
+        ) as serializer:
+            self.assertEqual(NotificationPayloadService.get(self.notification), payloads)
+            serializer.assert_not_called()
+
+        self.notification.mark_delivered()
+        updated = orjson.loads(NotificationPayloadService.get(self.notification)["json"])
+        self.assertEqual(updated["status"], "delivered")
+        self.assertEqual(updated["version"], 2)
+
+    def test_compact_payload_schema(self):
+        compact = msgpack.unpackb(
+            NotificationPayloadService.get(self.notification, formats=["msgpack"])[
+                "msgpack"
+            ]
+        )
+        self.assertEqual(compact["i"], self.notification.id)
+        self.assertEqual(compact["u"], self.user.id)
+        self.assertEqual(compact["t"], "Test")
+        self.assertEqual(
+            compact["ca"], int(self.notification.created_at.timestamp() * 1000)
+        )
+        self.assertIsNone(compact["da"])
+        self.assertLess(
+            len(NotificationPayloadService.encode_compact(self.notification)),
+            len(NotificationPayloadService.encode(self.notification)),
+        )
+
+    def test_frame_wraps_payloads_without_reencoding(self):
+        payloads = NotificationPayloadService.get(self.notification)
+        for wire_format in ["json", "msgpack"]:
+            with self.subTest(wire_format=wire_format):
+                frame = NotificationPayloadService.decode(
+                    wire_format,
+                    NotificationPayloadService.frame(
+                        wire_format,
+                        {"type": "missed_notifications"},
+                        notifications=NotificationPayloadService.encoded_list(
+                            wire_format, [payloads[wire_format]] * 2
+                        ),
+                    ),
+                )
+                self.assertEqual(frame["type"], "missed_notifications")
+                self.assertEqual(len(frame["notifications"]), 2)
+
+
+class RateLimiterServiceTest(SimpleTestCase):
+    user_id = 987654
+
+    def setUp(self):
+        clear_rate_limits()
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_low="20/hour"))
+    def test_limit_holds_under_parallel_load(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(
+                executor.map(
+                    lambda _: RateLimiterService.check_rate_limit(self.user_id, "low"),
+                    range(100),
+                )
+            )
+        self.assertEqual(sum(allowed for allowed, _ in results), 20)
+        self.assertEqual(
+            sorted(remaining for allowed, remaining in results if allowed),
+            list(range(20)),
+        )
+        self.assertEqual(RateLimiterService.get_remaining(self.user_id, "low"), 0)
+
+    def age(self, scope, ident, ms):
+        """Move the scope's recorded requests `ms` into the past."""
+        key = RateLimiterService.key(scope, ident)
+        for member, score in redis_client.zrange(key, 0, -1, withscores=True):
+            redis_client.zadd(key, {member: score - ms})
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_medium="2/minute"))
+    def test_window_slides(self):
+        ident = RateLimiterService.action_ident(self.user_id)
+        self.assertEqual(RateLimiterService.get_remaining(self.user_id), 2)
+        self.assertEqual(RateLimiterService.check_rate_limit(self.user_id), (True, 1))
+        self.assertEqual(RateLimiterService.check_rate_limit(self.user_id), (True, 0))
+
+        allowed, _, retry_after = RateLimiterService.hit("notifications_medium", ident)
+        self.assertFalse(allowed)
+        self.assertTrue(0 < retry_after <= 60)
+
+        self.age("notifications_medium", ident, 30_000)
+        self.assertFalse(RateLimiterService.check_rate_limit(self.user_id)[0])
+        self.age("notifications_medium", ident, 30_000)
+        self.assertEqual(RateLimiterService.check_rate_limit(self.user_id), (True, 1))
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_medium="1/minute"))
+    def test_actions_are_limited_separately(self):
+        self.assertTrue(RateLimiterService.check_rate_limit(self.user_id)[0])
+        self.assertFalse(RateLimiterService.check_rate_limit(self.user_id)[0])
+        self.assertTrue(
+            RateLimiterService.check_rate_limit(self.user_id, action="bulk")[0]
+        )
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_medium="0/minute"))
+    def test_zero_limit_throttles_for_a_window(self):
+        allowed, remaining, retry_after = RateLimiterService.hit(
+            "notifications_medium", self.user_id
+        )
+        self.assertEqual((allowed, remaining, retry_after), (False, 0, 60))
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_service="250/hour"))
+    def test_leases_take_one_round_trip_per_batch(self):
+        bucket = LeasedTokenBucket(lease_size=100, lease_ttl=60)
+        with mock.patch.object(
+            RateLimiterService, "take", wraps=RateLimiterService.take
+        ) as take:
+            results = [
+                bucket.take("notifications_service", self.user_id)[0]
+                for _ in range(250)
+            ]
+        self.assertTrue(all(results))
+        self.assertEqual(take.call_count, 3)
+
+        allowed, retry_after = bucket.take("notifications_service", self.user_id)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 3500)
+
+    @override_settings(REST_FRAMEWORK=throttle_rates(notifications_service="250/hour"))
+    def test_leased_limit_holds_across_processes(self):
+        # Separate buckets stand in for separate worker processes
+        buckets = [LeasedTokenBucket(lease_size=30, lease_ttl=60) for _ in range(4)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(
+                    lambda i: buckets[i % 4].take("notifications_service", self.user_id),
+                    range(400),
+                )
+            )
+        self.assertEqual(sum(allowed for allowed, _ in results), 250)
+
+
+class PriorityLaneTest(SimpleTestCase):
+    def test_tasks_are_routed_to_their_lane(self):
+        self.assertEqual(
+            route_task("notifications.tasks.send_offline_emails", [], {"priority": "high"}, {}),
+            {"queue": "notifications.high"},
+        )
+        self.assertEqual(
+            route_task("notifications.tasks.send_email_digest", [], {}, {}),
+            {"queue": "notifications.maintenance"},
+        )
+        self.assertEqual(
+            route_task("notifications.tasks.flush_notification_batch", [1], {}, {}),
+            {"queue": "notifications.low"},
+        )
+        self.assertIsNone(route_task("other.task", [], {}, {}))
+        self.assertEqual(
+            lane_concurrency(
+                ["notifications.high", "notifications.low"],
+                {"high": 8, "medium": 4, "low": 2, "maintenance": 1},
+            ),
+            10,
+        )
+
+    def test_high_lane_is_consumed_while_low_lane_is_saturated(self):
+        app = Celery("lanes", broker="memory://", set_as_current=False)
+        app.conf.task_routes = (route_task,)
+        app.conf.task_default_queue = lane_queue("medium")
+        app.conf.broker_transport_options = {"polling_interval": 0.01}
+        release_low, high_done = threading.Event(), threading.Event()
+        finished = []
+
+        @app.task(name="lanes.deliver", bind=True)
+        def deliver(self, priority):
+            if priority == "low":
+                # Holds the low lane's only worker slot until released
+                release_low.wait(10)
+            finished.append((priority, self.request.delivery_info["routing_key"]))
+            if priority == "high":
+                high_done.set()
+
+        with start_worker(
+            app, queues=[lane_queue("low")], perform_ping_check=False
+        ), start_worker(app, queues=[lane_queue("high")], perform_ping_check=False):
+            for _ in range(20):
+                deliver.delay(priority="low")
+            deliver.delay(priority="high")
+            try:
+                # Liveness bound only; the assertions below are on ordering
+                self.assertTrue(high_done.wait(10))
+                self.assertEqual(finished, [("high", lane_queue("high"))])
+            finally:
+                release_low.set()
+
+
+class RecordingSMTPHandler:
+    def __init__(self):
+        self.connections = 0
+        self.messages = []
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class EmailDispatchTest(SimpleTestCase):
+    def setUp(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.handler = RecordingSMTPHandler()
+        controller = Controller(self.handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        smtp = override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1",
+            EMAIL_PORT=port,
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER="",
+            EMAIL_HOST_PASSWORD="",
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+
+    def messages(self, count):
+        return [
+            EmailDispatchService.message(f"Subject {i}", "Body", f"user{i}@example.com")
+            for i in range(count)
+        ]
+
+    @override_settings(NOTIFICATIONS_EMAIL_CONNECTIONS=1)
+    def test_messages_share_one_connection(self):
+        self.assertEqual(EmailDispatchService.send_many(self.messages(25), batch_size=10), 25)
+        self.assertEqual(len(self.handler.messages), 25)
+        self.assertEqual(self.handler.connections, 1)
+
+    @override_settings(NOTIFICATIONS_EMAIL_CONNECTIONS=3)
+    def test_batches_are_spread_over_concurrent_connections(self):
+        self.assertEqual(EmailDispatchService.send_many(self.messages(95), batch_size=10), 95)
+        self.assertEqual(
+            sorted(m.rcpt_tos[0] for m in self.handler.messages),
+            sorted(f"user{i}@example.com" for i in range(95)),
+        )
+        self.assertEqual(self.handler.connections, 3)
+
+
+class PresenceServiceTest(SimpleTestCase):
+    user_id = 987654
+
+    def setUp(self):
+        self.addCleanup(
+            redis_client.delete,
+            f"user_connections:{self.user_id}",
+            f"user_presence:{self.user_id}",
+        )
+
+    def test_connect_and_disconnect(self):
+        self.assertTrue(PresenceService.connect(self.user_id, "channel.1"))
+        self.assertTrue(PresenceService.is_online(self.user_id))
+        self.assertTrue(PresenceService.connect(self.user_id, "channel.2"))
+
+        self.assertEqual(PresenceService.disconnect(self.user_id, "channel.1"), 1)
+        self.assertTrue(PresenceService.is_online(self.user_id))
+        self.assertEqual(PresenceService.disconnect(self.user_id, "channel.2"), 0)
+        self.assertFalse(PresenceService.is_online(self.user_id))
+
+    def test_connection_limit_holds_under_parallel_connects(self):
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(
+                executor.map(
+                    lambda i: PresenceService.connect(self.user_id, f"channel.{i}"),
+                    range(50),
+                )
+            )
+        self.assertEqual(sum(results), MAX_CONNECTIONS_PER_USER)
+        self.assertEqual(
+            PresenceService.get_connection_count(self.user_id), MAX_CONNECTIONS_PER_USER
+        )
+
+    def test_refresh_presence_only_when_online(self):
+        self.assertFalse(PresenceService.refresh_presence(self.user_id))
+        PresenceService.connect(self.user_id, "channel.1")
+        self.assertTrue(PresenceService.refresh_presence(self.user_id))
+
+    def test_presence_changes_are_published(self):
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(PRESENCE_CHANGES_CHANNEL)
+        self.addCleanup(pubsub.close)
+
+        PresenceService.connect(self.user_id, "channel.1")
+        PresenceService.connect(self.user_id, "channel.2")
+        PresenceService.disconnect(self.user_id, "channel.1")
+        PresenceService.disconnect(self.user_id, "channel.2")
+
+        messages = []
+        deadline = time.monotonic() + 2
+        while len(messages) < 2 and time.monotonic() < deadline:
+            message = pubsub.get_message(timeout=0.1)
+            if message:
+                messages.append(message["data"])
+        self.assertIsNone(pubsub.get_message(timeout=0.1))
+        # Only the offline -> online and online -> offline flips are announced
+        self.assertEqual(messages, [str(self.user_id), str(self.user_id)])
+
+    def test_cached_lookup_is_invalidated_by_presence_changes(self):
+        self.addCleanup(presence_cache.clear)
+        with mock.patch.object(presence_cache, "ttl", 60):
+            self.assertEqual(
+                PresenceService.is_online_many([self.user_id], cached=True),
+                {self.user_id: False},
+            )
+            while not redis_client.pubsub_numsub(PRESENCE_CHANGES_CHANNEL)[0][1]:
+                time.sleep(0.01)
+
+            PresenceService.connect(self.user_id, "channel.1")
+            deadline = time.monotonic() + 2
+            while not PresenceService.is_online(self.user_id, cached=True):
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class NotificationConsumerTest(TransactionTestCase):
+    def setUp(self):
+        clear_payload_cache()
+        clear_counters()
+        self.user = User.objects.create_user(
+            username="wsuser", email="ws@example.com", password="testpass123"
+        )
+        self.addCleanup(
+            redis_client.delete,
+            f"user_connections:{self.user.id}",
+            f"user_presence:{self.user.id}",
+            f"user_cursor:{self.user.id}",
+            f"notification_batch:{self.user.id}",
+        )
+
+    async def connect(self, subprotocols=None):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(),
+            "/ws/notifications/",
+            subprotocols=subprotocols,
+        )
+        communicator.scope["user"] = self.user
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, (subprotocols or [None])[0])
+        return communicator
+
+    async def test_presence_follows_connection_lifecycle(self):
+        communicator = await self.connect()
+        self.assertTrue(await AsyncPresenceService.is_online(self.user.id))
+
+        await communicator.send_json_to({"type": "ping"})
+        self.assertEqual(await communicator.receive_json_from(), {"type": "pong"})
+
+        await communicator.disconnect()
+        self.assertFalse(await AsyncPresenceService.is_online(self.user.id))
+
+    async def test_notification_frames_use_cached_payload(self):
+        communicator = await self.connect()
+        payloads = {"json": b'{"id":1,"title":"Hello"}', "msgpack": b""}
+        await get_channel_layer().group_send(
+            f"notifications_{self.user.id}",
+            {"type": "notification_message", "payloads": payloads},
+        )
+        self.assertEqual(
+            await communicator.receive_json_from(),
+            {"type": "notification", "notification": {"id": 1, "title": "Hello"}},
+        )
+        await communicator.disconnect()
+
+    async def test_missed_notifications_are_replayed_on_connect(self):
+        await Notification.objects.acreate(user=self.user, title="Missed", message="Test")
+        communicator = await self.connect()
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "missed_notifications")
+        self.assertEqual(frame["notifications"][0]["title"], "Missed")
+        await communicator.disconnect()
+
+    async def test_replay_is_chunked_and_advances_cursor_on_ack(self):
+        notifications = [
+            await Notification.objects.acreate(
+                user=self.user, title=f"Missed {i}", message="Test"
+            )
+            for i in range(3)
+        ]
+        with mock.patch("notifications.consumers.REPLAY_CHUNK_SIZE", 2):
+            communicator = await self.connect()
+            frame = await communicator.receive_json_from()
+            self.assertEqual(
+                [n["id"] for n in frame["notifications"]],
+                [n.id for n in notifications[:2]],
+            )
+            self.assertTrue(frame["more"])
+            # Nothing more is sent until the chunk is acknowledged
+            self.assertTrue(await communicator.receive_nothing())
+
+            await communicator.send_json_to(
+                {"type": "replay_ack", "cursor": frame["cursor"]}
+            )
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["notifications"][0]["id"], notifications[2].id)
+            self.assertFalse(frame["more"])
+            await communicator.send_json_to(
+                {"type": "replay_ack", "cursor": frame["cursor"]}
+            )
+            await communicator.send_json_to({"type": "ping"})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+        self.assertEqual(
+            await AsyncPresenceService.get_missed_notifications_cursor(self.user.id),
+            notifications[2].id,
+        )
+        self.assertFalse(
+            await Notification.objects.filter(user=self.user, status="pending").aexists()
+        )
+
+        # Reconnecting only replays notifications created since the last ack
+        await Notification.objects.acreate(user=self.user, title="New", message="Test")
+        communicator = await self.connect()
+        frame = await communicator.receive_json_from()
+        self.assertEqual([n["title"] for n in frame["notifications"]], ["New"])
+        await communicator.disconnect()
+
+    async def test_unread_count_is_pushed_on_change(self):
+        communicator = await self.connect()
+        await database_sync_to_async(UnreadCounterService.get)(self.user.id)
+
+        await Notification.objects.acreate(user=self.user, title="New", message="Test")
+        self.assertEqual(
+            await communicator.receive_json_from(),
+            {"type": "unread_count", "unread": 1, "pending": 1},
+        )
+        await communicator.disconnect()
+
+    async def test_bulk_mark_read_sends_one_sync_event(self):
+        for i in range(3):
+            await Notification.objects.acreate(
+                user=self.user, title="Test", message="Test"
+            )
+        await database_sync_to_async(UnreadCounterService.get)(self.user.id)
+        communicator = await self.connect()
+        frame = await communicator.receive_json_from()
+        await communicator.send_json_to(
+            {"type": "replay_ack", "cursor": frame["cursor"]}
+        )
+        await communicator.send_json_to({"type": "ping"})
+        await communicator.receive_json_from()
+
+        updated = await database_sync_to_async(NotificationReadService.mark_read)(
+            self.user
+        )
+        self.assertEqual(updated, 3)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "notifications_read")
+        self.assertTrue(frame["all"])
+        self.assertEqual((frame["unread"], frame["pending"]), (0, 0))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_acks_and_reads_are_batched_into_one_update_each(self):
+        notifications = [
+            await Notification.objects.acreate(
+                user=self.user, title=f"Missed {i}", message="Test"
+            )
+            for i in range(4)
+        ]
+        other = await User.objects.acreate_user(username="other_ws")
+        foreign = await Notification.objects.acreate(
+            user=other, title="Not yours", message="Test"
+        )
+        ids = [n.id for n in notifications]
+
+        with mock.patch(
+            "notifications.consumers.RECEIPT_FLUSH_DELAY", 0.05
+        ), mock.patch.object(
+            Notification,
+            "mark_delivered_many",
+            wraps=Notification.mark_delivered_many,
+        ) as mark_delivered_many, mock.patch.object(
+            NotificationReadService, "mark_read", wraps=NotificationReadService.mark_read
+        ) as mark_read:
+            communicator = await self.connect()
+            await communicator.receive_json_from()  # missed_notifications
+
+            await communicator.send_json_to({"type": "ack", "ids": ids[:2]})
+            await communicator.send_json_to({"type": "ack", "ids": [ids[2], foreign.id]})
+            await communicator.send_json_to({"type": "read", "ids": [ids[3]]})
+            await communicator.send_json_to({"type": "read", "ids": [ids[0]]})
+
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame["type"], "notifications_read")
+            self.assertEqual(frame["ids"], [ids[0], ids[3]])
+            await communicator.disconnect()
+
+        mark_delivered_many.assert_called_once()
+        mark_read.assert_called_once()
+        statuses = {
+            n.id: n.status
+            async for n in Notification.objects.filter(id__in=ids + [foreign.id])
+        }
+        self.assertEqual(
+            statuses,
+            {
+                ids[0]: "read",
+                ids[1]: "delivered",
+                ids[2]: "delivered",
+                ids[3]: "read",
+                foreign.id: "pending",
+            },
+        )
+
+    async def test_buffered_receipts_are_flushed_on_disconnect(self):
+        notification = await Notification.objects.acreate(
+            user=self.user, title="Missed", message="Test"
+        )
+        communicator = await self.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({"type": "ack", "ids": [notification.id]})
+        await communicator.send_json_to({"type": "ping"})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        await notification.arefresh_from_db()
+        self.assertEqual(notification.status, "delivered")
+        self.assertIsNotNone(notification.delivered_at)
+
+    @override_settings(NOTIFICATIONS_BATCH_WINDOW=30)
+    async def test_low_priority_notifications_are_delivered_as_one_batch(self):
+        communicator = await self.connect()
+        # Let the replay on connect finish before creating notifications
+        await communicator.send_json_to({"type": "ping"})
+        await communicator.receive_json_from()
+        notifications = []
+        with mock.patch(
+            "notifications.tasks.flush_notification_batch.apply_async"
+        ) as apply_async:
+            for i in range(3):
+                notification = await Notification.objects.acreate(
+                    user=self.user, title=f"Low {i}", message="Test", priority="low"
+                )
+                data = await database_sync_to_async(
+                    lambda: NotificationSerializer(notification).data
+                )()
+                await AsyncNotificationDeliveryService.deliver(notification, data)
+                notifications.append(notification)
+        apply_async.assert_called_once_with(args=[self.user.id], countdown=30)
+        self.assertTrue(await communicator.receive_nothing())
+
+        delivered = await database_sync_to_async(
+            NotificationDeliveryService.deliver_batch
+        )(self.user.id)
+        self.assertEqual(delivered, 3)
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame["type"], "notifications")
+        self.assertEqual(
+            [n["title"] for n in frame["notifications"]], ["Low 0", "Low 1", "Low 2"]
+        )
+        self.assertFalse(
+            await Notification.objects.filter(user=self.user, status="pending").aexists()
+        )
+        await communicator.disconnect()
+
+    async def test_msgpack_subprotocol_uses_binary_frames(self):
+        notification = await Notification.objects.acreate(
+            user=self.user, title="Missed", message="Test"
+        )
+        communicator = await self.connect(subprotocols=["notifications.msgpack"])
+        frame = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(frame["type"], "missed_notifications")
+        self.assertEqual(frame["notifications"][0]["i"], notification.id)
+
+        await communicator.send_to(bytes_data=msgpack.packb({"type": "ping"}))
+        self.assertEqual(
+            msgpack.unpackb(await communicator.receive_from()), {"type": "pong"}
+        )
+        await communicator.disconnect()
+
+
+class LocalUserCacheTest(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LocalUserCache(size=2, ttl=60)
+        expires_at = time.time() + 300
+        for user_id in (1, 2):
+            cache.set(f"token{user_id}", User(id=user_id), expires_at)
+        cache.get("token1")
+        cache.set("token3", User(id=3), expires_at)
+        self.assertEqual(cache.get("token1").id, 1)
+        self.assertIsNone(cache.get("token2"))
+        self.assertEqual(cache.get("token3").id, 3)
+
+    def test_entries_expire_with_their_token(self):
+        cache = LocalUserCache(size=10, ttl=60)
+        cache.set("expired", User(id=1), time.time() - 1)
+        self.assertIsNone(cache.get("expired"))
+        cache.set("expiring", User(id=1), time.time() + 0.05)
+        self.assertIsNotNone(cache.get("expiring"))
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("expiring"))
+
+    def test_invalidate_evicts_every_token_of_the_user(self):
+        cache = LocalUserCache(size=10, ttl=60)
+        expires_at = time.time() + 300
+        cache.set("a", User(id=1), expires_at)
+        cache.set("b", User(id=1), expires_at)
+        cache.set("c", User(id=2), expires_at)
+        cache.invalidate(1)
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c").id, 2)
+
+
+class InvalidationListenerTest(SimpleTestCase):
+    def test_one_connection_serves_every_channel(self):
+        listener = InvalidationListener()
+        received = []
+        for channel in ("test_changes_a", "test_changes_b"):
+            listener.subscribe(
+                channel, lambda i, c=channel: received.append((c, i)), mock.Mock()
+            )
+        with mock.patch.object(
+            redis_client, "pubsub", wraps=redis_client.pubsub
+        ) as pubsub:
+            listener.ensure_running()
+            deadline = time.monotonic() + 2
+            while not redis_client.pubsub_numsub("test_changes_b")[0][1]:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+            redis_client.publish("test_changes_a", 1)
+            redis_client.publish("test_changes_b", 2)
+            while len(received) < 2:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        self.assertEqual(received, [("test_changes_a", 1), ("test_changes_b", 2)])
+        self.assertEqual(pubsub.call_count, 1)
+
+    def test_failed_connection_is_closed_and_caches_cleared(self):
+        listener = InvalidationListener()
+        clear = mock.Mock()
+        listener.subscribe("test_changes", mock.Mock(), clear)
+        failed = mock.Mock()
+        failed.get_message.side_effect = redis.ConnectionError
+        with mock.patch.object(redis_client, "pubsub", return_value=failed), \
+                mock.patch(
+                    "notifications.services.invalidation.time.sleep",
+                    side_effect=RuntimeError,
+                ):
+            with self.assertRaises(RuntimeError):
+                listener._listen()
+        failed.close.assert_called_once()
+        clear.assert_called_once()
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class JWTAuthMiddlewareTest(TransactionTestCase):
+    def setUp(self):
+        clear_payload_cache()
+        user_cache.clear()
+        self.addCleanup(user_cache.clear)
+        self.user = User.objects.create_user(
+            username="jwtuser", email="jwt@example.com", password="testpass123"
+        )
+        self.token = str(AccessToken.for_user(self.user))
+        self.addCleanup(
+            redis_client.delete,
+            f"user_connections:{self.user.id}",
+            f"user_presence:{self.user.id}",
+            f"user_cursor:{self.user.id}",
+        )
+
+    async def test_handshakes_reuse_the_cached_user(self):
+        with mock.patch.object(
+            jwt_auth, "load_user_from_token", wraps=jwt_auth.load_user_from_token
+        ) as load:
+            for _ in range(3):
+                user = await get_user_from_token(self.token)
+                self.assertEqual(user.id, self.user.id)
+        self.assertEqual(load.call_count, 1)
+
+        other = await get_user_from_token(str(AccessToken.for_user(self.user)) + "x")
+        self.assertTrue(other.is_anonymous)
+
+    async def test_deactivation_evicts_the_cached_user(self):
+        self.assertTrue((await get_user_from_token(self.token)).is_authenticated)
+        self.user.is_active = False
+        await self.user.asave(update_fields=["is_active"])
+        self.assertTrue((await get_user_from_token(self.token)).is_anonymous)
+
+    async def connect(self, subprotocols):
+        communicator = WebsocketCommunicator(
+            JWTAuthMiddleware(NotificationConsumer.as_asgi()),
+            "/ws/notifications/",
+            subprotocols=subprotocols,
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        # Only authenticated sockets register presence
+        self.assertTrue(await AsyncPresenceService.is_online(self.user.id))
+        await communicator.disconnect()
+        return subprotocol
+
+    async def test_token_in_subprotocol(self):
+        self.assertEqual(
+            await self.connect(["access_token", self.token]), "access_token"
+        )
+        self.assertEqual(
+            await self.connect(["notifications.msgpack", "access_token", self.token]),
+            "notifications.msgpack",
+        )
@@ -3,9 +3,12 @@ from prometheus_client import generate_latest
 from django.http import HttpResponse
 from .views import (
     NotificationListCreateView,
+    NotificationBulkCreateView,
+    NotificationBulkMarkReadView,
     NotificationDetailView,
     NotificationMarkReadView,
     NotificationStatsView,
+    NotificationUnreadCountView,
 )
 
 
@@ -15,8 +18,11 @@ def metrics_view(request):
 
 urlpatterns = [
     path("notifications/", NotificationListCreateView.as_view(), name="notification-list"),
+    path("notifications/bulk/", NotificationBulkCreateView.as_view(), name="notification-bulk-create"),
+    path("notifications/mark_read/", NotificationBulkMarkReadView.as_view(), name="notification-bulk-mark-read"),
     path("notifications/<int:pk>/", NotificationDetailView.as_view(), name="notification-detail"),
     path("notifications/<int:pk>/mark_read/", NotificationMarkReadView.as_view(), name="notification-mark-read"),
     path("notifications/stats/", NotificationStatsView.as_view(), name="notification-stats"),
+    path("notifications/unread_count/", NotificationUnreadCountView.as_view(), name="notification-unread-count"),
     path("metrics/", metrics_view, name="metrics"),
 ]
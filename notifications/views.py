@@ -1,27 +1,67 @@
 import logging
+from asgiref.sync import sync_to_async
+from adrf.views import APIView as AsyncAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 
-from .models import Notification
-from .serializers import NotificationSerializer, NotificationStatsSerializer
-from .services.delivery import NotificationDeliveryService
-from .services.rate_limiter import PriorityBasedRateThrottle
+from .models import ArchivedNotification, Notification
+from .pagination import NotificationKeysetPagination
+from .serializers import (
+    NotificationSerializer,
+    NotificationBulkCreateSerializer,
+    NotificationBulkMarkReadSerializer,
+    NotificationStatsSerializer,
+)
+from .services.archive import NotificationArchiveService
+from .services.bulk import BulkNotificationService
+from .services.counters import UnreadCounterService
+from .services.delivery import AsyncNotificationDeliveryService
+from .services.rate_limiter import NotificationRateThrottle, PriorityBasedRateThrottle
+from .services.reads import NotificationReadService
+from .services.rollups import StatsRollupService
+from .services.stats import NotificationStatsService
+from .services.tracking import NotificationStateTracker
 from .middleware.metrics import notifications_created_total
 
 logger = logging.getLogger(__name__)
 
 
-class NotificationListCreateView(APIView):
+class NotificationListCreateView(AsyncAPIView):
+    """
+    Async view so that creation and delivery run on the ASGI event loop.
+    Listing still goes through the sync ORM and paginator in a worker thread.
+    """
+
     permission_classes = [IsAuthenticated]
     throttle_classes = [PriorityBasedRateThrottle]
 
-    def get(self, request):
-        queryset = Notification.objects.select_related("user").all()
+    async def get(self, request):
+        return await sync_to_async(self.list)(request)
+
+    def list(self, request):
+        queryset = self.filter_notifications(
+            Notification.objects.select_related("user"), request
+        )
+        archive = None
+        if NotificationArchiveService.reaches_archive(
+            request.query_params.get("date_from")
+        ):
+            archive = self.filter_notifications(
+                ArchivedNotification.objects.select_related("user"), request
+            )
 
+        paginator = NotificationKeysetPagination()
+        paginated_queryset = paginator.paginate_queryset(
+            queryset, request, archive=archive
+        )
+        serializer = NotificationSerializer(paginated_queryset, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def filter_notifications(self, queryset, request):
         status_filter = request.query_params.get("status")
         if status_filter:
             queryset = queryset.filter(status=status_filter)
@@ -42,16 +82,15 @@ class NotificationListCreateView(APIView):
         if date_to:
             queryset = queryset.filter(created_at__lte=date_to)
 
-        paginator = PageNumberPagination()
-        paginator.page_size = 50
-        paginated_queryset = paginator.paginate_queryset(queryset, request)
-        serializer = NotificationSerializer(paginated_queryset, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return queryset
 
-    def post(self, request):
+    async def post(self, request):
         serializer = NotificationSerializer(data=request.data)
         if serializer.is_valid():
-            notification = serializer.save(user=request.user)
+            # asave() rather than acreate(), which would go through save()
+            notification = Notification(user=request.user, **serializer.validated_data)
+            await notification.asave()
+            data = NotificationSerializer(notification).data
 
             notifications_created_total.labels(
                 priority=notification.priority, channel=notification.channel
@@ -67,16 +106,36 @@ class NotificationListCreateView(APIView):
                 },
             )
 
-            NotificationDeliveryService.deliver(notification, serializer.data)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            await AsyncNotificationDeliveryService.deliver(notification, data)
+            return Response(data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class NotificationBulkCreateView(APIView):
+    permission_classes = [IsAdminUser]
+    throttle_classes = [NotificationRateThrottle]
+
+    def post(self, request):
+        serializer = NotificationBulkCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        fields = dict(serializer.validated_data)
+        recipients = BulkNotificationService.get_recipients(
+            recipient_ids=fields.pop("recipients", None),
+            recipient_filter=fields.pop("recipient_filter", None),
+        )
+        totals = BulkNotificationService.create_and_deliver(recipients, **fields)
+        return Response(totals, status=status.HTTP_201_CREATED)
+
+
 class NotificationDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        notification = get_object_or_404(Notification, pk=pk)
+        notification = NotificationArchiveService.get(pk)
+        if notification is None:
+            raise Http404
         serializer = NotificationSerializer(notification)
         return Response(serializer.data)
 
@@ -86,7 +145,11 @@ class NotificationDetailView(APIView):
             notification, data=request.data, partial=True
         )
         if serializer.is_valid():
-            serializer.save()
+            before = notification.rollup_state()
+            serializer.save(version=notification.version + 1)
+            NotificationStateTracker.record(
+                [(notification.user_id, before, notification.rollup_state())]
+            )
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -106,11 +169,34 @@ class NotificationMarkReadView(APIView):
         return Response(serializer.data)
 
 
+class NotificationUnreadCountView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(UnreadCounterService.get(request.user.id))
+
+
+class NotificationBulkMarkReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = NotificationBulkMarkReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = NotificationReadService.mark_read(
+            request.user,
+            ids=serializer.validated_data.get("ids"),
+            before=serializer.validated_data.get("before"),
+        )
+        return Response({"updated": updated})
+
+
 class NotificationStatsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        queryset = Notification.objects.select_related("user").all()
+        queryset = Notification.objects.all()
 
         status_filter = request.query_params.get("status")
         if status_filter:
@@ -120,40 +206,20 @@ class NotificationStatsView(APIView):
         if priority_filter:
             queryset = queryset.filter(priority=priority_filter)
 
+        percentiles = request.query_params.get("percentiles") in ("1", "true")
+
         user_filter = request.query_params.get("user")
         if user_filter:
             queryset = queryset.filter(user_id=user_filter)
-
-        total = queryset.count()
-        delivered = queryset.filter(status="delivered").count()
-        read = queryset.filter(status="read").count()
-        failed = queryset.filter(status="failed").count()
-        pending = queryset.filter(status="pending").count()
-
-        delivery_rate = (delivered / total * 100) if total > 0 else 0
-        read_rate = (read / total * 100) if total > 0 else 0
-
-        delivered_notifications = queryset.filter(
-            status__in=["delivered", "read"], delivered_at__isnull=False
-        )
-        avg_latency = 0
-        if delivered_notifications.exists():
-            latencies = [
-                (n.delivered_at - n.created_at).total_seconds()
-                for n in delivered_notifications
-            ]
-            avg_latency = sum(latencies) / len(latencies)
-
-        stats_data = {
-            "total_notifications": total,
-            "delivered_count": delivered,
-            "read_count": read,
-            "failed_count": failed,
-            "pending_count": pending,
-            "delivery_rate": round(delivery_rate, 2),
-            "read_rate": round(read_rate, 2),
-            "avg_delivery_latency": round(avg_latency, 3),
-        }
+            stats_data = NotificationStatsService.compute(
+                queryset, percentiles=percentiles
+            )
+        else:
+            # Rollups answer in constant time; latency percentiles are
+            # estimated from their histogram buckets
+            stats_data = StatsRollupService.read(
+                status=status_filter, priority=priority_filter, percentiles=percentiles
+            )
 
         serializer = NotificationStatsSerializer(stats_data)
         return Response(serializer.data)